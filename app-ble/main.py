@@ -1,8 +1,6 @@
 import sys
-import asyncio
 import numpy as np
 from scipy import fft
-from bleak import BleakScanner, BleakClient
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout,
     QHBoxLayout, QPushButton, QLabel
@@ -13,6 +11,11 @@ import pyqtgraph as pg
 from collections import deque
 from PyQt6.QtCore import QTimer
 import librosa
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from sources import create_source
+from ring_buffer import RollingWindow
 
 
 # BLE
@@ -43,74 +46,45 @@ class DataWorker(QObject):
     def __init__(self):
         super().__init__()
         self._is_running = True
-        self.buffer = b''
-        # asyncioのイベントループを安全に停止させるためのイベント
-        self.disconnected_event = asyncio.Event()
-
-    def notification_handler(self, sender, data: bytearray):
-        self.buffer += data
+        self._connected = False
+        # 前回接続したアドレスへ直接接続し、見つからない場合だけスキャンする
+        self.source = create_source(
+            "ble", name=DEVICE_NAME, characteristic_uuid=CHARACTERISTIC_UUID, frame_bytes=BUFFER_SIZE,
+            on_status=lambda message: self.status_update.emit(f"状態: <font color='blue'><b>{message}</b></font>"),
+            on_connected=self._on_connected,
+            on_error=self._on_error,
+        )
+
+    def _on_connected(self):
+        self._connected = True
+        self.connection_success.emit()
+
+    def _on_error(self, message):
+        # 接続前のエラーは接続失敗、接続後は切断として通知する
+        if self._connected:
+            self.connection_lost.emit(message)
+        else:
+            self.connection_failed.emit(message)
 
-        # 定められたバッファサイズ(1024バイト)に達するまでデータを溜める
-        while len(self.buffer) >= BUFFER_SIZE:
-            data_to_process = self.buffer[:BUFFER_SIZE]
-            self.buffer = self.buffer[BUFFER_SIZE:]
-            
-            # pcm_data = np.frombuffer(data, dtype=DTYPE)
-            pcm_data = np.frombuffer(data_to_process, dtype=DTYPE)
-            if pcm_data.size > 0:
-                normalized_data = pcm_data / 32768.0
+    def run(self):
+        """BLE の受信スレッドを開始し、揃ったフレームをGUIへ渡す"""
+        self.source.start()
+
+        while self._is_running and self.source.running:
+            # NUM_SAMPLES(BUFFER_SIZEバイト)ごとのフレーム (-1.0 ~ 1.0 に正規化済みの float32)
+            frames = self.source.read_frames(NUM_SAMPLES)
+            if frames is None:
+                continue
+            for normalized_data in frames:
                 self.data_ready.emit(normalized_data)
 
-    async def main_ble_loop(self):
-        """BLEデバイスのスキャン、接続、データ受信待機を行うメインループ"""
-        self.status_update.emit("状態: <font color='blue'><b>BLEデバイスを検索中...</b></font>")
-        # device = await BleakScanner.find_device_by_name(DEVICE_NAME, timeout=10.0)
-        devices = await BleakScanner.discover(timeout=5.0)
-        device = None
-        for d in devices:
-            if d.name == DEVICE_NAME:
-                device = d
-                break
-        
-        if not device:
-            self.connection_failed.emit(f"デバイス '{DEVICE_NAME}' が見つかりません。")
-            return
-
-        self.status_update.emit(f"状態: <font color='orange'><b>'{DEVICE_NAME}' に接続中...</b></font>")
-
-        def on_disconnect(client):
-            print("BLE接続が切断されました。")
-            self.disconnected_event.set() # イベントをセットして待機ループを終了させる
-            if self._is_running:
-                self.connection_lost.emit("BLE接続が予期せず切断されました。")
-
-        async with BleakClient(device, disconnected_callback=on_disconnect) as client:
-            if not client.is_connected:
-                self.connection_failed.emit("デバイスへの接続に失敗しました。")
-                return
-            
-            self.connection_success.emit()
-            print("BLE接続成功。通知の受信を開始します。")
-            
-            await client.start_notify(CHARACTERISTIC_UUID, self.notification_handler)
-            
-            # stop()が呼ばれるか、接続が切断されるまでここで待機
-            await self.disconnected_event.wait()
-        
-        print("BLEクライアントの処理が終了しました。")
-
-    def run(self):
-        """Qtスレッドからasyncioのイベントループを開始する"""
-        try:
-            asyncio.run(self.main_ble_loop())
-        except Exception as e:
-            self.connection_failed.emit(f"非同期処理エラー: {e}")
+        self.source.stop()
         print("データ受信スレッドを終了しました。")
 
     def stop(self):
         """データ受信ループの停止を要求する"""
         self._is_running = False
-        self.disconnected_event.set()
+        self.source.stop()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -120,7 +94,7 @@ class MainWindow(QMainWindow):
 
         self.display_mode = 'waveform'
 
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -80.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-80.0)
         self._setup_ui()
         self._init_plots()
 
@@ -172,9 +146,9 @@ class MainWindow(QMainWindow):
 
     def _init_plots(self):
         self.plot_data_size = NUM_SAMPLES * 10
-        self.y_data = np.zeros(self.plot_data_size)
+        self.y_data = RollingWindow(self.plot_data_size)
         self.waveform_pen = pg.mkPen(color=(0, 120, 215), width=2)
-        self.waveform_plot_item = self.plot_widget.plot(self.y_data, pen=self.waveform_pen)
+        self.waveform_plot_item = self.plot_widget.plot(self.y_data.view(), pen=self.waveform_pen)
         
         # FFT
         # self.fft_freqs = fft.rfftfreq(NUM_SAMPLES, 1 / SAMPLE_RATE)
@@ -189,7 +163,7 @@ class MainWindow(QMainWindow):
         self.image_item.setLookupTable(cmap.getLookupTable())
         # dBの最小/最大値を設定 (-60dB から 0dB の範囲で色付け)
         self.image_item.setLevels([-60, 0])        
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self.image_item.hide()
         self._setup_waveform_view()
@@ -309,9 +283,8 @@ class MainWindow(QMainWindow):
         
 
         if self.display_mode == 'waveform':
-            self.y_data[:-NUM_SAMPLES] = self.y_data[NUM_SAMPLES:]
-            self.y_data[-NUM_SAMPLES:] = data_to_plot
-            self.waveform_plot_item.setData(self.y_data)
+            self.y_data.append(data_to_plot)
+            self.waveform_plot_item.setData(self.y_data.view())
             update_end = time.perf_counter()
             elapsed_update = update_end - update_start
 
@@ -332,14 +305,9 @@ class MainWindow(QMainWindow):
             if num_new_frames == 0:
                 return
 
-            if num_new_frames > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num_new_frames = SPECTRO_TIME_STEPS
-
-            self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-            self.spectro_data[:, -num_new_frames:] = S_db
+            self.spectro_data.append(S_db)
             
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
         # else:
         #     processed_data = data_to_plot - np.mean(data_to_plot)
         #     window = np.hanning(len(processed_data))
@@ -377,7 +345,7 @@ class SpectrogramWindow(QWidget):
         self.setGeometry(110, 110, 800, 400) # メインと少しずらす
 
         # --- スペクトログラムの初期化 (MainWindowから移植) ---
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -60.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-60.0)
 
         # --- UIセットアップ ---
         main_layout = QVBoxLayout(self)
@@ -396,7 +364,7 @@ class SpectrogramWindow(QWidget):
         # ★ チューニングしたdB範囲 (ref=1.0 と併用)
         self.image_item.setLevels([-30, 0]) 
         
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
         self._setup_spectrogram_view()
         print("サブのスペクトログラムウィンドウ準備完了")
 
@@ -426,13 +394,9 @@ class SpectrogramWindow(QWidget):
             num_new_frames = S_db.shape[1]
             if num_new_frames == 0:
                 return
-            if num_new_frames > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num_new_frames = SPECTRO_TIME_STEPS
 
-            self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-            self.spectro_data[:, -num_new_frames:] = S_db
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+            self.spectro_data.append(S_db)
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
         except Exception as e:
             print(f"サブスペクトログラム更新エラー: {e}")
 
@@ -1,3 +1,4 @@
+import os
 import sys
 import serial
 import serial.tools.list_ports
@@ -17,9 +18,15 @@ from torch.nn import functional as F
 import pyautogui
 from utils import SimpleCNN, extract_pcen
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from sources import create_source
+from ring_buffer import RollingWindow
+
 # --- 基本設定 ---
 # シリアル通信設定 (GUIで選択可能にします)
 DEFAULT_BAUD_RATE = 2000000 
+# "raw": 生の int16 ストリーム / "sync": 同期ワード付きフレーム (esp_serial.ino の USE_SYNC_FRAMING=1)
+SERIAL_FRAMING = "raw"
 
 # 音声データ設定
 SAMPLE_RATE = 24000
@@ -51,48 +58,41 @@ class SerialWorker(QObject):
         super().__init__()
         self.port = port
         self.baud_rate = baud_rate
-        self.serial_conn = None
         self._is_running = True
+        self._connected = False
+        # 1サンプル2バイト (int16) なので、BUFFER_SIZE * 2 バイトずつのフレームに切り出す
+        self.source = create_source(
+            "serial", port=port, baud_rate=baud_rate, framing=SERIAL_FRAMING, frame_bytes=BUFFER_SIZE * 2,
+            on_connected=self._on_connected,
+            on_error=self._on_error,
+        )
 
-    def run(self):
-        """シリアル接続とデータ受信ループ"""
-        try:
-            self.serial_conn = serial.Serial(self.port, self.baud_rate, timeout=1)
-            self.serial_conn.reset_input_buffer()
-            self.connection_success.emit()
-            print(f"Connected to {self.port} at {self.baud_rate}")
-        except Exception as e:
-            self.connection_failed.emit(f"接続失敗: {e}")
-            return
+    def _on_connected(self):
+        self._connected = True
+        self.connection_success.emit()
 
-        # 1サンプル2バイト (int16) なので、BUFFER_SIZE * 2 バイトずつ読む
-        read_size = BUFFER_SIZE * 2 
-
-        while self._is_running:
-            try:
-                if self.serial_conn.in_waiting >= read_size:
-                    raw_data = self.serial_conn.read(read_size)
-                    
-                    if not raw_data:
-                        continue
-
-                    # バイナリデータをint16に変換
-                    pcm_data = np.frombuffer(raw_data, dtype=DTYPE)
-                    
-                    if pcm_data.size > 0:
-                        # -1.0 ~ 1.0 に正規化
-                        normalized_data = pcm_data / 32768.0
-                        self.data_ready.emit(normalized_data)
-                else:
-                    # データが足りないときは少し待つ（CPU負荷軽減）
-                    self.thread().msleep(1)
-
-            except Exception as e:
-                self.connection_lost.emit(f"受信エラー: {e}")
-                break
-        
-        if self.serial_conn and self.serial_conn.is_open:
-            self.serial_conn.close()
+    def _on_error(self, message):
+        if self._connected:
+            self.connection_lost.emit(message)
+        else:
+            self.connection_failed.emit(f"接続失敗: {message}")
+
+    def run(self):
+        """シリアル受信スレッドを開始し、揃ったフレームをGUIへ渡す"""
+        self.source.start()
+
+        while self._is_running and self.source.running:
+            # BUFFER_SIZEごとのフレーム (-1.0 ~ 1.0 に正規化済みの float32)
+            frames = self.source.read_frames(BUFFER_SIZE)
+            if frames is None:
+                continue
+            for normalized_data in frames:
+                self.data_ready.emit(normalized_data)
+
+        resyncs = self.source.stats().get("resyncs", 0)
+        if resyncs:
+            print(f"フレームの再同期: {resyncs} 回")
+        self.source.stop()
         print("シリアル受信スレッドを終了しました。")
 
     def stop(self):
@@ -107,7 +107,7 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, 1000, 600)
 
         self.display_mode = 'waveform'
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -80.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-80.0)
         
         # モデル読み込み
         # self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -125,7 +125,7 @@ class MainWindow(QMainWindow):
         self.last_confidence = 0.0
         self.overlap_size = N_FFT - HOP_LENGTH
         self.prev_audio_main = np.zeros(self.overlap_size, dtype=np.float32)
-        self.full_audio_buffer = deque(np.zeros(SAMPLE_SIZE_FOR_INFERENCE, dtype=np.float32), maxlen=SAMPLE_SIZE_FOR_INFERENCE)
+        self.full_audio_buffer = RollingWindow(SAMPLE_SIZE_FOR_INFERENCE)
         self.current_gesture_status = "認識: N/A"
 
         self.worker = None
@@ -212,9 +212,9 @@ class MainWindow(QMainWindow):
 
         # 波形用
         self.plot_data_size = BUFFER_SIZE * 10
-        self.y_data = np.zeros(self.plot_data_size)
+        self.y_data = RollingWindow(self.plot_data_size)
         self.waveform_pen = pg.mkPen(color=(0, 120, 215), width=2)
-        self.waveform_plot_item = self.plot_widget.plot(self.y_data, pen=self.waveform_pen)
+        self.waveform_plot_item = self.plot_widget.plot(self.y_data.view(), pen=self.waveform_pen)
         
         # スペクトログラム用
         self.image_item = pg.ImageItem()
@@ -222,7 +222,7 @@ class MainWindow(QMainWindow):
         cmap = pg.colormap.get('viridis')
         self.image_item.setLookupTable(cmap.getLookupTable())
         self.image_item.setLevels([-60, 0])        
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self.image_item.hide()
         self._setup_waveform_view()
@@ -312,7 +312,7 @@ class MainWindow(QMainWindow):
 
     def queue_data(self, new_data):
         self.data_buffer.append(new_data)
-        self.full_audio_buffer.extend(new_data)
+        self.full_audio_buffer.append(new_data)
 
     def triggered_update_plot(self):
         if not self.data_buffer:
@@ -324,9 +324,8 @@ class MainWindow(QMainWindow):
             self.spectro_window.update_plot(data_to_plot)
 
         if self.display_mode == 'waveform':
-            self.y_data[:-len(data_to_plot)] = self.y_data[len(data_to_plot):]
-            self.y_data[-len(data_to_plot):] = data_to_plot
-            self.waveform_plot_item.setData(self.y_data)
+            self.y_data.append(data_to_plot)
+            self.waveform_plot_item.setData(self.y_data.view())
         else:
             # スペクトログラム計算 (簡易版)
             combined_y = np.concatenate((self.prev_audio_main, data_to_plot))
@@ -340,13 +339,8 @@ class MainWindow(QMainWindow):
 
             num_new_frames = S_db.shape[1]
             if num_new_frames > 0:
-                if num_new_frames > SPECTRO_TIME_STEPS:
-                    S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                    num_new_frames = SPECTRO_TIME_STEPS
-
-                self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-                self.spectro_data[:, -num_new_frames:] = S_db
-                self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+                self.spectro_data.append(S_db)
+                self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
 
     # def _run_inference(self):
     #     current_time = time.time()
@@ -354,7 +348,7 @@ class MainWindow(QMainWindow):
     #         self._update_gesture_display(f"{self.last_recognized_gesture} (Hold)", color="#FF0000")
     #         return
             
-    #     y_samples = np.array(self.full_audio_buffer)
+    #     y_samples = self.full_audio_buffer.view()
     #     # PCEN特徴量抽出 (utils.pyの実装に依存)
     #     try:
     #         input_tensor = extract_pcen(y_samples).to(self.device)
@@ -423,7 +417,7 @@ class SpectrogramWindow(QWidget):
         super().__init__()
         self.setWindowTitle("ヒートマップ (Sub Window)")
         self.setGeometry(110, 110, 800, 400) 
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -60.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-60.0)
         main_layout = QVBoxLayout(self)
         pg.setConfigOptions(antialias=True)
         self.plot_widget = pg.PlotWidget()
@@ -434,7 +428,7 @@ class SpectrogramWindow(QWidget):
         cmap = pg.colormap.get('viridis')
         self.image_item.setLookupTable(cmap.getLookupTable())
         self.image_item.setLevels([-30, 0]) 
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
         self.overlap_size = N_FFT - HOP_LENGTH
         self.prev_audio_sub = np.zeros(self.overlap_size, dtype=np.float32)
         self._setup_view()
@@ -458,12 +452,8 @@ class SpectrogramWindow(QWidget):
             S_db = librosa.power_to_db(S, ref=1.0)
             num = S_db.shape[1]
             if num == 0: return
-            if num > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num = SPECTRO_TIME_STEPS
-            self.spectro_data = np.roll(self.spectro_data, -num, axis=1)
-            self.spectro_data[:, -num:] = S_db
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+            self.spectro_data.append(S_db)
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
         except:
             pass
 
@@ -12,6 +12,15 @@ import torch.nn.functional as F
 import os
 import sys
 import queue
+import wave
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from sources import create_source
+from config import NORM_FACTOR, FLOAT_DTYPE
+from signal_process import STFTFrames
+from activity import ActivityDetector
+from scheduler import InferenceScheduler
+from ring_buffer import RollingWindow
 
 # TCP設定
 ESP_IP = "saw-ring.local" 
@@ -27,7 +36,8 @@ HOP_LENGTH = 256
 N_MELS = 128
 FIXED_WIDTH = 188
 SAMPLE_SIZE_FOR_INFERENCE = int(SR * 2)
-INFERENCE_INTERVAL = 0.35  # 350msごとに推論
+INFERENCE_INTERVAL = 0.35  # 触れている間は350msごとに推論 (受信したサンプル数で数える)
+ONSET_DELAY = int(SR * 0.3)  # 触れ始めからこのサンプル数だけ後の窓で推論する
 CONFIDENCE_THRESHOLD = 0.85
 COOLDOWN_TIME = 1.5
 
@@ -46,62 +56,47 @@ class TCPListener(threading.Thread):
         super().__init__()
         self.data_queue = data_queue
         self._is_running = True
-        self.client = None
+        # 切断・無通信時は自動で再接続する (名前解決の結果はキャッシュされる)
+        self.source = create_source("tcp", host=ESP_IP, port=PORT, frame_bytes=BUFFER_SIZE)
 
     def run(self):
         """TCP接続とデータ受信ループ"""
-        buffer = b''
-        try:
-            print(f"[TCP] 接続中... {ESP_IP}:{PORT}")
-            self.client = socket.create_connection((ESP_IP, PORT), timeout=5)
-            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            print("[TCP] 接続成功。データ受信開始。")
-        except Exception as e:
-            print(f"[ERROR] 接続失敗: {e}")
-            return
-
-        while self._is_running:
-            try:
-                raw_data = self.client.recv(BUFFER_SIZE)
-                if not raw_data:
-                    print("[TCP] 接続が切断されました。")
-                    break
-                
-                buffer += raw_data
-                
-                # BUFFER_SIZEごとに切り出して処理（ユーザーコードのロジックを流用）
-                while len(buffer) >= BUFFER_SIZE:
-                    data_to_process = buffer[:BUFFER_SIZE]
-                    buffer = buffer[BUFFER_SIZE:]
-                    
-                    pcm_data = np.frombuffer(data_to_process, dtype=DTYPE)
-                    
-                    if pcm_data.size > 0:
-                        # -1.0 ~ 1.0 に正規化し、Queueに格納
-                        normalized_data = pcm_data / 32768.0
-                        self.data_queue.put(normalized_data)
-
-            except socket.timeout:
+        self.source.start()
+        while self._is_running and self.source.running:
+            # BUFFER_SIZEごとのフレーム (-1.0 ~ 1.0 に正規化済みの float32) を Queue に格納
+            frames = self.source.read_frames(BUFFER_SIZE // np.dtype(DTYPE).itemsize)
+            if frames is None:
                 continue
-            except Exception as e:
-                if self._is_running:
-                     print(f"[ERROR] 受信エラー: {e}")
-                break
-            
-        if self.client:
-            self.client.close()
+            for normalized_data in frames:
+                self.data_queue.put(normalized_data)
+
+        self.source.stop()
         print("[TCP] データ受信スレッドを終了しました。")
 
     def stop(self):
         self._is_running = False
-        if self.client:
-            # 接続を切断してrecvを強制終了
-            try:
-                self.client.shutdown(socket.SHUT_RDWR)
-            except OSError:
-                pass
-
-def main_inference_engine():
+        # 接続を切断して recv・再接続待ちを強制終了
+        self.source.stop()
+
+def live_chunks(data_queue):
+    """TCP で受信したフレームを順に返す"""
+    while True:
+        try:
+            yield data_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+def replay_chunks(path):
+    """録音済み WAV (16bit) を受信フレームと同じ大きさで返す (待たずに流すので実時間より速い)"""
+    with wave.open(path, "rb") as wf:
+        channels = wf.getnchannels()
+        while True:
+            raw = wf.readframes(BUFFER_SIZE // np.dtype(DTYPE).itemsize)
+            if not raw:
+                return
+            yield np.frombuffer(raw, dtype=DTYPE)[::channels].astype(FLOAT_DTYPE) / NORM_FACTOR
+
+def main_inference_engine(replay_path=None):
     # --- 初期設定 ---
     data_queue = queue.Queue()
     
@@ -114,72 +109,94 @@ def main_inference_engine():
     model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
     model.eval()
 
-    # リングバッファ（2.5秒分の音声サンプルを溜める）
-    global_buffer = deque(np.zeros(SAMPLE_SIZE_FOR_INFERENCE, dtype=np.float32), maxlen=SAMPLE_SIZE_FOR_INFERENCE)
-    
-    # リスナースレッド起動
-    listener = TCPListener(data_queue)
-    listener.start()
+    # 推論の特徴量は学習時と同じく 2 秒分の生サンプルから utils.extract_pcen で窓ごとに作る
+    # (スケジューラの窓を取り出せるよう 0.5 秒分多く残す)
+    audio_window = RollingWindow(SAMPLE_SIZE_FOR_INFERENCE + SR // 2)
+    # STFT は触れているかの検出だけに使う
+    stft = STFTFrames(n_fft=N_FFT, hop_length=HOP_LENGTH)
+    # 指が触れていない (idle) 間は推論しない
+    activity = ActivityDetector(hop_length=HOP_LENGTH, sr=SR)
+    # 推論のタイミングは受信したサンプル数で決める (触れ始めから ONSET_DELAY 後 + 定期実行)
+    # 時計を使わないので、同じ録音を再生すれば同じ判定になる
+    scheduler = InferenceScheduler(interval=INFERENCE_INTERVAL, onset_delay=ONSET_DELAY,
+                                   hop_length=HOP_LENGTH, sr=SR)
+
+    # リスナースレッド起動 (再生時は使わない)
+    listener = None
+    if replay_path:
+        chunks = replay_chunks(replay_path)
+    else:
+        listener = TCPListener(data_queue)
+        listener.start()
+        chunks = live_chunks(data_queue)
     
-    last_inference_time = 0
-    last_action_time = 0
+    last_action_time = -COOLDOWN_TIME
 
-    print(f"\n=== Real-time Inference Engine Started (Interval: {INFERENCE_INTERVAL}s) ===")
+    print(f"\n=== Real-time Inference Engine Started (Interval: {INFERENCE_INTERVAL}s, Onset delay: {ONSET_DELAY} samples) ===")
     print("Listening for gestures...")
     
     try:
-        while True:
-            # Queueから新しいデータをすべて取り出し、グローバルバッファに追加
-            while not data_queue.empty():
-                new_chunk = data_queue.get()
-                global_buffer.extend(new_chunk)
+        for new_chunk in chunks:
+            audio_window.append(new_chunk)
+            magnitude = stft.push(new_chunk)
+            activity.push_frames(magnitude)
+            scheduler.push_frames(0 if magnitude is None else magnitude.shape[1], activity.pop_onsets())
 
-            current_time = time.time()
-            
             # --- 判定サイクルチェック ---
-            if current_time - last_inference_time < INFERENCE_INTERVAL:
-                time.sleep(0.01)
-                continue
+            due = scheduler.poll()
+            while due is not None:
+                reason, end = due
+                due = scheduler.poll()
+                current_time = scheduler.time   # ストリーム上の時刻 (秒)
 
-            last_inference_time = current_time
+                # --- クールダウンチェック ---
+                if current_time - last_action_time < COOLDOWN_TIME:
+                    print(f"[INFO] Cooldown... Remaining: {COOLDOWN_TIME - (current_time - last_action_time):.1f}s", end='\r')
+                    continue
 
-            # --- クールダウンチェック ---
-            if current_time - last_action_time < COOLDOWN_TIME:
-                print(f"[INFO] Cooldown... Remaining: {COOLDOWN_TIME - (current_time - last_action_time):.1f}s", end='\r')
-                continue
+                # --- 待機中 (idle) チェック ---
+                if not activity.should_run(force=(reason == "onset")):
+                    print(f"[INFO] Idle... (推論 {activity.inference_skipped} 回をスキップ)", end='\r')
+                    continue
 
-            # --- 推論実行 ---
-            
-            # 1. バッファ全体を抽出（2.5秒）
-            y_samples = np.array(global_buffer)
-            input_tensor = extract_pcen(y_samples).to(device)
-            
-            # 2. 推論
-            with torch.no_grad():
-                outputs = model(input_tensor)
-                probs = F.softmax(outputs, dim=1).squeeze().cpu().numpy()
+                # --- 推論実行 ---
                 
-            label_idx = np.argmax(probs)
-            confidence = probs[label_idx]
-            label_name = LABELS[label_idx]
-
-            # 3. アクション判定と実行
-            if confidence > CONFIDENCE_THRESHOLD and label_name != LABELS[0]:
-                key = KEY_MAPPING.get(label_name)
+                # 1. スケジューラが決めた窓 (end フレームの位置までの2秒) を抽出
+                y_samples = audio_window.latest_until(SAMPLE_SIZE_FOR_INFERENCE, end * HOP_LENGTH)
+                input_tensor = extract_pcen(y_samples).to(device)
                 
-                if key:
-                    pyautogui.press(key)
-                    last_action_time = current_time
-                    print(f"\n[ACTION] {label_name} ({confidence:.2f}) -> Key: '{key}'")
-            else:
-                # ノイズ判定をリアルタイムで表示 (上書き)
-                print(f"[INFO] Current: {label_name} ({confidence:.2f})", end='\r')
+                # 2. 推論
+                with torch.no_grad():
+                    outputs = model(input_tensor)
+                    probs = F.softmax(outputs, dim=1).squeeze().cpu().numpy()
+                    
+                label_idx = np.argmax(probs)
+                confidence = probs[label_idx]
+                label_name = LABELS[label_idx]
+
+                # 3. アクション判定と実行
+                if confidence > CONFIDENCE_THRESHOLD and label_name != LABELS[0]:
+                    key = KEY_MAPPING.get(label_name)
+                    
+                    if key:
+                        last_action_time = current_time
+                        if replay_path:
+                            print(f"[REPLAY] {current_time:7.2f}s ({reason}) {label_name} ({confidence:.2f}) -> Key: '{key}'")
+                        else:
+                            pyautogui.press(key)
+                            print(f"\n[ACTION] {label_name} ({confidence:.2f}) -> Key: '{key}'")
+                else:
+                    # ノイズ判定をリアルタイムで表示 (上書き)
+                    print(f"[INFO] Current: {label_name} ({confidence:.2f})", end='\r')
                 
     except KeyboardInterrupt:
         print("\n[SYSTEM] ユーザーによって停止されました。")
     finally:
-        listener.stop()
-        listener.join()
+        print(f"\n[SYSTEM] 推論 {activity.inference_run} 回 (onset {scheduler.fired['onset']} 回), "
+              f"idle でスキップ {activity.inference_skipped} 回 ({activity.saved_ratio * 100:.0f}% 削減)")
+        if listener:
+            listener.stop()
+            listener.join()
 
 if __name__ == '__main__':
     # モデルの重みファイルが存在するか確認
@@ -188,7 +205,11 @@ if __name__ == '__main__':
         sys.exit(1)
         
     import os # ここでosをインポート (pyqtの後に書くと上書きされないため)
-    main_inference_engine()
+    # python app.py replay <WAV>: 録音を実時間より速く流し、キーを押さずに判定だけを表示する
+    if len(sys.argv) == 3 and sys.argv[1] == "replay":
+        main_inference_engine(replay_path=sys.argv[2])
+    else:
+        main_inference_engine()
 
 
 # class GestureController:
@@ -17,6 +17,13 @@ import os
 from utils import SimpleCNN, extract_pcen
 import pyautogui
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from sources import create_source
+from ring_buffer import RollingWindow
+from signal_process import STFTFrames
+from activity import ActivityDetector
+from scheduler import InferenceScheduler
+
 # --- 基本設定 ---
 # TCP接続設定
 ESP_IP = "saw-ring.local" 
@@ -36,7 +43,8 @@ N_MELS = 128
 FIXED_WIDTH = 188
 SAMPLE_SIZE_FOR_INFERENCE = int(SAMPLE_RATE * 2)
 
-INFERENCE_INTERVAL = 100  # 350msごとに推論
+INFERENCE_INTERVAL = 100  # 触れている間の定期的な推論の間隔 (ms, 受信したサンプル数で数える)
+ONSET_DELAY = int(SAMPLE_RATE * 0.5)  # 触れ始めからこのサンプル数だけ後の窓で推論する
 CONFIDENCE_THRESHOLD = 0.60
 COOLDOWN_TIME = 3.0
 
@@ -48,63 +56,46 @@ MODEL_PATH = "../controller/cnn_model_weights_update.pth"
 # --- データ受信を専門に行うWorkerクラス (TCP版) ---
 class DataWorker(QObject):
     data_ready = pyqtSignal(np.ndarray)
-    connection_failed = pyqtSignal(str)
     connection_lost = pyqtSignal(str)
     connection_success = pyqtSignal()
+    reconnecting = pyqtSignal(str)
+    reconnected = pyqtSignal(float)
 
     def __init__(self):
         super().__init__()
-        self.client = None
         self._is_running = True
+        # 切断・無通信時は自動で再接続する (名前解決の結果はキャッシュされる)
+        self.source = create_source(
+            "tcp", host=ESP_IP, port=PORT, frame_bytes=BUFFER_SIZE,
+            on_connected=self._on_connected,
+            on_status=self.reconnecting.emit,
+            on_error=self.connection_lost.emit,
+        )
+
+    def _on_connected(self):
+        self.connection_success.emit()
+        tcp = self.source.tcp
+        if tcp.connects > 1:
+            self.reconnected.emit(tcp.last_reconnect_time)
 
     def run(self):
         """TCP接続とデータ受信ループ"""
-        buffer = b''
-        try:
-            # 接続タイムアウトを少し長めに設定
-            self.client = socket.create_connection((ESP_IP, PORT), timeout=5)
-            # Nagleアルゴリズムを無効化（遅延対策）
-            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.connection_success.emit()
-        except Exception as e:
-            self.connection_failed.emit(f"接続失敗: {e}")
-            return
+        self.source.start()
 
-        while self._is_running:
-            try:
-                # データ受信
-                raw_data = self.client.recv(BUFFER_SIZE)
-                # raw_data = self.client.recv(BUFFER_SIZE * 4)
-                if not raw_data:
-                    self.connection_lost.emit("接続が相手方から切断されました。")
-                    break
-                
-                buffer += raw_data
-                
-                # BUFFER_SIZEごとに切り出して処理
-                while len(buffer) >= BUFFER_SIZE:
-                    data_to_process = buffer[:BUFFER_SIZE]
-                    buffer = buffer[BUFFER_SIZE:]
-                    
-                    pcm_data = np.frombuffer(data_to_process, dtype=DTYPE)
-                    
-                    if pcm_data.size > 0:
-                        # -1.0 ~ 1.0 に正規化
-                        normalized_data = pcm_data / 32768.0
-                        self.data_ready.emit(normalized_data)
-
-            except socket.timeout:
-                continue 
-            except Exception as e:
-                self.connection_lost.emit(f"受信エラー: {e}")
-                break
-        
-        if self.client:
-            self.client.close()
+        while self._is_running and self.source.running:
+            # NUM_SAMPLESごとのフレーム (-1.0 ~ 1.0 に正規化済みの float32)
+            frames = self.source.read_frames(NUM_SAMPLES)
+            if frames is None:
+                continue
+            for normalized_data in frames:
+                self.data_ready.emit(normalized_data)
+
+        self.source.stop()
         print("データ受信スレッドを終了しました。")
 
     def stop(self):
         self._is_running = False
+        self.source.stop()
 
 
 # --- メインウィンドウクラス ---
@@ -117,21 +108,28 @@ class MainWindow(QMainWindow):
         self.display_mode = 'waveform'
         
         # スペクトログラム用データバッファ初期化
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -80.0)
-        self.last_action_time = 0
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-80.0)
+        self.last_action_time = -COOLDOWN_TIME
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model = SimpleCNN(num_classes=len(LABELS)).to(self.device)
         self.model.load_state_dict(torch.load(MODEL_PATH, map_location=self.device))
         self.model.eval()
 
-        self.overlap_size = N_FFT - HOP_LENGTH
-        self.prev_audio_main = np.zeros(self.overlap_size, dtype=np.float32)
+        # STFT は受信時に1回だけ計算し、2つのヒートマップと触れているかの検出で共有する
+        self.stft = STFTFrames(n_fft=N_FFT, hop_length=HOP_LENGTH)
+        self.mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS)
+        # 推論の特徴量は学習時と同じく 2 秒分の生サンプルから extract_pcen で窓ごとに作る
+        # (スケジューラの窓を取り出せるよう 0.5 秒分多く残す)
+        self.full_audio_buffer = RollingWindow(SAMPLE_SIZE_FOR_INFERENCE + SAMPLE_RATE // 2)
+        # 指が触れていない (idle) 間は推論しない
+        self.activity = ActivityDetector(hop_length=HOP_LENGTH, sr=SAMPLE_RATE)
+        # 推論のタイミングは受信したサンプル数で決める (触れ始めから ONSET_DELAY 後 + 定期実行)
+        self.scheduler = InferenceScheduler(interval=INFERENCE_INTERVAL / 1000, onset_delay=ONSET_DELAY,
+                                            hop_length=HOP_LENGTH, sr=SAMPLE_RATE)
 
         self.current_gesture_status = "認識: N/A (接続前)"
         self.last_recognized_gesture = "None"
 
-        self.full_audio_buffer = deque(np.zeros(SAMPLE_SIZE_FOR_INFERENCE, dtype=np.float32), maxlen=SAMPLE_SIZE_FOR_INFERENCE)
-
         self._setup_ui()
         self._init_plots()
 
@@ -148,10 +146,6 @@ class MainWindow(QMainWindow):
         self.plot_timer.setInterval(16)  # 約60fps
         self.plot_timer.timeout.connect(self.triggered_update_plot)
 
-        self.inference_timer = QTimer(self)
-        self.inference_timer.setInterval(INFERENCE_INTERVAL)
-        self.inference_timer.timeout.connect(self._run_inference)
-
     def _setup_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -194,9 +188,9 @@ class MainWindow(QMainWindow):
         self.plot_widget.addItem(self.gesture_label)
         # 波形プロット用
         self.plot_data_size = NUM_SAMPLES * 10
-        self.y_data = np.zeros(self.plot_data_size)
+        self.y_data = RollingWindow(self.plot_data_size)
         self.waveform_pen = pg.mkPen(color=(0, 120, 215), width=2)
-        self.waveform_plot_item = self.plot_widget.plot(self.y_data, pen=self.waveform_pen)
+        self.waveform_plot_item = self.plot_widget.plot(self.y_data.view(), pen=self.waveform_pen)
         
         # スペクトログラム用 (ImageItem)
         self.image_item = pg.ImageItem()
@@ -204,7 +198,7 @@ class MainWindow(QMainWindow):
         cmap = pg.colormap.get('viridis')
         self.image_item.setLookupTable(cmap.getLookupTable())
         self.image_item.setLevels([-60, 0])        
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self.image_item.hide()
         self._setup_waveform_view()
@@ -253,14 +247,20 @@ class MainWindow(QMainWindow):
         self.spectro_window.show()
         
         self.data_buffer.clear()
+        self.stft.reset()
+        self.full_audio_buffer.reset()
+        self.activity.reset()
+        self.scheduler.reset()
+        self.last_action_time = -COOLDOWN_TIME
         self.thread = QThread()
         self.worker = DataWorker()
         self.worker.moveToThread(self.thread)
 
         self.worker.data_ready.connect(self.queue_data)
         self.worker.connection_success.connect(self._on_connection_success)
-        self.worker.connection_failed.connect(self._on_connection_failed)
         self.worker.connection_lost.connect(self._on_connection_lost)
+        self.worker.reconnecting.connect(self._on_reconnecting)
+        self.worker.reconnected.connect(self._on_reconnected)
         
         self.thread.started.connect(self.worker.run)
         self.thread.finished.connect(self.thread.deleteLater)
@@ -268,13 +268,11 @@ class MainWindow(QMainWindow):
         self.thread.start()
 
         self.plot_timer.start()
-        self.inference_timer.start()
         self.start_button.setEnabled(False)
         self.status_label.setText("状態: <font color='orange'><b>接続中...</b></font>")
 
     def stop_plotting(self):
         self.plot_timer.stop()
-        self.inference_timer.stop()
         if self.worker:
             self.worker.stop()
         if self.thread:
@@ -290,8 +288,16 @@ class MainWindow(QMainWindow):
         self.status_label.setText("状態: <font color='red'><b>切断</b></font>")
 
     def queue_data(self, new_data):
-        self.data_buffer.append(new_data)
-        self.full_audio_buffer.extend(new_data)
+        self.full_audio_buffer.append(new_data)
+        magnitude = self.stft.push(new_data)
+        self.activity.push_frames(magnitude)
+        self.data_buffer.append((new_data, magnitude))
+
+        self.scheduler.push_frames(0 if magnitude is None else magnitude.shape[1], self.activity.pop_onsets())
+        due = self.scheduler.poll()
+        while due is not None:
+            self._run_inference(*due)
+            due = self.scheduler.poll()
     
     def _update_gesture_display(self, text, color='#0078D4'):
         """ジェスチャー認識結果を画面上部のラベルに反映させる"""
@@ -309,53 +315,42 @@ class MainWindow(QMainWindow):
         if not self.data_buffer:
             return
 
-        data_to_plot = self.data_buffer.popleft()
+        data_to_plot, magnitude = self.data_buffer.popleft()
+
+        # 共有の振幅スペクトルからメルスペクトログラム (パワー, dB) を1回だけ計算する
+        S_db = None
+        if magnitude is not None:
+            S_db = librosa.power_to_db(self.mel_basis @ magnitude**2, ref=1.0)
 
         # サブウィンドウにもデータを送る
-        if self.spectro_window:
-            self.spectro_window.update_plot(data_to_plot)
+        if self.spectro_window and S_db is not None:
+            self.spectro_window.update_plot(S_db)
 
         if self.display_mode == 'waveform':
-            self.y_data[:-NUM_SAMPLES] = self.y_data[NUM_SAMPLES:]
-            self.y_data[-NUM_SAMPLES:] = data_to_plot
-            self.waveform_plot_item.setData(self.y_data)
+            self.y_data.append(data_to_plot)
+            self.waveform_plot_item.setData(self.y_data.view())
         else:
-            combined_y = np.concatenate((self.prev_audio_main, data_to_plot))
-            self.prev_audio_main = data_to_plot[-self.overlap_size:]
-            # librosaでメルスペクトログラム計算
-            S = librosa.feature.melspectrogram(
-                y=combined_y, 
-                sr=SAMPLE_RATE, 
-                n_fft=N_FFT, 
-                hop_length=HOP_LENGTH, 
-                n_mels=N_MELS,
-                center = False
-            )
-            S_db = librosa.power_to_db(S, ref=1.0)
-
-            num_new_frames = S_db.shape[1]
-            if num_new_frames == 0:
+            if S_db is None:
                 return
-
-            if num_new_frames > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num_new_frames = SPECTRO_TIME_STEPS
-
-            self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-            self.spectro_data[:, -num_new_frames:] = S_db
+            self.spectro_data.append(S_db)
             
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
-    def _run_inference(self):
-        """推論タイマーから呼ばれるリアルタイム判定処理"""
-        current_time = time.time()
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
+    def _run_inference(self, reason, end):
+        """スケジューラが決めた窓 (end フレームまで) でのリアルタイム判定処理 (時刻は受信したサンプル数で測る)"""
+        current_time = self.scheduler.time
         # クールダウン中なら何もしない (UIは更新する)
         if current_time - self.last_action_time < COOLDOWN_TIME:
             self._update_gesture_display(f"{self.last_recognized_gesture} ({self.last_confidence * 100:.2f}%)", color="#000000")
             self.status_label.setText(f"状態: 稼働中 / 認識: <font color='red'><b>HOLDING!</b></font>")
             return
             
-        # 1. 特徴量抽出とTensor化
-        y_samples = np.array(self.full_audio_buffer)
+        if not self.activity.should_run(force=(reason == "onset")):
+            self._update_gesture_display("idle", color="#888888")
+            self.status_label.setText("状態: 稼働中 / 認識: <font color='gray'><b>待機中</b></font>")
+            return
+
+        # 1. 特徴量抽出とTensor化 (end フレームの位置までの2秒)
+        y_samples = self.full_audio_buffer.latest_until(SAMPLE_SIZE_FOR_INFERENCE, end * HOP_LENGTH)
         input_tensor = extract_pcen(y_samples).to(self.device)
         
         # 2. 推論
@@ -429,9 +424,11 @@ class MainWindow(QMainWindow):
         self.toggle_button.setEnabled(True)
         self.status_label.setText("状態: <font color='green'><b>接続成功</b></font>")
     
-    def _on_connection_failed(self, message):
-        self.status_label.setText(f"状態: <font color='red'><b>{message}</b></font>")
-        self.start_button.setEnabled(True)
+    def _on_reconnecting(self, message):
+        self.status_label.setText(f"状態: <font color='orange'><b>再接続中... ({message})</b></font>")
+
+    def _on_reconnected(self, reconnect_time):
+        self.status_label.setText(f"状態: <font color='green'><b>再接続成功 ({reconnect_time:.2f} 秒)</b></font>")
 
     def _on_connection_lost(self, message):
         self.status_label.setText(f"状態: <font color='red'><b>{message}</b></font>")
@@ -451,7 +448,7 @@ class SpectrogramWindow(QWidget):
         self.setWindowTitle("ヒートマップ (Sub Window)")
         self.setGeometry(110, 110, 800, 400) 
 
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -60.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-60.0)
 
         main_layout = QVBoxLayout(self)
         pg.setConfigOptions(antialias=True)
@@ -466,10 +463,7 @@ class SpectrogramWindow(QWidget):
         self.image_item.setLookupTable(cmap.getLookupTable())
         
         self.image_item.setLevels([-30, 0]) 
-        self.image_item.setImage(self.spectro_data.T)
-
-        self.overlap_size = N_FFT - HOP_LENGTH
-        self.prev_audio_sub = np.zeros(self.overlap_size, dtype=np.float32)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self._setup_spectrogram_view()
 
@@ -483,30 +477,13 @@ class SpectrogramWindow(QWidget):
         self.plot_widget.setYRange(0, N_MELS)
         self.plot_widget.showGrid(x=False, y=False)
 
-    def update_plot(self, data_to_plot: np.ndarray):
+    def update_plot(self, S_db: np.ndarray):
+        """メインウィンドウで計算したメルスペクトログラム (dB) の新しいフレームを追加する"""
         try:
-            combined_y = np.concatenate((self.prev_audio_sub, data_to_plot))
-            self.prev_audio_sub = data_to_plot[-self.overlap_size:]
-            S = librosa.feature.melspectrogram(
-                y=combined_y, 
-                sr=SAMPLE_RATE, 
-                n_fft=N_FFT, 
-                hop_length=HOP_LENGTH, 
-                n_mels=N_MELS,
-                center=False
-            )
-            S_db = librosa.power_to_db(S, ref=1.0) 
-            
-            num_new_frames = S_db.shape[1]
-            if num_new_frames == 0:
+            if S_db.shape[1] == 0:
                 return
-            if num_new_frames > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num_new_frames = SPECTRO_TIME_STEPS
-
-            self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-            self.spectro_data[:, -num_new_frames:] = S_db
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+            self.spectro_data.append(S_db)
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
         except Exception as e:
             print(f"サブスペクトログラム更新エラー: {e}")
 
@@ -5,7 +5,7 @@ import threading
 import os
 import time
 from collections import deque
-import socket
+import sys
 import re
 import numpy as np
 import matplotlib.pyplot as plt
@@ -13,6 +13,9 @@ import wave
 
 from utils import *
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from sources import create_source
+
 # udp config 
 FORMAT = pyaudio.paInt16
 CHANNELS = 1             
@@ -39,7 +42,7 @@ class AudioDataCollector:
 
         self.is_collecting_active = False 
         self.is_recording = False
-        self.socket = None
+        self.source = None
         self.receive_thread = None
 
         # udp
@@ -80,10 +83,10 @@ class AudioDataCollector:
         if self.is_collecting_active:
             return
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 4)
-            self.socket.bind((UDP_IP, PORT))
-            self.socket.settimeout(1.0)
+            self.source = create_source("udp", port=PORT, sock_buf_size=1024 * 1024 * 4)
+            self.source.start()
+            if not self.source.running:
+                raise OSError(f"UDPポート {PORT} を開けませんでした")
 
             self.mac_stream = self.p.open(
                 format=MAC_FORMAT,
@@ -114,17 +117,16 @@ class AudioDataCollector:
             print(f"Error: {e}")
 
     def receive_pcm_data(self):
-        while self.is_collecting_active:
-            try:
-                data, _ = self.socket.recvfrom(BUFFER_SIZE * 2)
+        source = self.source
+        while self.is_collecting_active and source.running:
+            frames = source.read_frames(BUFFER_SIZE, timeout=1.0, scale=None)
+            if frames is None:
+                continue
+            for frame in frames:
+                data = frame.tobytes()
                 self.stream_buffer.append(data)
                 if self.is_recording:
                     self.recorded_chunks.append(data)
-            except socket.timeout:
-                continue
-            except Exception as e:
-                print(f"受信エラー: {e}")
-                break
 
     def mac_audio_callback(self, in_data, frame_count, time_info, status):
         """ Macマイク入力用コールバック """
@@ -230,10 +232,10 @@ class AudioDataCollector:
         self.is_collecting_active = False
         self.is_recording = False
         
-        # ソケットを閉じる
-        if self.socket:
-            self.socket.close()
-            self.socket = None
+        # 受信ソースを止める
+        if self.source:
+            self.source.stop()
+            self.source = None
         
         # mac streamを閉じる
         if self.mac_stream:
@@ -260,8 +262,8 @@ class AudioDataCollector:
         self.is_collecting_active = False
         self.is_recording = False
         
-        if self.socket:
-            self.socket.close()
+        if self.source:
+            self.source.stop()
             
         if self.receive_thread and self.receive_thread.is_alive():
             self.receive_thread.join(timeout=1.0)
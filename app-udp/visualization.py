@@ -1,5 +1,5 @@
+import os
 import sys
-import socket
 import numpy as np
 import librosa
 from PyQt6.QtWidgets import (
@@ -10,9 +10,15 @@ from PyQt6.QtCore import QThread, pyqtSignal, QObject, QTimer
 import pyqtgraph as pg
 from collections import deque
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from sources import create_source
+from ring_buffer import RollingWindow
+
 # Configuration
 UDP_IP = "0.0.0.0" 
 UDP_PORT = 8000    
+# asyncio の受信エンジン (aio ソース, 上限付きバッファ) で受ける。描画が滞った時は古いサンプルから捨てる
+OVERFLOW_POLICY = "drop_oldest"
 
 # Audio Settings
 SAMPLE_RATE = 24000
@@ -32,43 +38,24 @@ class UDPWorker(QObject):
 
     def __init__(self):
         super().__init__()
-        self.sock = None
+        self.source = create_source("aio", port=UDP_PORT, policy=OVERFLOW_POLICY,
+                                    on_status=self.status_update.emit, on_error=self.status_update.emit)
         self._is_running = True
 
     def run(self):
         """UDP listening loop"""
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.bind((UDP_IP, UDP_PORT))
-            # Increase buffer size to prevent packet drops during heavy load
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
-            
-            self.status_update.emit(f"Listening on UDP Port {UDP_PORT}")
-            print(f"Listening on UDP port {UDP_PORT}...")
-            
-        except Exception as e:
-            self.status_update.emit(f"Bind Error: {e}")
-            return
+        self.source.start()
 
-        while self._is_running:
-            try:
-                # Receive data (read slightly more than BUFFER_SIZE to be safe)
-                data, addr = self.sock.recvfrom(BUFFER_SIZE * 4)
-                
-                if not data: continue
+        while self._is_running and self.source.running:
+            # BUFFER_SIZE samples per chunk, already normalized to -1.0 ~ 1.0 (float32)
+            frames = self.source.read_frames(BUFFER_SIZE)
+            if frames is None:
+                continue
+            for normalized_data in frames:
+                self.data_ready.emit(normalized_data)
 
-                # Convert binary data to numpy array
-                pcm_data = np.frombuffer(data, dtype=DTYPE)
-                
-                if pcm_data.size > 0:
-                    # Normalize to -1.0 ~ 1.0 range
-                    normalized_data = pcm_data / 32768.0
-                    self.data_ready.emit(normalized_data)
-
-            except Exception as e:
-                print(f"Receive Error: {e}")
-        
-        if self.sock: self.sock.close()
+        self.source.stop()
+        print(f"[AIO] 読み出しが追いつかず捨てたサンプル: {self.source.stats()['shed_samples']}")
 
     def stop(self):
         self._is_running = False
@@ -84,7 +71,7 @@ class MainWindow(QMainWindow):
         self.display_mode = 'waveform'
         
         # Buffer for spectrogram visualization
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -80.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-80.0)
         self.overlap_size = N_FFT - HOP_LENGTH
         self.prev_audio_main = np.zeros(self.overlap_size, dtype=np.float32)
 
@@ -141,9 +128,9 @@ class MainWindow(QMainWindow):
     def _init_plots(self):
         # Waveform Plot
         self.plot_data_size = SAMPLE_RATE * 2 # Display 2 seconds of data
-        self.y_data = np.zeros(self.plot_data_size)
+        self.y_data = RollingWindow(self.plot_data_size)
         self.waveform_pen = pg.mkPen(color=(0, 120, 215), width=2)
-        self.waveform_plot_item = self.plot_widget.plot(self.y_data, pen=self.waveform_pen)
+        self.waveform_plot_item = self.plot_widget.plot(self.y_data.view(), pen=self.waveform_pen)
         
         # Spectrogram ImageItem
         self.image_item = pg.ImageItem()
@@ -151,7 +138,7 @@ class MainWindow(QMainWindow):
         cmap = pg.colormap.get('viridis')
         self.image_item.setLookupTable(cmap.getLookupTable())
         self.image_item.setLevels([-60, 0])        
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self.image_item.hide()
         self._setup_waveform_view()
@@ -249,9 +236,8 @@ class MainWindow(QMainWindow):
                 self.spectro_window.update_plot(data_to_plot)
 
             if self.display_mode == 'waveform':
-                self.y_data[:-len(data_to_plot)] = self.y_data[len(data_to_plot):]
-                self.y_data[-len(data_to_plot):] = data_to_plot
-                self.waveform_plot_item.setData(self.y_data)
+                self.y_data.append(data_to_plot)
+                self.waveform_plot_item.setData(self.y_data.view())
             else:
                 # Calculate Spectrogram
                 combined_y = np.concatenate((self.prev_audio_main, data_to_plot))
@@ -271,13 +257,8 @@ class MainWindow(QMainWindow):
                 if num_new_frames == 0:
                     continue
 
-                if num_new_frames > SPECTRO_TIME_STEPS:
-                    S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                    num_new_frames = SPECTRO_TIME_STEPS
-
-                self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-                self.spectro_data[:, -num_new_frames:] = S_db
-                self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+                self.spectro_data.append(S_db)
+                self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
 
     def closeEvent(self, event):
         self.stop_receiving()
@@ -293,7 +274,7 @@ class SpectrogramWindow(QWidget):
         self.setWindowTitle("Spectrogram (Sub Window)")
         self.setGeometry(110, 110, 800, 400) 
 
-        self.spectro_data = np.full((N_MELS, SPECTRO_TIME_STEPS), -60.0)
+        self.spectro_data = RollingWindow(SPECTRO_TIME_STEPS, shape=(N_MELS,), fill=-60.0)
 
         main_layout = QVBoxLayout(self)
         pg.setConfigOptions(antialias=True)
@@ -308,7 +289,7 @@ class SpectrogramWindow(QWidget):
         self.image_item.setLookupTable(cmap.getLookupTable())
         
         self.image_item.setLevels([-30, 0]) 
-        self.image_item.setImage(self.spectro_data.T)
+        self.image_item.setImage(self.spectro_data.view().T)
 
         self.overlap_size = N_FFT - HOP_LENGTH
         self.prev_audio_sub = np.zeros(self.overlap_size, dtype=np.float32)
@@ -342,13 +323,9 @@ class SpectrogramWindow(QWidget):
             num_new_frames = S_db.shape[1]
             if num_new_frames == 0:
                 return
-            if num_new_frames > SPECTRO_TIME_STEPS:
-                S_db = S_db[:, -SPECTRO_TIME_STEPS:]
-                num_new_frames = SPECTRO_TIME_STEPS
 
-            self.spectro_data = np.roll(self.spectro_data, -num_new_frames, axis=1)
-            self.spectro_data[:, -num_new_frames:] = S_db
-            self.image_item.setImage(self.spectro_data.T, autoLevels=False)
+            self.spectro_data.append(S_db)
+            self.image_item.setImage(self.spectro_data.view().T, autoLevels=False)
         except Exception as e:
             print(f"Spectrogram Update Error: {e}")
 
@@ -7,6 +7,11 @@
 // PC側の受信スクリプトもこのボーレートに合わせてください
 #define SERIAL_BAUD_RATE    2000000 
 
+// 1: 同期ワード付きフレームで送る (PC側は SERIAL_FRAMING = "sync")
+//    0xA5 0x5A | ペイロード長 (uint16 LE) | PCM | チェックサム (ペイロードのバイト和, uint16 LE)
+// 0: 従来どおり PCM をそのまま送る
+#define USE_SYNC_FRAMING    0
+
 // --- I2Sピン設定 (TCP.ino準拠) ---
 #define I2S_PDM_CLK_IO      (GPIO_NUM_3)
 #define I2S_PDM_DIN_IO      (GPIO_NUM_1) 
@@ -80,7 +85,19 @@ void serial_send_task(void *pvParameters) {
     if (xQueueReceive(dataQueue, serial_send_buff, portMAX_DELAY) == pdPASS) {
       // バイナリデータとしてシリアル書き込み
       // Serial.writeはバッファが埋まるとブロックする可能性があるため、Core 0で実行するのが安全
+#if USE_SYNC_FRAMING
+      uint16_t checksum = 0;
+      for (size_t i = 0; i < BUFFER_SIZE; i++) {
+        checksum += serial_send_buff[i];
+      }
+      const uint8_t header[4] = { 0xA5, 0x5A, (uint8_t)(BUFFER_SIZE & 0xFF), (uint8_t)(BUFFER_SIZE >> 8) };
+      const uint8_t trailer[2] = { (uint8_t)(checksum & 0xFF), (uint8_t)(checksum >> 8) };
+      Serial.write(header, sizeof(header));
+      Serial.write(serial_send_buff, BUFFER_SIZE);
+      Serial.write(trailer, sizeof(trailer));
+#else
       Serial.write(serial_send_buff, BUFFER_SIZE);
+#endif
     }
   }
 }
@@ -29,6 +29,20 @@ constexpr int udpPort = 8888;
 IPAddress pcIP(192, 168, 4, 2);
 WiFiUDP udp;
 
+// v2パケット形式 (src/packet.py と合わせる)
+// 1にするとPCMの前にデバイスID・シーケンス番号・サンプル番号を付けて送信する
+#define USE_PACKET_V2 0
+constexpr uint8_t DEVICE_ID = 4;
+
+struct __attribute__((packed)) PacketHeader {
+  char magic[2];          // "SW"
+  uint8_t version;        // 2
+  uint8_t device_id;
+  uint32_t seq;           // パケット番号
+  uint32_t sample_index;  // 先頭サンプルの通し番号
+};
+PacketHeader packet_header = {{'S', 'W'}, 2, DEVICE_ID, 0, 0};
+
 // 受信チャンネル
 int16_t i2s_read_buff[BUFFER_SIZE / sizeof(int16_t)];
 i2s_chan_handle_t rx_handle;
@@ -99,11 +113,17 @@ void loop() {
     // broadcastAddress[3] = 255;
 
     if (udp.beginPacket(pcIP, udpPort)) {
+#if USE_PACKET_V2
+      udp.write((uint8_t*)&packet_header, sizeof(packet_header));
+#endif
       udp.write((uint8_t*)i2s_read_buff, bytes_read);
       udp.endPacket();
     } else {
       // Serial.println("Failed to start UDP");
     }
+    // 送信失敗時も番号は進める (受信側で欠落として扱う)
+    packet_header.seq++;
+    packet_header.sample_index += bytes_read / sizeof(int16_t);
   } else {
     // Serial.printf("I2S Error Code: %d\n", ret);
   }
@@ -6,14 +6,17 @@ import threading
 import os
 import socket
 import time
-import asyncio
-from bleak import BleakScanner, BleakClient
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from sources import create_source
 
 # --- 音声録音の基本設定 ---
 FORMAT = pyaudio.paInt16  # 16ビットPCM
 CHANNELS = 1              # モノラル
 SAMPLE_RATE = 16000       # サンプリングレート
 BUFFER_SIZE = 1024        # 一度に読み込むデータサイズ
+NUM_SAMPLES = BUFFER_SIZE // 2
 
 # --- BLE設定 ---
 DEVICE_NAME = "SAW-Ring"
@@ -59,10 +62,9 @@ class AudioDataCollector:
         # --- PyAudioの初期化（ファイル保存時のパラメータ取得用） ---
         self.p = pyaudio.PyAudio()
         
-        # --- BLEループ制御用 ---
-        self.loop = asyncio.new_event_loop()
+        # --- BLE受信用 ---
+        self.source = None
         self.ble_thread = None
-        self.stop_event = asyncio.Event()
 
         self.root.protocol("WM_DELETE_WINDOW", self.quit_app)
 
@@ -93,8 +95,15 @@ class AudioDataCollector:
             self.start_button.config(state=tk.DISABLED)
             self.status_label.config(text="BLEデバイスを検索中...", fg="orange")
             
-            # BLE通信を別スレッドで開始
-            self.ble_thread = threading.Thread(target=self.run_ble_loop, daemon=True)
+            # BLE通信を別スレッドで開始 (受信データはリングバッファに溜まる)
+            self.source = create_source(
+                "ble", name=DEVICE_NAME, characteristic_uuid=CHARACTERISTIC_UUID, frame_bytes=BUFFER_SIZE,
+                on_status=lambda message: self.root.after(0, lambda: self.status_label.config(text=message, fg="orange")),
+                on_connected=self.on_ble_connected,
+                on_error=self.on_ble_error,
+            )
+            self.source.start()
+            self.ble_thread = threading.Thread(target=self.receive_pcm_data, daemon=True)
             self.ble_thread.start()
 
             # キーバインド設定
@@ -103,62 +112,24 @@ class AudioDataCollector:
             self.root.bind("<Alt_R>", self.on_key_press) # 右Optionキーで録音開始
             self.root.bind("<KeyRelease-Alt_R>", self.on_key_release) # 停止
 
-    def run_ble_loop(self):
-        """非同期ループをスレッド内で回す"""
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_until_complete(self.ble_main())
-
-    async def ble_main(self):
-        """BLEのメイン処理（検索・接続・Notify待機）"""
-        print("BLEスキャン開始...")
-        devices = await BleakScanner.discover(timeout=5.0)
-        device = None
-        for d in devices:
-            if d.name == DEVICE_NAME:
-                device = d
-                break
-        
-        if device is None:
-            print(f"{DEVICE_NAME} が見つかりませんでした。")
-            # (以下変更なし...)
-
-        print(f"接続中: {device.name}")
-        self.root.after(0, lambda: self.status_label.config(text=f"接続中: {device.name}...", fg="orange"))
-
-        disconnected_event = asyncio.Event()
-
-        def disconnect_callback(client):
-            print("BLE切断されました")
-            disconnected_event.set()
-            self.is_ble_connected = False
-            self.root.after(0, lambda: self.status_label.config(text="BLE切断: 再接続待ち...", fg="red"))
-
-        try:
-            async with BleakClient(device, disconnected_callback=disconnect_callback) as client:
-                print(f"接続完了: {client.is_connected}")
-                self.is_ble_connected = True
-                self.root.after(0, lambda: self.status_label.config(text="接続完了: Optionキーで録音", fg="blue"))
-
-                # Notify開始
-                await client.start_notify(CHARACTERISTIC_UUID, self.notification_handler)
-
-                # アプリ終了シグナルか、切断があるまで待機
-                while not self.stop_event.is_set() and client.is_connected:
-                    await asyncio.sleep(0.1)
-
-                # 終了処理
-                if client.is_connected:
-                    await client.stop_notify(CHARACTERISTIC_UUID)
-        except Exception as e:
-            print(f"BLE Error: {e}")
-            self.root.after(0, lambda: self.status_label.config(text=f"エラー: {e}", fg="red"))
-            self.is_collecting_active = False
-
-    def notification_handler(self, sender, data):
-        """BLEからのデータ受信コールバック（常時呼ばれる）"""
-        # 録音中フラグが立っている時だけバッファに追加
-        if self.is_recording:
-            self.audio_buffer.extend(data)
+    def on_ble_connected(self):
+        print("接続完了")
+        self.is_ble_connected = True
+        self.root.after(0, lambda: self.status_label.config(text="接続完了: Optionキーで録音", fg="blue"))
+
+    def on_ble_error(self, message):
+        self.is_ble_connected = False
+        self.is_collecting_active = False
+        self.root.after(0, lambda: self.status_label.config(text=f"エラー: {message}", fg="red"))
+        self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
+
+    def receive_pcm_data(self):
+        """受信ソースからフレームを取り出し、録音中フラグが立っている時だけバッファに追加する"""
+        source = self.source
+        while self.is_collecting_active and source.running:
+            frames = source.read_frames(NUM_SAMPLES, scale=None)
+            if frames is not None and self.is_recording:
+                self.audio_buffer.extend(frames.tobytes())
 
     # --- キーイベント処理 ---
 
@@ -273,8 +244,9 @@ class AudioDataCollector:
         print("アプリがリセットされました（内部変数はクリア）。")
 
     def quit_app(self):
-        # 非同期ループを停止させる
-        self.stop_event.set()
+        # BLE受信を停止させる
+        if self.source:
+            self.source.stop()
         
         # PyAudio終了
         self.p.terminate()
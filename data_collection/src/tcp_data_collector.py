@@ -4,9 +4,12 @@ import pyaudio
 import wave
 import threading
 import os
-import socket
 import time
 import numpy as np
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from sources import create_source
 
 # --- 音声録音の基本設定 ---
 FORMAT = pyaudio.paInt16  # 16ビットPCM
@@ -37,6 +40,8 @@ class AudioDataCollector:
         self.is_recording = False         # Optionキーが押されているか
         self.audio_frames = []            # 録音データを一時保存するバッファ
         self.label_counts = {}            # ラベルごとのファイル数を記録する辞書
+        self.source = None                # TCP受信ソース (切断時は自動で再接続する)
+        self.recording_thread = None
 
         # --- GUIウィジェットの作成 ---
         # ラベル入力
@@ -96,24 +101,21 @@ class AudioDataCollector:
         self.start_button.config(state=tk.DISABLED)
         self.status_label.config(text=f"SAW-Ringに接続中...", fg="orange")
 
-        connect_thread = threading.Thread(target=self._connect_tcp, daemon=True)
-        connect_thread.start()
-
-
-    def _connect_tcp(self):
-        """TCP接続を実行するスレッド関数"""
-        try:
-            self.client = socket.create_connection((ESP_IP, PORT), timeout=10)
-            self.client.settimeout(3.0)
-            print(f"Connected to {ESP_IP}:{PORT}")
-            self.root.after(0, self._on_connection_success)
-
-        except socket.timeout:
-            self.root.after(0, self._on_connection_lost, "接続タイムアウト")
-        except Exception as e:
-            self.root.after(0, self._on_connection_lost, f"接続失敗: {e}")  
+        self.source = create_source(
+            "tcp", host=ESP_IP, port=PORT, frame_bytes=BUFFER_SIZE,
+            on_connected=lambda: self.root.after(0, self._on_connection_success),
+            on_status=lambda message: self.root.after(0, self.status_label.config, {"text": f"再接続中: {message}", "fg": "orange"}),
+        )
+        self.source.start()
 
     def _on_connection_success(self):
+        if self.source is None:
+            return  # 接続前にリセットされた
+        if self.is_collecting_active:
+            # 再接続 (受信スレッドはそのまま続ける)
+            self.status_label.config(text="待機中: Optionキーを押して録音開始", fg="blue")
+            return
+        print(f"Connected to {ESP_IP}:{PORT}")
         self.is_collecting_active = True
         self.status_label.config(text="待機中: Optionキーを押して録音開始", fg="blue")
         
@@ -137,38 +139,26 @@ class AudioDataCollector:
         self.root.unbind("<Alt_R>")
         self.root.unbind("<KeyRelease-Alt_R>")
         
-        if self.client:
-            self.client.close()
-            self.client = None
+        if self.source:
+            self.source.stop()
+            self.source = None
         
         print("接続がリセットされました。")
 
 
     def receive_pcm_data(self):
-        while self.is_collecting_active:
-            try:
-                raw_data = self.client.recv(BUFFER_SIZE)
-                if not raw_data:
-                    print("TCP接続が閉じられました。")
-                    self.is_recording = False
-                    self.root.after(0, self.status_label.config, {"text": "接続が閉じられました。", "fg": "red"})
-                    break
-                if self.is_recording:
-                    self.buffer += raw_data
-                
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if self.is_recording:
-                    print(f"受信エラー: {e}")
-                    self.root.after(0, self.status_label.config, {"text": "接続エラー発生。", "fg": "red"})
-                break
+        source = self.source
+        while self.is_collecting_active and source.running:
+            # BUFFER_SIZEバイトごとのフレームを int16 のまま受け取る (1秒でタイムアウトして終了判定)
+            frames = source.read_frames(NUM_SAMPLES, timeout=1.0, scale=None)
+            if frames is not None and self.is_recording:
+                self.buffer += frames.tobytes()
         print("受信スレッド終了。")
 
     def on_key_press(self, event):
         if not self.is_recording and self.is_collecting_active:
             self.is_recording = True
-            self.buffer = b''
+            self.buffer = bytearray()
             self.status_label.config(text="収集中...", fg="red")
 
             #　収集効率計測用
@@ -252,10 +242,6 @@ class AudioDataCollector:
                 self.recording_thread.join(timeout=0.5)
         
         # 接続中なら切断し、UIをリセット
-        if self.client:
-            self.client.close()
-            self.client = None
-            
         self._on_connection_lost("リセットされました。")
         self.status_label.config(text="「収集スタート」を押してください", fg="black")
         self.label_counts = {}
@@ -267,9 +253,9 @@ class AudioDataCollector:
         if self.recording_thread and self.recording_thread.is_alive():
             self.recording_thread.join(timeout=0.5)
             
-        if self.client:
-            print("TCPソケットを閉じます。")
-            self.client.close()
+        if self.source:
+            print("TCP接続を閉じます。")
+            self.source.stop()
             
         self.p.terminate() # PyAudioを終了
         self.root.destroy()
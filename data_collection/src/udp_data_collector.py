@@ -3,10 +3,13 @@ import pyaudio
 import wave
 import threading
 import os
-import socket
+import sys
 import time
 from collections import deque
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from sources import create_source
+
 # config
 FORMAT = pyaudio.paInt16
 CHANNELS = 1             
@@ -20,6 +23,13 @@ BUFFER_SIZE = 1024
 #   saw-ring-4: 8888
 UDP_IP = "0.0.0.0"
 PORT = 8880
+# "udp": このアプリが直接ポートを開く / "shm": src/shm_ingest.py が受信しているデバイスを共有して読む
+# (shm なら src/main.py などを同じデバイスで同時に動かせる)
+SOURCE = "udp"
+DEVICE_ID = "saw-ring-3"
+# "udp" の場合に参加するマルチキャストグループ (空文字ならユニキャスト)
+# デバイスがグループ宛てに送っていれば、src/main.py などと同時に同じポートで受信できる
+MULTICAST_GROUP = ""
 
 class AudioDataCollector:
     def __init__(self, root):
@@ -33,7 +43,7 @@ class AudioDataCollector:
         # --- 状態管理用の変数 ---
         self.is_collecting_active = False # 「収集スタート」が押されたか
         self.is_recording = False         # Optionキーが押されているか
-        self.socket = None
+        self.source = None
         self.receive_thread = None
 
         self.recorded_chunks = []
@@ -89,11 +99,15 @@ class AudioDataCollector:
             return
         
         try:
-            # UDPソケットの作成とバインド
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 4)
-            self.socket.bind((UDP_IP, PORT))
-            self.socket.settimeout(1.0) # タイムアウト設定（終了判定用）
+            # UDP受信ソースの作成 (受信は専用スレッドでリングバッファに溜まる)
+            if SOURCE == "shm":
+                self.source = create_source("shm", device_id=DEVICE_ID)
+            else:
+                self.source = create_source("udp", port=PORT, sock_buf_size=1024 * 1024 * 4,
+                                            multicast_group=MULTICAST_GROUP)
+            self.source.start()
+            if not self.source.running:
+                raise OSError(f"受信を開始できませんでした ({SOURCE})")
             
             self.is_collecting_active = True
             self.start_button.config(state=tk.DISABLED)
@@ -117,17 +131,17 @@ class AudioDataCollector:
     def receive_pcm_data(self):
         """常にデータを受信し続け、録音フラグがTrueの時だけバッファに溜める"""
         print("受信ループ開始")
-        while self.is_collecting_active:
-            try:
-                data, addr = self.socket.recvfrom(BUFFER_SIZE * 2)
+        source = self.source
+        while self.is_collecting_active and source.running:
+            # BUFFER_SIZEサンプルごとに int16 のまま受け取る (1秒でタイムアウトして終了判定)
+            frames = source.read_frames(BUFFER_SIZE, timeout=1.0, scale=None)
+            if frames is None:
+                continue
+            for frame in frames:
+                data = frame.tobytes()
                 self.stream_buffer.append(data)
                 if self.is_recording:
                     self.recorded_chunks.append(data)
-            except socket.timeout:
-                continue # タイムアウトは無視してループ継続
-            except Exception as e:
-                print(f"受信エラー: {e}")
-                break
         print("受信ループ終了")
 
     def on_key_press(self, event):
@@ -182,6 +196,10 @@ class AudioDataCollector:
         print(f"  - データ上の時間 : {duration:.3f} 秒")
         print(f"  - 実際の録音時間 : {self.actual_duration:.3f} 秒")
         print(f"  - 損失率     : {loss_rate:.1f} %")
+        stats = self.source.stats() if self.source else {}
+        if "rcvbuf" in stats:
+            print(f"  - 受信バッファ : {stats['rcvbuf']} bytes (要求 {stats['rcvbuf_requested']} bytes)")
+            print(f"  - カーネル破棄 : {stats['kernel_drops']} パケット")
         print(f"--------------------------------------------------")
 
         if loss_rate > LESS_THRESHOLD:
@@ -219,10 +237,10 @@ class AudioDataCollector:
         self.is_collecting_active = False
         self.is_recording = False
         
-        # ソケットを閉じる
-        if self.socket:
-            self.socket.close()
-            self.socket = None
+        # 受信ソースを止める
+        if self.source:
+            self.source.stop()
+            self.source = None
         
         # スレッド終了待ち
         if self.receive_thread and self.receive_thread.is_alive():
@@ -242,8 +260,8 @@ class AudioDataCollector:
         self.is_collecting_active = False
         self.is_recording = False
         
-        if self.socket:
-            self.socket.close()
+        if self.source:
+            self.source.stop()
             
         if self.receive_thread and self.receive_thread.is_alive():
             self.receive_thread.join(timeout=1.0)
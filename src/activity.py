@@ -0,0 +1,152 @@
+"""
+指が触れているかどうかの軽い検出 (推論のゲート)
+STFTFrames の振幅スペクトルからフレームごとのエネルギー (dB) とスペクトルフラックスを求め、
+背景レベルに対するヒステリシスとハングオーバー付きで動作中 / 待機 (idle) を判定する
+待機中は推論を飛ばし、飛ばした回数を記録する
+"""
+from collections import deque
+import numpy as np
+from config import *
+
+
+class ActivityDetector:
+    """
+    push_frames() で振幅スペクトル (N_FFT // 2 + 1, フレーム数) を受け取り、active で現在の状態を返す
+    背景レベル (floor) は 0.5 秒ごとのフレームエネルギーの中央値の、直近 ACTIVITY_FLOOR_TIME 秒での最小値
+    (中央値なので無音との境目のフレームに引きずられず、古いブロックは忘れるので動作中のまま戻らなくなることはない)
+    推論するかどうかは should_run() で決め、スキップした回数を stats() で確認できる
+    待機から動作中になったフレームと、動作中のフラックスの立ち上がり (タップ) を onset として記録する (pop_onsets())
+    """
+    def __init__(self, on_db=ACTIVITY_ON_DB, off_db=ACTIVITY_OFF_DB, flux_on=ACTIVITY_FLUX_ON,
+                 hangover=ACTIVITY_HANGOVER, floor_time=ACTIVITY_FLOOR_TIME, silence_db=ACTIVITY_SILENCE_DB,
+                 hop_length=HOP_LENGTH, sr=SAMPLE_RATE, bands=32, name="GATE"):
+        self.on_db = on_db
+        self.off_db = off_db
+        self.flux_on = flux_on
+        self.frame_time = hop_length / sr
+        self.hangover_frames = int(round(hangover / self.frame_time))
+        self.block_frames = max(1, int(round(0.5 / self.frame_time)))
+        self.floor_blocks = max(1, int(round(floor_time / 0.5)))
+        self.silence_db = silence_db
+        self.bands = bands
+        self.name = name
+        self.inference_run = 0
+        self.inference_skipped = 0
+        self.reset()
+
+    def reset(self):
+        """ストリームが途切れた時に背景レベルと状態を捨てる (推論の回数は残す)"""
+        self.active = False
+        self.floor = None
+        self._medians = deque(maxlen=self.floor_blocks)
+        self._block = []
+        self._block_count = 0
+        self.energy_db = -120.0
+        self.flux = 0.0
+        self._prev_bands = None
+        self._prev_flux = 0.0
+        self._onsets = []
+        self._hang = 0
+        self._changed_at = 0
+        self._skipped_since = 0
+        self.frames = 0
+        self.active_frames = 0
+
+    def push_frames(self, magnitude):
+        """新しいフレームで状態を更新し、現在の状態 (True: 動作中) を返す"""
+        if magnitude is None or magnitude.shape[1] == 0:
+            return self.active
+        # DC オフセットが漏れる最低域の2ビンは使わない (STFT 側で DC を除いていない場合のため)
+        power = magnitude[2:] ** 2
+        energy_db = 10.0 * np.log10(np.maximum(power.mean(axis=0), 1e-20))
+        # 周波数方向を帯域にまとめてから、増えた分だけのフラックスを全体のパワーで正規化する (0〜1)
+        usable = power.shape[0] // self.bands * self.bands
+        bands = power[:usable].reshape(self.bands, -1, power.shape[1]).sum(axis=1)
+        prev = bands[:, :1] if self._prev_bands is None else self._prev_bands
+        diff = np.diff(np.concatenate([prev, bands], axis=1), axis=1)
+        flux = np.maximum(diff, 0.0).sum(axis=0) / np.maximum(bands.sum(axis=0), 1e-20)
+        self._prev_bands = bands[:, -1:]
+
+        for e, f in zip(energy_db, flux):
+            self._step(float(e), float(f))
+        self.energy_db = float(energy_db[-1])
+        self.flux = float(flux[-1])
+        return self.active
+
+    def _step(self, e, f):
+        self.frames += 1
+        # 無音 (デジタル無音・欠落の無音埋め) は背景レベルにしない
+        if e >= self.silence_db:
+            self._block.append(e)
+        self._block_count += 1
+        if self._block_count >= self.block_frames:
+            # 無音が半分以上のブロックは、境目のフレームばかりになるので使わない
+            if len(self._block) >= self.block_frames // 2:
+                self._medians.append(float(np.median(self._block)))
+                self.floor = min(self._medians)
+            self._block = []
+            self._block_count = 0
+        level = e - self.floor if self.floor is not None else 0.0
+
+        rising = f > self.flux_on and self._prev_flux <= self.flux_on
+        self._prev_flux = f
+        if level > self.on_db or (f > self.flux_on and level > self.off_db):
+            if not self.active or (rising and level > self.off_db):
+                self._onsets.append(self.frames - 1)
+            self._hang = self.hangover_frames
+            self._set(True)
+        elif self.active and level > self.off_db:
+            self._hang = self.hangover_frames
+        elif self.active:
+            self._hang -= 1
+            if self._hang <= 0:
+                self._set(False)
+        if self.active:
+            self.active_frames += 1
+
+    def _set(self, active):
+        if active == self.active:
+            return
+        self.active = active
+        duration = (self.frames - self._changed_at) * self.frame_time
+        self._changed_at = self.frames
+        if active:
+            print(f"[{self.name}] active (idle {duration:.1f} 秒, 推論 {self._skipped_since} 回をスキップ, "
+                  f"累計 {self.saved_ratio * 100:.0f}% 削減)")
+            self._skipped_since = 0
+        else:
+            print(f"[{self.name}] idle (active {duration:.1f} 秒)")
+
+    def pop_onsets(self):
+        """前回の呼び出し以降の onset のフレーム番号 (reset からの通し番号) を返す"""
+        onsets, self._onsets = self._onsets, []
+        return onsets
+
+    def should_run(self, force=False):
+        """
+        推論のタイミングで呼び、推論するかどうかを返す (スキップした回数を数える)
+        force=True (onset で決まった推論など) は状態によらず実行する
+        """
+        if self.active or force:
+            self.inference_run += 1
+            return True
+        self.inference_skipped += 1
+        self._skipped_since += 1
+        return False
+
+    @property
+    def saved_ratio(self):
+        total = self.inference_run + self.inference_skipped
+        return self.inference_skipped / total if total else 0.0
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "energy_db": self.energy_db,
+            "floor_db": self.floor if self.floor is not None else -120.0,
+            "flux": self.flux,
+            "active_ratio": self.active_frames / self.frames if self.frames else 0.0,
+            "inference_run": self.inference_run,
+            "inference_skipped": self.inference_skipped,
+            "inference_saved_ratio": self.saved_ratio,
+        }
@@ -0,0 +1,145 @@
+"""
+IMA-ADPCM (4bit) の符号化・復号
+パケットごとに予測値・ステップ番号を持たせる (packet.py の "adpcm" 形式) ので、欠落しても次のパケットに影響しない
+復号は NumPy でベクトル化している (ステップ番号・予測値の上下限付き累積和をまとめて計算する)
+
+    python adpcm.py bench   # raw 形式との復号スループット比較
+"""
+import sys
+import time
+import numpy as np
+from config import *
+
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+    15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+], dtype=np.int32)
+MAX_INDEX = len(STEP_TABLE) - 1
+
+def clamped_cumsum(start, deltas, lo, hi):
+    """
+    s[k] = clip(s[k-1] + deltas[k], lo, hi) (s[-1] = start) をまとめて計算する
+    下限は累積和の最小値で反射させて一度に求め、上限に当たった所からだけ計算し直す
+    (上限に当たるのは大振幅の時だけなので、ほとんどの場合は1回で終わる)
+    """
+    out = np.empty(len(deltas), dtype=np.int64)
+    pos = 0
+    while pos < len(deltas):
+        c = start + np.cumsum(deltas[pos:], dtype=np.int64)
+        s = c + np.maximum(0, lo - np.minimum.accumulate(c))
+        over = np.flatnonzero(s > hi)
+        if over.size == 0:
+            out[pos:] = s
+            break
+        k = over[0]
+        out[pos:pos + k] = s[:k]
+        out[pos + k] = hi
+        start = hi
+        pos += k + 1
+    return out
+
+def _diffs(nibbles, steps):
+    """ニブルとステップ幅から予測値の増分を作る (デコーダ・エンコーダ共通の丸め方)"""
+    diff = steps >> 3
+    diff = diff + np.where(nibbles & 4, steps, 0)
+    diff = diff + np.where(nibbles & 2, steps >> 1, 0)
+    diff = diff + np.where(nibbles & 1, steps >> 2, 0)
+    return np.where(nibbles & 8, -diff, diff)
+
+def decode_block(data, predictor, index):
+    """1パケット分のニブル列 (下位ニブルが先) を int16 に復号する (ニブルが無ければ空の配列)"""
+    packed = np.frombuffer(data, dtype=np.uint8)
+    if len(packed) == 0:
+        return np.empty(0, dtype=DTYPE)
+    nibbles = np.empty(len(packed) * 2, dtype=np.int32)
+    nibbles[0::2] = packed & 0x0F
+    nibbles[1::2] = packed >> 4
+
+    # ステップ番号はニブルだけで決まるので、先に全サンプル分を求める
+    indices = np.empty(len(nibbles), dtype=np.int64)
+    indices[0] = index
+    indices[1:] = clamped_cumsum(index, INDEX_TABLE[nibbles[:-1]], 0, MAX_INDEX)
+    diffs = _diffs(nibbles, STEP_TABLE[indices])
+    return clamped_cumsum(predictor, diffs, -32768, 32767).astype(DTYPE)
+
+def initial_index(block):
+    """ブロック先頭の変化量に近いステップ幅から始める (0 から始めると立ち上がりが遅れる)"""
+    head = np.abs(np.diff(block[..., :9].astype(np.int32), axis=-1)).mean(axis=-1)
+    return np.clip(np.searchsorted(STEP_TABLE, head), 0, MAX_INDEX).astype(np.int32)
+
+def encode_blocks(blocks):
+    """
+    (パケット数, サンプル数) の int16 を、パケットごとに独立した ADPCM に符号化する
+    戻り値: (先頭の予測値, 先頭のステップ番号, パケットごとのニブル列 bytes (パケット数, サンプル数 // 2))
+    各パケットは独立しているので、サンプル方向にだけループしパケット方向はまとめて計算する
+    """
+    blocks = np.asarray(blocks, dtype=np.int32)
+    n_blocks, n = blocks.shape
+    if n % 2:
+        raise ValueError("ADPCM のブロック長は偶数にしてください")
+    predictors = blocks[:, 0].copy()
+    indices = initial_index(blocks)
+    start = (predictors.astype(DTYPE), indices.copy())
+
+    pred = predictors
+    index = indices
+    nibbles = np.empty((n_blocks, n), dtype=np.uint8)
+    for k in range(n):
+        steps = STEP_TABLE[index]
+        diff = blocks[:, k] - pred
+        nibble = np.where(diff < 0, 8, 0)
+        diff = np.abs(diff)
+        for bit, step in ((4, steps), (2, steps >> 1), (1, steps >> 2)):
+            hit = diff >= step
+            nibble |= np.where(hit, bit, 0)
+            diff -= np.where(hit, step, 0)
+        pred = np.clip(pred + _diffs(nibble, steps), -32768, 32767)
+        index = np.clip(index + INDEX_TABLE[nibble], 0, MAX_INDEX)
+        nibbles[:, k] = nibble
+
+    packed = (nibbles[:, 0::2] | (nibbles[:, 1::2] << 4)).astype(np.uint8)
+    return start[0], start[1], packed
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] != "bench":
+        print("usage: python adpcm.py bench")
+        sys.exit(1)
+    from packet import encode_packet, encode_adpcm_packet, decode_packet
+
+    seconds = 10
+    packet_samples = 512
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    signal = 0.3 * np.sin(2 * np.pi * 440 * t) * (1 + np.sin(2 * np.pi * 0.5 * t)) + 0.05 * rng.standard_normal(len(t))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(DTYPE)
+    pcm = pcm[:len(pcm) // packet_samples * packet_samples].reshape(-1, packet_samples)
+
+    started = time.perf_counter()
+    predictors, indices, packed = encode_blocks(pcm)
+    encode_time = time.perf_counter() - started
+    raw_packets = [encode_packet(0, i, i * packet_samples, block) for i, block in enumerate(pcm)]
+    adpcm_packets = [encode_adpcm_packet(0, i, i * packet_samples, predictors[i], indices[i], packed[i])
+                     for i in range(len(pcm))]
+
+    results = {}
+    for name, packets in (("raw (v2)", raw_packets), ("adpcm", adpcm_packets)):
+        started = time.perf_counter()
+        decoded = [decode_packet(packet)[1] for packet in packets]
+        elapsed = time.perf_counter() - started
+        results[name] = np.concatenate(decoded)
+        size = sum(len(packet) for packet in packets)
+        print(f"{name:9s}: {len(packets) / elapsed:9.0f} パケット/秒 ({len(pcm.ravel()) / elapsed / SAMPLE_RATE:7.1f} 倍速), "
+              f"{size / seconds / 1000:5.1f} kB/s")
+
+    error = results["adpcm"].astype(np.float64) - pcm.ravel()
+    snr = 10 * np.log10(np.mean(pcm.astype(np.float64) ** 2) / np.mean(error ** 2))
+    print(f"符号化: {len(pcm.ravel()) / encode_time / SAMPLE_RATE:.1f} 倍速, SNR {snr:.1f} dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+import asyncio
+import socket
+import threading
+import numpy as np
+from config import *
+from packet import StreamTracker, decode_packet
+from tcp import Backoff, resolve
+from udp import open_udp_socket
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+class BoundedSampleBuffer:
+    """
+    上限付きの int16 サンプルバッファ (イベントループ側が書き込み、GUI側スレッドが読み出す)
+    policy: "drop_oldest" 古いサンプルを捨てる / "drop_newest" 新しいサンプルを捨てる /
+            "block" 空きができるまで書き込み側を待たせる
+    """
+    def __init__(self, capacity=INGEST_BUFFER_SIZE, policy=OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self._buf = np.zeros(capacity, dtype=DTYPE)
+        self._head = 0       # 読み出し位置
+        self.size = 0
+        self.shed_samples = 0  # 溢れて捨てたサンプル数
+        self.on_data = None    # 書き込んだサンプル数を受け取るコールバック (イベントループのスレッドから呼ばれる)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._space = None
+
+    def attach(self, loop):
+        """block ポリシーで待機するためのイベントループを登録する"""
+        self._loop = loop
+        self._space = asyncio.Event()
+
+    def _write(self, samples):
+        """空きに入るだけ書き込み、書き込んだサンプル数を返す (lock 内で呼ぶ)"""
+        n = min(len(samples), self.capacity - self.size)
+        tail = (self._head + self.size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._buf[tail:tail + first] = samples[:first]
+        self._buf[:n - first] = samples[first:n]
+        self.size += n
+        if n and self.on_data:
+            self.on_data(n)
+        return n
+
+    def put_nowait(self, samples):
+        """待たずに書き込む (block ポリシーでも溢れた分は捨てる)"""
+        with self._lock:
+            if self.policy == "drop_oldest" and len(samples) > self.capacity:
+                self.shed_samples += len(samples) - self.capacity
+                samples = samples[-self.capacity:]
+            overflow = len(samples) - (self.capacity - self.size)
+            if overflow > 0 and self.policy == "drop_oldest":
+                self._head = (self._head + overflow) % self.capacity
+                self.size -= overflow
+                self.shed_samples += overflow
+            written = self._write(samples)
+            self.shed_samples += len(samples) - written
+        return written
+
+    def try_put(self, samples):
+        """block ポリシー用: 全て入る場合だけ書き込む"""
+        with self._lock:
+            if len(samples) > self.capacity - self.size:
+                return False
+            self._write(samples)
+        return True
+
+    async def put(self, samples):
+        """ストリーム系ソース用の書き込み (block なら空きを待つ)"""
+        if self.policy != "block":
+            self.put_nowait(samples)
+            return
+        while len(samples) > 0:
+            with self._lock:
+                written = self._write(samples)
+                if written < len(samples):
+                    self._space.clear()
+            samples = samples[written:]
+            if len(samples) > 0:
+                await self._space.wait()
+
+    def wait_space(self, callback):
+        """空きができたら callback を呼ぶ (DatagramProtocol の再開用)"""
+        async def _waiter():
+            await self._space.wait()
+            callback()
+        self._space.clear()
+        return asyncio.ensure_future(_waiter())
+
+    def get(self, scale=1.0 / NORM_FACTOR):
+        """溜まっている全サンプルを float32 に正規化して取り出す (scale=None なら int16 のまま)"""
+        with self._lock:
+            n = self.size
+            if n == 0:
+                return None
+            out = np.empty(n, dtype=FLOAT_DTYPE if scale is not None else self._buf.dtype)
+            first = min(n, self.capacity - self._head)
+            out[:first] = self._buf[self._head:self._head + first]
+            out[first:] = self._buf[:n - first]
+            self._head = (self._head + n) % self.capacity
+            self.size = 0
+        if self._loop is not None and self.policy == "block" and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._space.set)
+        if scale is not None:
+            out *= FLOAT_DTYPE(scale)
+        return out
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "size": self.size,
+            "shed_samples": self.shed_samples,
+        }
+
+
+class UDPIngestProtocol(asyncio.DatagramProtocol):
+    """UDP パケットを BoundedSampleBuffer に書き込む DatagramProtocol"""
+    def __init__(self, buffer, packet_format=PACKET_FORMAT, conceal=GAP_CONCEAL):
+        self.buffer = buffer
+        self.packet_format = packet_format
+        self.conceal = conceal
+        self.tracker = StreamTracker()
+        self.transport = None
+        self._pending = None
+        self._waiter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self._waiter is not None:
+            self._waiter.cancel()
+
+    def datagram_received(self, data, addr):
+        if self.packet_format == "v2":
+            decoded = decode_packet(data)
+            if decoded is None:
+                return
+            pcm = self.tracker.accept(*decoded, self.conceal)
+            if pcm is None:
+                return
+        else:
+            pcm = np.frombuffer(data, dtype=DTYPE, count=len(data) // np.dtype(DTYPE).itemsize)
+            if pcm.size == 0:
+                return
+
+        if self.buffer.policy != "block":
+            self.buffer.put_nowait(pcm)
+        elif not self.buffer.try_put(pcm):
+            # 空きができるまで受信を止める (その間はカーネルの受信バッファが溜める)
+            self._pending = pcm
+            self.transport.pause_reading()
+            self._waiter = self.buffer.wait_space(self._resume)
+
+    def _resume(self):
+        if self._pending is not None and not self.buffer.try_put(self._pending):
+            self._waiter = self.buffer.wait_space(self._resume)
+            return
+        self._pending = None
+        self._waiter = None
+        self.transport.resume_reading()
+
+    def error_received(self, exc):
+        print(f"Receive Error: {exc}")
+
+
+def tcp_stream(host, port, frame_bytes=BUFFER_SIZE * 2):
+    """
+    TCP ソースをエンジンに載せるためのコルーチンを返す
+    ReconnectingTCPSource と同じく名前解決をキャッシュし、切断・無通信タイムアウト時は
+    ジッタ付き指数バックオフで再接続する (途中まで届いたフレームは捨て、次の接続のフレーム境界から読む)
+    """
+    async def _open(refresh):
+        loop = asyncio.get_running_loop()
+        # 名前解決 (初回・引き直し時の mDNS) でイベントループを止めない
+        addrs = await loop.run_in_executor(None, resolve, host, port, refresh)
+        last_error = OSError(f"no address for {host}")
+        for family, sockaddr in addrs:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.open_connection(sockaddr[0], sockaddr[1], family=family), TCP_CONNECT_TIMEOUT)
+            except OSError as e:  # asyncio.TimeoutError を含む
+                last_error = e
+        raise last_error
+
+    async def _run(buffer):
+        connects = 0
+        while True:
+            backoff = Backoff()
+            while True:
+                try:
+                    reader, writer = await _open(backoff.refresh)
+                    break
+                except OSError as e:
+                    wait = backoff.next()
+                    print(f"[TCP] 接続失敗 ({backoff.failures}回目): {e}")
+                    await asyncio.sleep(wait)
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if connects > 0:
+                print(f"[TCP] 再接続しました ({host}:{port})")
+            connects += 1
+            try:
+                while True:
+                    data = await asyncio.wait_for(reader.readexactly(frame_bytes), TCP_RECV_TIMEOUT)
+                    await buffer.put(np.frombuffer(data, dtype=DTYPE))
+            except asyncio.IncompleteReadError:
+                print("[TCP] 接続が相手方から切断されました。再接続します。")
+            except OSError as e:  # 無通信タイムアウトを含む
+                print(f"[TCP] 受信エラー: {e!r} 再接続します。")
+            finally:
+                writer.close()
+    return _run
+
+
+def ble_stream(address, characteristic_uuid):
+    """BLE ソース (bleak の通知) をエンジンに載せるためのコルーチンを返す"""
+    async def _run(buffer):
+        from bleak import BleakClient
+
+        residual = bytearray()
+        def notification_handler(sender, data):
+            # 通知コールバックは待てないため、block ポリシーでも溢れた分は捨てる
+            residual.extend(data)
+            n = len(residual) // 2 * 2
+            if n:
+                buffer.put_nowait(np.frombuffer(bytes(residual[:n]), dtype=DTYPE))
+                del residual[:n]
+
+        disconnected = asyncio.Event()
+        async with BleakClient(address, disconnected_callback=lambda _: disconnected.set()) as client:
+            await client.start_notify(characteristic_uuid, notification_handler)
+            await disconnected.wait()
+    return _run
+
+
+class AsyncIngestEngine:
+    """
+    1つの asyncio イベントループ (専用スレッド) で UDP / TCP / BLE のソースをまとめて受信する
+    デバイスごとに上限付きバッファを持ち、溢れた場合は policy に従う
+    on_error(device_id, メッセージ): TCP / BLE のストリームが終わった時に呼ばれる (TCP は切断されても再接続し続ける)
+    sources.py の "aio" ソース (AsyncIngestSampleSource) から1デバイスずつ使える
+    """
+    def __init__(self, capacity=INGEST_BUFFER_SIZE, policy=OVERFLOW_POLICY, on_error=None):
+        self.capacity = capacity
+        self.policy = policy
+        self.on_error = on_error
+        self.buffers = {}
+        self.protocols = {}
+        self._udp = {}
+        self._streams = {}
+        self._tasks = []
+        self._transports = []
+        self.loop = None
+        self.thread = None
+        self.running = False
+
+    def _add_buffer(self, device_id, capacity):
+        self.buffers[device_id] = BoundedSampleBuffer(capacity or self.capacity, self.policy)
+
+    def add_udp(self, device_id, port, packet_format=PACKET_FORMAT, conceal=GAP_CONCEAL,
+                sock_buf_size=SOCKET_BUF_SIZE, multicast_group=MULTICAST_GROUP, multicast_if=MULTICAST_IF,
+                capacity=None):
+        """UDP の受信ポートを追加する (オプションは UDPListener と同じ。capacity を省略するとエンジンの既定値)"""
+        self._add_buffer(device_id, capacity)
+        self._udp[device_id] = {
+            "port": port, "packet_format": packet_format, "conceal": conceal, "sock_buf_size": sock_buf_size,
+            "multicast_group": multicast_group, "multicast_if": multicast_if,
+        }
+
+    def add_stream(self, device_id, source, capacity=None):
+        """source: バッファを受け取るコルーチン関数 (tcp_stream / ble_stream など)"""
+        self._add_buffer(device_id, capacity)
+        self._streams[device_id] = source
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+        except Exception:
+            # bind に失敗した場合などはループを片付けてから伝える
+            self.stop()
+            raise
+        print(f"Ingest engine started: {', '.join(self.buffers)} (policy: {self.policy})")
+
+    async def _setup(self):
+        loop = asyncio.get_running_loop()
+        for buffer in self.buffers.values():
+            buffer.attach(loop)
+        for device_id, options in self._udp.items():
+            sock = open_udp_socket(options["port"], options["multicast_group"], options["multicast_if"])
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, options["sock_buf_size"])
+            protocol = UDPIngestProtocol(self.buffers[device_id], options["packet_format"], options["conceal"])
+            transport, _ = await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+            self._transports.append(transport)
+            self.protocols[device_id] = protocol
+        for device_id, source in self._streams.items():
+            self._tasks.append(asyncio.ensure_future(self._run_stream(device_id, source)))
+
+    async def _run_stream(self, device_id, source):
+        try:
+            await source(self.buffers[device_id])
+            message = f"Source ended ({device_id})"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            message = f"Source Error ({device_id}): {e}"
+        print(message)
+        if self.on_error:
+            self.on_error(device_id, message)
+
+    def get_data(self, device_id=None):
+        """指定デバイスのバッファを空にして正規化済みデータを返す"""
+        if device_id is None:
+            device_id = next(iter(self.buffers))
+        return self.buffers[device_id].get()
+
+    def get_stats(self, device_id=None):
+        if device_id is None:
+            device_id = next(iter(self.buffers))
+        return self.buffers[device_id].stats()
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for transport in self._transports:
+            transport.close()
+        await asyncio.sleep(0)  # connection_lost を処理させる
+        self._tasks = []
+        self._transports = []
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=2.0)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1.0)
+        self.loop.close()
+        self.loop = None
+        self.thread = None
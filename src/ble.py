@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import time
+from config import *
+from ring_buffer import FrameAssembler
+
+def load_cached_address(name, path=BLE_ADDRESS_CACHE):
+    """前回接続したデバイスのアドレスを返す (無ければ None)"""
+    try:
+        with open(path) as f:
+            return json.load(f).get(name)
+    except (OSError, ValueError):
+        return None
+
+def save_cached_address(name, address, path=BLE_ADDRESS_CACHE):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[name] = address
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        print(f"[BLE] アドレスを保存できませんでした: {e}")
+
+
+class BLESource:
+    """
+    SAW-Ring の BLE 通知を受信するソース
+    前回接続したアドレスへ直接接続し、失敗した場合だけ名前でスキャンする
+    通知は FrameAssembler (事前確保したバッファ) に追記し、frame_bytes ごとに on_frames へ渡す
+    client_class / scanner_class を差し替えれば実機なしで動かせる
+    """
+    def __init__(self, name=BLE_DEVICE_NAME, characteristic_uuid=BLE_CHARACTERISTIC_UUID,
+                 frame_bytes=BUFFER_SIZE, dtype=DTYPE, on_frames=None, on_status=None,
+                 on_connected=None, cache_path=BLE_ADDRESS_CACHE,
+                 client_class=None, scanner_class=None):
+        self.name = name
+        self.characteristic_uuid = characteristic_uuid
+        self.assembler = FrameAssembler(frame_bytes, dtype=dtype)
+        self.on_frames = on_frames        # on_frames(int16 フレーム配列)
+        self.on_status = on_status        # on_status(メッセージ)
+        self.on_connected = on_connected
+        self.cache_path = cache_path
+        self.client_class = client_class
+        self.scanner_class = scanner_class
+        self.startup_time = None          # run() 開始から最初のフレームまでの時間 (秒)
+        self.used_scan = False
+        self._started = None
+        self._loop = None
+        self._stop = None
+        self._stop_requested = False
+
+    def _status(self, message):
+        print(f"[BLE] {message}")
+        if self.on_status:
+            self.on_status(message)
+
+    def _notification_handler(self, sender, data):
+        frames = self.assembler.feed(data)
+        if len(frames) == 0:
+            return
+        if self.startup_time is None:
+            self.startup_time = time.monotonic() - self._started
+            print(f"[BLE] 接続開始から最初のデータまで {self.startup_time:.2f} 秒")
+        if self.on_frames:
+            self.on_frames(frames)
+
+    async def _connect(self, target):
+        client = self.client_class(target, disconnected_callback=lambda _: self._stop.set(),
+                                   timeout=BLE_CONNECT_TIMEOUT)
+        await client.connect()
+        return client
+
+    async def _find_and_connect(self):
+        address = load_cached_address(self.name, self.cache_path)
+        if address:
+            self._status(f"'{self.name}' ({address}) に直接接続中...")
+            try:
+                return await self._connect(address)
+            except Exception as e:
+                self._status(f"直接接続に失敗しました ({e})。スキャンします。")
+
+        self.used_scan = True
+        self._status(f"'{self.name}' を検索中...")
+        # 見つかった時点でスキャンを打ち切る (discover のように全時間待たない)
+        device = await self.scanner_class.find_device_by_name(self.name, timeout=BLE_SCAN_TIMEOUT)
+        if device is None:
+            raise ConnectionError(f"デバイス '{self.name}' が見つかりません。")
+        self._status(f"'{self.name}' に接続中...")
+        client = await self._connect(device)
+        save_cached_address(self.name, device.address, self.cache_path)
+        return client
+
+    async def run(self):
+        """接続して通知を受信し、切断または stop() まで待つ (接続できなければ ConnectionError)"""
+        if self.client_class is None or self.scanner_class is None:
+            from bleak import BleakClient, BleakScanner
+            self.client_class = self.client_class or BleakClient
+            self.scanner_class = self.scanner_class or BleakScanner
+
+        self._stop = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self._stop_requested:
+            return
+        self._started = time.monotonic()
+        self.startup_time = None
+        self.used_scan = False
+        self.assembler.reset()
+
+        client = await self._find_and_connect()
+        try:
+            if not client.is_connected:
+                raise ConnectionError("デバイスへの接続に失敗しました。")
+            if self.on_connected:
+                self.on_connected()
+            await client.start_notify(self.characteristic_uuid, self._notification_handler)
+            await self._stop.wait()
+        finally:
+            if client.is_connected:
+                await client.disconnect()
+
+    def stop(self):
+        """別スレッドからも呼べる停止要求"""
+        self._stop_requested = True
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
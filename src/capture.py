@@ -0,0 +1,223 @@
+"""
+受信パケットの記録 (キャプチャ) と再生
+UDPListener(capture_path=...) で受信したパケットをそのままファイルへ追記し、
+CaptureReplayListener で同じパケットを元のタイミング (または最速) で受信側へ流し直す
+
+    python capture.py info captures/20250101-120000.sawcap   # 中身の概要を表示
+"""
+import json
+import mmap
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from config import *
+from packet import decode_packet
+from udp import UDPListener
+
+# ファイル形式 (リトルエンディアン):
+#   "SAWCAP01" | メタデータ長 (uint32) | メタデータ (JSON: デバイスID -> ポート, パケット形式, サンプリングレート)
+#   以降レコードの繰り返し: 到着時刻 (ns, uint64) | 送信元 IPv4 (4B) | 送信元ポート (uint16) | 長さ (uint16) |
+#                            デバイス番号 (uint8) | 予備 (3B) | ペイロード (受信したパケットそのまま)
+CAPTURE_MAGIC = b"SAWCAP01"
+META_LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<Q4sHHB3x")
+
+CaptureRecord = namedtuple("CaptureRecord", ["timestamp_ns", "device_id", "addr", "payload"])
+
+
+class CaptureWriter:
+    """
+    メモリマップしたファイルへパケットを追記する (受信スレッドから呼ぶ)
+    ファイルは chunk_size 単位で先に確保し、close() で実際の長さに切り詰める
+    """
+    def __init__(self, path, devices, packet_format=PACKET_FORMAT, chunk_size=CAPTURE_CHUNK_BYTES):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.device_index = {device_id: i for i, device_id in enumerate(devices)}
+        meta = json.dumps({
+            "devices": dict(devices),
+            "packet_format": packet_format,
+            "sample_rate": SAMPLE_RATE,
+        }).encode()
+        header = CAPTURE_MAGIC + META_LENGTH.pack(len(meta)) + meta
+
+        self.file = open(path, "w+b")
+        self.size = max(chunk_size, len(header))
+        self.file.truncate(self.size)
+        self.mm = mmap.mmap(self.file.fileno(), self.size)
+        self.mm[:len(header)] = header
+        self.pos = len(header)
+        self.records = 0
+        self._last_addr = None
+        self._packed_addr = (b"\0" * 4, 0)
+
+    def write(self, device_id, addr, *parts, timestamp_ns=None):
+        """
+        1パケット分を記録する (parts はヘッダ・PCM など分かれて受信した場合のバイト列)
+        timestamp_ns: カーネルの受信時刻 (省略時は現在時刻)
+        """
+        length = sum(len(part) for part in parts)
+        end = self.pos + RECORD.size + length
+        if end > self.size:
+            self.size = (end // self.chunk_size + 1) * self.chunk_size
+            self.mm.resize(self.size)
+
+        if addr != self._last_addr:
+            try:
+                self._packed_addr = (socket.inet_aton(addr[0]), addr[1])
+            except (OSError, TypeError, IndexError):
+                self._packed_addr = (b"\0" * 4, 0)
+            self._last_addr = addr
+        ip, port = self._packed_addr
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        RECORD.pack_into(self.mm, self.pos, timestamp_ns, ip, port, length, self.device_index[device_id])
+
+        offset = self.pos + RECORD.size
+        for part in parts:
+            self.mm[offset:offset + len(part)] = part
+            offset += len(part)
+        self.pos = end
+        self.records += 1
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+        self.file.truncate(self.pos)
+        self.file.close()
+        print(f"[CAPTURE] {self.records} パケット ({self.pos} bytes) を {self.path} に保存しました")
+
+
+class CaptureReader:
+    """キャプチャファイルを読み、CaptureRecord を順に返す (payload はファイルのビュー)"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            raise ValueError(f"{path}: キャプチャファイルではありません")
+        (meta_length,) = META_LENGTH.unpack_from(self.mm, len(CAPTURE_MAGIC))
+        self.data_start = len(CAPTURE_MAGIC) + META_LENGTH.size + meta_length
+        meta = json.loads(bytes(self.mm[self.data_start - meta_length:self.data_start]))
+        self.devices = meta["devices"]
+        self.packet_format = meta["packet_format"]
+        self.sample_rate = meta["sample_rate"]
+        self._device_ids = list(self.devices)
+
+    def __iter__(self):
+        view = memoryview(self.mm)
+        pos = self.data_start
+        end = len(self.mm)
+        while pos + RECORD.size <= end:
+            timestamp_ns, ip, port, length, index = RECORD.unpack_from(self.mm, pos)
+            payload_at = pos + RECORD.size
+            if payload_at + length > end:
+                break  # 書き込み途中で終了したファイル
+            addr = (socket.inet_ntoa(ip), port)
+            yield CaptureRecord(timestamp_ns, self._device_ids[index], addr, view[payload_at:payload_at + length])
+            pos = payload_at + length
+
+    def summary(self):
+        """デバイスごとのパケット数・バイト数・到着間隔の最大値"""
+        stats = {device_id: {"packets": 0, "bytes": 0, "max_interval": 0.0} for device_id in self.devices}
+        first = last = None
+        last_arrival = {}
+        for record in self:
+            s = stats[record.device_id]
+            s["packets"] += 1
+            s["bytes"] += len(record.payload)
+            previous = last_arrival.get(record.device_id)
+            if previous is not None:
+                s["max_interval"] = max(s["max_interval"], (record.timestamp_ns - previous) / 1e9)
+            last_arrival[record.device_id] = record.timestamp_ns
+            if first is None:
+                first = record.timestamp_ns
+            last = record.timestamp_ns
+        duration = (last - first) / 1e9 if first is not None else 0.0
+        return duration, stats
+
+
+class CaptureReplayListener(UDPListener):
+    """
+    キャプチャしたパケットを UDPListener と同じ受信処理 (v2 の欠落検出・補間を含む) に流し直す
+    get_data() / get_stats() は UDPListener と同じように使える
+    speed: 1.0 で記録時と同じ間隔、0 で待たずに流す
+    """
+    def __init__(self, path, speed=REPLAY_SPEED, conceal=GAP_CONCEAL, on_data=None, on_end=None):
+        self.reader = CaptureReader(path)
+        super().__init__(self.reader.devices, self.reader.packet_format, conceal, on_data, capture_path="")
+        self.speed = speed
+        self.on_end = on_end
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._replay_loop, daemon=True)
+        self.thread.start()
+        print(f"Replaying {self.reader.path} (x{self.speed})")
+
+    def _replay_loop(self):
+        started = time.monotonic()
+        first = None
+        for record in self.reader:
+            if self._stop_event.is_set():
+                break
+            if self.speed > 0:
+                if first is None:
+                    first = record.timestamp_ns
+                delay = started + (record.timestamp_ns - first) / 1e9 / self.speed - time.monotonic()
+                if delay > 0 and self._stop_event.wait(delay):
+                    break
+            ring = self.rings[record.device_id]
+            written = ring.write_pos
+            self._feed(record.device_id, record.payload)
+            if ring.write_pos != written:
+                # 記録時の受信時刻でクロックを推定する (再生速度によらず記録時のドリフトが分かる)
+                self.clocks[record.device_id].update(record.timestamp_ns, ring.write_pos)
+            if self.on_data:
+                self.on_data(record.device_id)
+        self.running = False
+        if self.on_end and not self._stop_event.is_set():
+            self.on_end()
+
+    def _feed(self, device_id, data):
+        ring = self.rings[device_id]
+        if self.packet_format == "v2":
+            decoded = decode_packet(data)
+            if decoded is None:
+                return
+            pcm = self.trackers[device_id].accept(*decoded, self.conceal)
+            if pcm is not None:
+                ring.write(pcm)
+        else:
+            ring.write(np.frombuffer(data, dtype=DTYPE, count=len(data) // ring.itemsize))
+
+    def stop(self):
+        self._stop_event.set()
+        super().stop()
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "info":
+        print("usage: python capture.py info <キャプチャファイル>")
+        sys.exit(1)
+    reader = CaptureReader(sys.argv[2])
+    duration, stats = reader.summary()
+    print(f"{reader.path}: {duration:.2f} 秒, 形式 {reader.packet_format}, {reader.sample_rate} Hz")
+    for device_id, s in stats.items():
+        print(f"  {device_id} (port {reader.devices[device_id]}): {s['packets']} パケット, "
+              f"{s['bytes']} bytes, 最大到着間隔 {s['max_interval'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+デバイスのサンプリングクロック推定とドリフト補正
+ESP32 の PDM クロックは公称 SAMPLE_RATE だが、実際の速度は PC の時計に対して少しずれる
+受信時刻 (UDP はカーネルのタイムスタンプ) と累積サンプル数から実際のレート・到着ジッタを推定し、
+必要なら DriftResampler で公称レートに合わせ直す
+"""
+from collections import deque
+import numpy as np
+from config import *
+
+
+class ClockEstimator:
+    """
+    1デバイス分の (到着時刻, 累積サンプル数) からサンプリングレートとジッタを推定する
+    ネットワーク遅延は到着を遅らせる方向にしか働かないため、CLOCK_BUCKET 秒ごとに
+    最も早く届いた (遅延の小さい) 点だけを残し、直近 CLOCK_WINDOW 秒分の傾きをレートとする
+    jitter は RFC 3550 と同じ到着間隔のずれの指数平滑 (秒)
+    """
+    def __init__(self, nominal_rate=SAMPLE_RATE, bucket=CLOCK_BUCKET, window=CLOCK_WINDOW):
+        self.nominal_rate = nominal_rate
+        self.bucket = bucket
+        self.points = deque(maxlen=max(3, int(window / bucket)))
+        self.rate = float(nominal_rate)
+        self.resets = 0   # 時間軸が途切れて推定をやり直した回数
+        self._clear()
+
+    def reset(self):
+        """時間軸が途切れた (再接続・デバイス再起動) 時に推定をやり直す"""
+        self._clear()
+        self.resets += 1
+
+    def _clear(self):
+        self.t0 = None
+        self.s0 = 0
+        self.last = None
+        self.jitter = 0.0
+        self.points.clear()
+        self._bucket_start = None
+        self._best = None
+
+    def update(self, arrival_ns, samples):
+        """samples: このパケットまでの累積サンプル数 (リングの write_pos など)"""
+        if self.t0 is None:
+            self.t0 = arrival_ns
+            self.s0 = samples
+        x = (arrival_ns - self.t0) / 1e9
+        y = samples - self.s0
+        offset = x - y / self.nominal_rate   # 到着の遅れ + クロックのずれ (秒)
+
+        if self.last is not None:
+            last_x, last_y, last_offset = self.last
+            if y < last_y or abs(offset - last_offset) > CLOCK_RESET_THRESHOLD:
+                self.reset()
+                self.update(arrival_ns, samples)
+                return
+            d = (x - last_x) - (y - last_y) / self.rate
+            self.jitter += (abs(d) - self.jitter) / 16
+        self.last = (x, y, offset)
+
+        if self._best is None or offset < self._best[2]:
+            self._best = (x, y, offset)
+        if self._bucket_start is None:
+            self._bucket_start = x
+        elif x - self._bucket_start >= self.bucket:
+            self.points.append(self._best[:2])
+            self._bucket_start = x
+            self._best = None
+            if len(self.points) >= 3:
+                xs, ys = np.array(self.points).T
+                self.rate = float(np.polyfit(xs, ys, 1)[0])
+
+    @property
+    def drift_ppm(self):
+        return (self.rate / self.nominal_rate - 1.0) * 1e6
+
+    def ready(self):
+        """推定に十分な点が溜まったか"""
+        return len(self.points) >= 3
+
+    def stats(self):
+        return {
+            "sample_rate_est": self.rate,
+            "drift_ppm": self.drift_ppm if self.ready() else 0.0,
+            "jitter_ms": self.jitter * 1000,
+            "clock_resets": self.resets,
+        }
+
+
+class DriftResampler:
+    """
+    推定したレートのストリームを公称レートへ線形補間で連続的に変換する
+    呼び出しをまたいで最後のサンプルと補間位置を引き継ぐので、ブロック境界で不連続にならない
+    """
+    def __init__(self):
+        self._last = None
+        self._phase = 0.0
+
+    def process(self, samples, rate, nominal_rate=SAMPLE_RATE):
+        """rate (サンプル/秒) で取られた samples を nominal_rate に変換して返す (dtype は入力と同じ)"""
+        if len(samples) == 0:
+            return samples
+        if self._last is None:
+            self._last = samples[0]
+            self._phase = 1.0
+        buf = np.empty(len(samples) + 1, dtype=np.float64)
+        buf[0] = self._last
+        buf[1:] = samples
+        step = rate / nominal_rate   # 出力1サンプルあたりに進む入力サンプル数
+        end = len(buf) - 1
+        count = max(0, int(np.ceil((end - self._phase) / step)))
+        positions = self._phase + step * np.arange(count)
+        index = positions.astype(np.int64)
+        frac = positions - index
+        out = buf[index] * (1.0 - frac) + buf[index + 1] * frac
+        self._phase += count * step - end
+        self._last = buf[-1]
+        if np.issubdtype(samples.dtype, np.integer):
+            out = np.round(out)
+        return out.astype(samples.dtype)
+
+    def reset(self):
+        self._last = None
+        self._phase = 0.0
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 
 # UDP settings
@@ -10,11 +11,84 @@ UDP_IP = "0.0.0.0"
 UDP_PORT = 8888
 SOCKET_BUF_SIZE = 65536
 
+# 1プロセスで複数デバイスを同時受信する場合のデバイスID -> ポート番号
+DEVICE_PORTS = {
+    "saw-ring-1": 8000,
+    "saw-ring-2": 8800,
+    "saw-ring-3": 8880,
+    "saw-ring-4": 8888,
+}
+DEFAULT_DEVICE = "saw-ring-4"  # UDP_PORT に対応するデバイス
+SELECT_TIMEOUT = 0.1           # selector の待ち時間 (停止判定用, 秒)
+STATS_INTERVAL = 1.0           # 受信レート (packets/s, bytes/s, カーネル破棄数) の更新間隔 (秒)
+
+# マルチキャスト受信 (空文字ならユニキャスト)
+# "239.255.42.1" などを指定すると、複数の受信プロセス・PC が同じポートで同じストリームを受け取れる
+MULTICAST_GROUP = ""
+MULTICAST_IF = "0.0.0.0"       # グループに参加するインターフェースのアドレス (ループバックで試す場合は "127.0.0.1")
+MULTICAST_TTL = 1              # シミュレータから送る時の TTL (1 = 同じネットワーク内のみ)
+
+# パケット形式 ("raw": ヘッダなしPCM, "v2": デバイスID・シーケンス番号付き, v2 では IMA-ADPCM の adpcm パケットも受け付ける)
+PACKET_FORMAT = "raw"
+GAP_CONCEAL = "zero"     # 欠落区間の埋め方 ("zero" or "interp")
+
+# TCP settings (arduino/tcp/tcp.ino)
+TCP_HOST = "saw-ring.local"
+TCP_PORT = 8000
+TCP_CONNECT_TIMEOUT = 5.0         # 1回の接続試行のタイムアウト (秒)
+TCP_RECV_TIMEOUT = 2.0            # これ以上データが届かなければ切断とみなす (秒)
+TCP_BACKOFF_INITIAL = 0.1         # 再接続の待ち時間の初期値 (秒, 失敗ごとに倍)
+TCP_BACKOFF_MAX = 5.0             # 再接続の待ち時間の上限 (秒)
+TCP_RESOLVE_AFTER_FAILURES = 3    # キャッシュしたアドレスでこの回数失敗したら名前解決し直す
+
+# BLE settings (arduino/ble/ble.ino)
+BLE_DEVICE_NAME = "SAW-Ring"
+BLE_CHARACTERISTIC_UUID = "13b73498-101b-4f22-aa2b-a72c6710e54f"
+BLE_ADDRESS_CACHE = os.path.expanduser("~/.saw-ring/ble_address.json")  # 前回接続したアドレスの保存先
+BLE_CONNECT_TIMEOUT = 3.0         # キャッシュしたアドレスへの直接接続のタイムアウト (秒)
+BLE_SCAN_TIMEOUT = 5.0            # 名前でスキャンする場合のタイムアウト (秒)
+
+# 受信ノード間の転送 (forwarder.py)
+FORWARD_HOST = "127.0.0.1"   # 集約ノードのアドレス (転送側で使う)
+FORWARD_PORT = 9000          # 集約ノードの待ち受けポート
+FORWARD_INTERVAL = 0.02      # 転送側がサンプルをまとめて送る間隔 (秒)
+
+# パケットの記録 (capture.py)
+# 空文字なら記録しない。"captures/%Y%m%d-%H%M%S.sawcap" のように指定すると UDPListener の開始時刻で保存する
+CAPTURE_PATH = ""
+CAPTURE_CHUNK_BYTES = 16 * 1024 * 1024   # 記録ファイルを一度に確保するサイズ
+
+# Serial settings (arduino/esp_serial/esp_serial.ino)
+SERIAL_BAUD_RATE = 2000000
+SERIAL_READ_TIMEOUT = 0.1         # 1回の読み出しの最大待ち時間 (秒, 停止判定用)
+SERIAL_FRAMING = "raw"            # "raw": 生の int16 ストリーム / "sync": 同期ワード付きフレーム
+SERIAL_MAX_PAYLOAD = 2048         # sync フレームのペイロード長の上限 (バイト)
+
+# 受信ソース (sources.py の create_source で選ぶ)
+SOURCE_TYPE = "udp"               # "udp" / "tcp" / "ble" / "serial" / "file" / "shm" (shm_ingest.py 経由) / "capture" / "forward" (forwarder.py 経由) / "aio" (aio_ingest.py, 上限付きバッファ)
+SERIAL_PORT = "/dev/ttyUSB0"      # SOURCE_TYPE = "serial" の場合のポート
+REPLAY_PATH = ""                  # SOURCE_TYPE = "file" / "capture" の場合に再生する WAV / キャプチャファイル
+REPLAY_SPEED = 1.0                # 再生速度 (1.0 = 実時間, 0 = 待たずに流し込む)
+
 # SAW settings
 SAMPLE_RATE = 24000
 BUFFER_SIZE = 1024       # 1回の受信パケットサイズ
 DTYPE = np.int16         # 受信データの型
 NORM_FACTOR = 32768.0    # 正規化係数
+FLOAT_DTYPE = np.float32 # 正規化後のサンプル・スペクトル・特徴量の型 (リングは DTYPE のまま溜め、読み出しで初めて変換する)
+RING_CAPACITY = SAMPLE_RATE * 4   # デバイスごとの受信リングバッファ長 (サンプル)
+RECV_BATCH = 64          # 1回の selector 通知でまとめて読むパケット数の上限
+MAX_GAP_FILL = SAMPLE_RATE        # これ以上の番号の飛びは補間せず同期し直す (サンプル)
+
+# サンプリングクロックの推定 (clock.py)
+CLOCK_BUCKET = 0.5              # 遅延の最も小さい到着を1点だけ残す区間 (秒)
+CLOCK_WINDOW = 300.0            # レート推定に使う直近の時間 (秒)
+CLOCK_RESET_THRESHOLD = 1.0     # 到着時刻がこれ以上飛んだら推定をやり直す (秒)
+RESAMPLE_DRIFT_PPM = 0          # 推定ドリフトがこれを超えたら読み出し時に SAMPLE_RATE へリサンプルする (0 で無効)
+
+# asyncio 受信エンジン (aio_ingest.py)
+INGEST_BUFFER_SIZE = SAMPLE_RATE * 2   # デバイスごとのバッファ上限 (サンプル)
+OVERFLOW_POLICY = "drop_oldest"        # 溢れた時の扱い ("drop_oldest" / "drop_newest" / "block")
 
 # Visualize settings
 WAVE_WINDOW_SIZE = 48000
@@ -25,9 +99,24 @@ SPECTRO_WIDTH = 200      # 横軸の時間ステップ数
 FFT_SIZE = 1024          # FFTのウィンドウサイズ
 MAX_FREQ_DISP = SAMPLE_RATE / 2     # 表示する最大周波数(Hz)
 
+# ジッタバッファ (jitter_buffer.py, main.py の表示で使う)
+JITTER_TARGET_LATENCY = 0.05   # 目標遅延の初期値・下限 (秒)
+JITTER_MAX_LATENCY = 0.5       # 目標遅延の上限 (これを超えて溜まった分は捨てる, 秒)
+JITTER_ADAPT_TIME = 10.0       # 観測したバーストを目標遅延に反映し続ける時間 (秒)
+JITTER_MAX_SKEW = 0.05         # 深さを目標に戻すために放出速度を変える最大割合
+
 # Inference settings
 MODEL_PATH = "./surface_recognition/resnet_best_model.pth" # pthファイルパス
 NUM_CLASSES = 9                                 # クラス数
 # CLASS_LABELS = ["ダンボール", "布", "ガラス", "None", "紙", "プラスチック", "皮膚", "ステンレス", "木"]  # クラス名
 CLASS_LABELS = ["None", "None", "None", "None", "None", "None", "皮膚を触っています！", "None", "None"]
-INFERENCE_INTERVAL = 0.5
\ No newline at end of file
+INFERENCE_INTERVAL = 0.5                        # 定期的な推論の間隔 (秒, 受信したサンプル数で数える)
+INFERENCE_ONSET_DELAY = SAMPLE_RATE // 2        # 触れ始め (onset) からこのサンプル数だけ後の窓で推論する
+
+# 推論のゲート (activity.py): 指が触れていない間は推論しない
+ACTIVITY_ON_DB = 10.0        # 背景レベルからこれだけ大きいフレームで動作中にする (dB)
+ACTIVITY_OFF_DB = 6.0        # これを下回ったらハングオーバーの後に待機へ戻す (dB, ON より小さくしてばたつきを防ぐ)
+ACTIVITY_FLUX_ON = 0.5       # スペクトルフラックス (0〜1) がこれを超えたら、OFF の閾値以上でも動作中にする (タップの立ち上がり)
+ACTIVITY_HANGOVER = 1.0      # 静かになってから待機へ戻すまでの時間 (秒)
+ACTIVITY_FLOOR_TIME = 20.0   # 背景レベルを求める期間 (秒, この間の最小エネルギー。これより長く触れ続けると待機に戻る)
+ACTIVITY_SILENCE_DB = -90.0  # これより静かなフレーム (デジタル無音・欠落の無音埋め) は背景レベルの推定に使わない
@@ -0,0 +1,429 @@
+"""
+受信ノード間の転送
+離れた場所の受信機 (転送側) が UDP で受けたデバイスのサンプルを、1本の TCP 接続でまとめて集約ノードへ送る
+集約ノードはデバイスごとのリングに振り分け、"forward" ソースとして推論・可視化から読める
+
+    python forwarder.py send 192.168.1.10 saw-ring-1 saw-ring-3   # 転送側 (DEVICE_PORTS から選ぶ)
+    python forwarder.py receive                                     # 集約ノード (受信状況だけを表示)
+    python main.py forward                                          # 集約ノードで推論 (DEFAULT_DEVICE を読む)
+"""
+import json
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy as np
+from config import *
+from ring_buffer import SampleRing
+from packet import conceal_gap
+from clock import ClockEstimator
+from tcp import resolve
+from udp import UDPListener
+
+# 通信形式 (リトルエンディアン):
+#   接続直後に1回: "SAWFWD01" | メタデータ長 (uint32) | メタデータ (JSON: 送信元ホスト名, デバイスID の一覧, セッション, サンプリングレート)
+#   以降バッチの繰り返し: "SB" | ブロック数 (uint16) | 送信時刻 (ns, uint64)
+#     ブロック: デバイス番号 (uint8) | 予備 (3B) | 先頭のサンプル番号 (uint64) | サンプル数 (uint32) | int16 PCM
+HELLO_MAGIC = b"SAWFWD01"
+META_LENGTH = struct.Struct("<I")
+BATCH = struct.Struct("<2sHQ")
+BATCH_MAGIC = b"SB"
+BLOCK = struct.Struct("<B3xQI")
+
+
+class Forwarder:
+    """
+    ローカルの UDPListener で受けたデバイスのサンプルを、FORWARD_INTERVAL ごとに1つのバッチにまとめて送る
+    切断されたらバックオフしながら再接続する (その間のサンプルはリングに溜まり、溢れた分は集約側で欠落として埋める)
+    """
+    def __init__(self, host=FORWARD_HOST, port=FORWARD_PORT, device_ids=None, interval=FORWARD_INTERVAL,
+                 packet_format=PACKET_FORMAT):
+        if not device_ids:
+            device_ids = [DEFAULT_DEVICE]
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.device_ids = list(device_ids)
+        self.listener = UDPListener({device_id: DEVICE_PORTS[device_id] for device_id in self.device_ids},
+                                    packet_format)
+        self.cursors = {}
+        # 再接続では同じセッションのままサンプル番号を続ける (集約側で欠落・重なりを判定できる)
+        self.session = f"{random.getrandbits(64):016x}"
+        self.sock = None
+        self.batches = 0
+        self.sent_bytes = 0
+        self.connects = 0
+        self.running = False
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.running:
+            return
+        self.listener.start()
+        # 接続前に受信した分から送る
+        self.cursors = {device_id: ring.write_pos for device_id, ring in self.listener.rings.items()}
+        self.running = True
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        """集約ノードへ接続できるまで再試行し、接続したらメタデータを送る"""
+        delay = TCP_BACKOFF_INITIAL
+        while not self._stop.is_set():
+            try:
+                family, sockaddr = resolve(self.host, self.port)[0]
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.settimeout(TCP_CONNECT_TIMEOUT)
+                sock.connect(sockaddr)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                meta = json.dumps({
+                    "host": socket.gethostname(),
+                    "devices": self.device_ids,
+                    "session": self.session,
+                    "sample_rate": SAMPLE_RATE,
+                }).encode()
+                sock.sendall(HELLO_MAGIC + META_LENGTH.pack(len(meta)) + meta)
+            except OSError as e:
+                print(f"[FWD] 接続失敗 {self.host}:{self.port}: {e}")
+                self._stop.wait(random.uniform(0, delay))
+                delay = min(delay * 2, TCP_BACKOFF_MAX)
+                continue
+            self.connects += 1
+            print(f"[FWD] {self.host}:{self.port} に接続しました ({', '.join(self.device_ids)})")
+            return sock
+        return None
+
+    def _send_loop(self):
+        next_send = time.monotonic()
+        while not self._stop.is_set():
+            if self.sock is None:
+                self.sock = self._connect()
+                if self.sock is None:
+                    break
+            next_send += self.interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_send = time.monotonic()  # 送信が遅れた分は取り戻さない
+
+            parts = []
+            cursors = {}
+            for index, device_id in enumerate(self.device_ids):
+                data, cursor = self.listener.rings[device_id].read(self.cursors[device_id], scale=None)
+                if data is None:
+                    continue
+                cursors[device_id] = cursor
+                parts.append(BLOCK.pack(index, cursor - len(data), len(data)))
+                parts.append(data.tobytes())
+            if not parts:
+                continue
+            message = BATCH.pack(BATCH_MAGIC, len(parts) // 2, time.time_ns()) + b"".join(parts)
+            try:
+                self.sock.sendall(message)
+            except OSError as e:
+                # 送れなかった分は再接続後に送り直す (途中まで届いていても集約側で重なりを捨てる)
+                print(f"[FWD] 送信エラー: {e} 再接続します。")
+                self.sock.close()
+                self.sock = None
+                continue
+            self.cursors.update(cursors)
+            self.batches += 1
+            self.sent_bytes += len(message)
+
+    def stop(self):
+        self._stop.set()
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.listener.stop()
+        self.running = False
+
+
+class DeviceStats:
+    """集約側の1デバイス分の受信カウンタ"""
+    def __init__(self):
+        self.samples = 0
+        self.bytes = 0
+        self.lost_samples = 0
+        self.latency = 0.0        # 送信から受信までの時間の指数平滑 (秒)
+        self.max_latency = 0.0
+        self.rates = (0.0, 0.0)
+        self._last = (time.monotonic(), 0, 0)
+
+    def update_rates(self, now):
+        last_time, last_samples, last_bytes = self._last
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        self.rates = ((self.samples - last_samples) / elapsed, (self.bytes - last_bytes) / elapsed)
+        self._last = (now, self.samples, self.bytes)
+
+    def stats(self):
+        samples_per_sec, bytes_per_sec = self.rates
+        return {
+            "forwarded_samples": self.samples,
+            "forward_lost_samples": self.lost_samples,
+            "forward_latency_ms": self.latency * 1000,
+            "forward_max_latency_ms": self.max_latency * 1000,
+            "forward_samples_per_sec": samples_per_sec,
+            "forward_bytes_per_sec": bytes_per_sec,
+        }
+
+
+class Aggregator:
+    """
+    転送側からの TCP 接続を受け付け、デバイスIDごとの SampleRing に振り分ける
+    転送側が複数あってもよい (デバイスIDは全体で重ならないようにする)
+    転送の遅延は送信時刻との差なので、別のホストとは時計を合わせておく (NTP など)
+    転送側ごとの受信スレッドが同じデバイスに書き込んでも (再接続の直後など) 混ざらないよう、
+    デバイスごとのロックの中で期待するサンプル番号の確認からリングへの書き込みまでを行う
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, port=FORWARD_PORT, host="0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.rings = {}
+        self.clocks = {}
+        self.device_stats = {}
+        self.device_locks = {}    # デバイスごとの書き込みのロック (expected・リング・クロックを守る)
+        self.expected = {}        # デバイスごとの次に来るはずのサンプル番号
+        self.sessions = {}        # デバイスごとの転送側のセッション (転送側の起動ごとに変わる)
+        self.subscribers = {}     # デバイスID -> on_data() のリスト
+        self.peers = {}           # 接続中の転送側 (ソケット -> ホスト名)
+        self.users = 0
+        self.running = False
+        self.server = None
+        self.thread = None
+        self._lock = threading.Lock()
+        self._next_stats = 0.0
+
+    @classmethod
+    def shared(cls, port=FORWARD_PORT):
+        """同じプロセスの複数のソースで1つの集約ノード (ポート) を共有する"""
+        with cls._shared_lock:
+            aggregator = cls._shared.get(port)
+            if aggregator is None:
+                aggregator = cls._shared[port] = cls(port)
+            aggregator.users += 1
+            return aggregator
+
+    def release(self):
+        with Aggregator._shared_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            Aggregator._shared.pop(self.port, None)
+        self.stop()
+
+    def ring(self, device_id):
+        with self._lock:
+            if device_id not in self.rings:
+                self.rings[device_id] = SampleRing()
+                self.clocks[device_id] = ClockEstimator()
+                self.device_stats[device_id] = DeviceStats()
+                self.device_locks[device_id] = threading.Lock()
+            return self.rings[device_id]
+
+    def subscribe(self, device_id, callback):
+        self.subscribers.setdefault(device_id, []).append(callback)
+
+    def unsubscribe(self, device_id, callback):
+        callbacks = self.subscribers.get(device_id, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def start(self):
+        if self.running:
+            return
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(8)
+        self.server.settimeout(SELECT_TIMEOUT)
+        self.running = True
+        self.thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.thread.start()
+        print(f"[AGG] 転送を待ち受けます: {self.host}:{self.port}")
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, addr = self.server.accept()
+            except socket.timeout:
+                self._update_rates()
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            threading.Thread(target=self._serve, args=(sock, addr), daemon=True).start()
+
+    def _update_rates(self):
+        now = time.monotonic()
+        if now < self._next_stats:
+            return
+        self._next_stats = now + STATS_INTERVAL
+        for stats in list(self.device_stats.values()):
+            stats.update_rates(now)
+
+    def _serve(self, sock, addr):
+        reader = _SocketReader(sock)
+        try:
+            if bytes(reader.read(len(HELLO_MAGIC))) != HELLO_MAGIC:
+                raise ConnectionError("転送側のデータではありません")
+            (meta_length,) = META_LENGTH.unpack(reader.read(META_LENGTH.size))
+            meta = json.loads(bytes(reader.read(meta_length)))
+            device_ids = meta["devices"]
+            for device_id in device_ids:
+                self.ring(device_id)
+                with self.device_locks[device_id]:
+                    if self.sessions.get(device_id) != meta["session"]:
+                        # 転送側が起動し直した (サンプル番号が 0 から数え直される)
+                        self.sessions[device_id] = meta["session"]
+                        self.expected.pop(device_id, None)
+            self.peers[sock] = meta["host"]
+            print(f"[AGG] {meta['host']} ({addr[0]}) から接続: {', '.join(device_ids)}")
+
+            while self.running:
+                magic, blocks, sent_ns = BATCH.unpack(reader.read(BATCH.size))
+                if magic != BATCH_MAGIC:
+                    raise ConnectionError("バッチの区切りが壊れています")
+                received_ns = time.time_ns()
+                for _ in range(blocks):
+                    index, sample_index, n = BLOCK.unpack(reader.read(BLOCK.size))
+                    payload = reader.read(n * np.dtype(DTYPE).itemsize)
+                    self._write(device_ids[index], sample_index, np.frombuffer(payload, dtype=DTYPE),
+                                sent_ns, received_ns)
+                self._update_rates()
+        except (OSError, ConnectionError, ValueError, KeyError, IndexError, struct.error) as e:
+            if self.running:
+                print(f"[AGG] {addr[0]} との接続が切れました: {e}")
+        finally:
+            self.peers.pop(sock, None)
+            sock.close()
+
+    def _write(self, device_id, sample_index, pcm, sent_ns, received_ns):
+        with self.device_locks[device_id]:
+            written = self._write_locked(device_id, sample_index, pcm, sent_ns, received_ns)
+        if written:
+            for callback in self.subscribers.get(device_id, []):
+                callback()
+
+    def _write_locked(self, device_id, sample_index, pcm, sent_ns, received_ns):
+        """デバイスのロックの中で呼ぶ。リングに書き込んだら True を返す"""
+        ring = self.rings[device_id]
+        stats = self.device_stats[device_id]
+        expected = self.expected.get(device_id)
+        if expected is not None:
+            gap = sample_index - expected
+            if -MAX_GAP_FILL <= gap < 0:
+                pcm = pcm[min(-gap, len(pcm)):]   # 既に受け取った分と重なった部分は捨てる
+                sample_index = expected
+            elif 0 < gap <= MAX_GAP_FILL and len(pcm):
+                # 転送側のリングが溢れて届かなかった区間
+                ring.write(conceal_gap(gap, ring.last_sample(), pcm[0]))
+                stats.lost_samples += gap
+        if len(pcm) == 0:
+            return False
+        self.expected[device_id] = sample_index + len(pcm)
+        ring.write(pcm)
+        self.clocks[device_id].update(sent_ns, ring.write_pos)
+
+        latency = (received_ns - sent_ns) / 1e9
+        stats.latency += (latency - stats.latency) / 16
+        stats.max_latency = max(stats.max_latency, latency)
+        stats.samples += len(pcm)
+        stats.bytes += pcm.nbytes
+        return True
+
+    def get_stats(self, device_id=None):
+        if device_id is None:
+            device_id = next(iter(self.rings))
+        stats = {"peers": len(self.peers)}
+        if device_id in self.device_stats:
+            stats.update(self.device_stats[device_id].stats())
+            stats.update(self.clocks[device_id].stats())
+        return stats
+
+    def stop(self):
+        self.running = False
+        if self.server:
+            self.server.close()
+            self.server = None
+        for sock in list(self.peers):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+
+class _SocketReader:
+    """ストリームから指定バイト数ずつ読み出す (作業バッファは使い回す)"""
+    def __init__(self, sock, size=BUFFER_SIZE * 16):
+        self.sock = sock
+        self.buf = bytearray(size)
+
+    def read(self, n):
+        if n > len(self.buf):
+            self.buf = bytearray(n)
+        view = memoryview(self.buf)[:n]
+        got = 0
+        while got < n:
+            nbytes = self.sock.recv_into(view[got:])
+            if nbytes == 0:
+                raise ConnectionError("接続が相手方から切断されました")
+            got += nbytes
+        return view
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "send":
+        unknown = [device_id for device_id in sys.argv[3:] if device_id not in DEVICE_PORTS]
+        if unknown:
+            print(f"不明なデバイスID: {', '.join(unknown)} (DEVICE_PORTS: {', '.join(DEVICE_PORTS)})")
+            sys.exit(1)
+        node = Forwarder(sys.argv[2], FORWARD_PORT, sys.argv[3:])
+    elif len(sys.argv) == 2 and sys.argv[1] == "receive":
+        node = Aggregator.shared(FORWARD_PORT)
+    else:
+        print("usage: python forwarder.py send <集約ノードのアドレス> [デバイスID ...]\n"
+              "       python forwarder.py receive")
+        sys.exit(1)
+
+    node.start()
+    try:
+        while True:
+            time.sleep(5.0)
+            if isinstance(node, Forwarder):
+                print(f"[FWD] {node.batches} バッチ, {node.sent_bytes / 1000:.0f} kB 送信")
+                continue
+            for device_id in list(node.rings):
+                s = node.get_stats(device_id)
+                print(f"[AGG] {device_id}: {s['forward_samples_per_sec'] / SAMPLE_RATE:.2f} 倍速, "
+                      f"{s['forward_bytes_per_sec'] / 1000:.1f} kB/s, 遅延 {s['forward_latency_ms']:.1f} ms "
+                      f"(最大 {s['forward_max_latency_ms']:.1f} ms), 欠落 {s['forward_lost_samples']}")
+    except KeyboardInterrupt:
+        print("\n停止します")
+    finally:
+        node.stop()
+
+
+if __name__ == "__main__":
+    main()
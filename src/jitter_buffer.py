@@ -0,0 +1,118 @@
+import time
+import numpy as np
+from config import *
+from ring_buffer import SampleRing
+
+class JitterBuffer:
+    """
+    受信ソースと DSP の間に置く適応型ジッタバッファ
+    到着のばらつき (Wi-Fi のバースト) を吸収し、描画フレームごとに経過時間分のサンプルだけを一定のペースで渡す
+    目標遅延 (target) は観測したバーストの大きさに合わせて min_latency〜max_latency の間で伸び縮みする
+    get_data() は SampleSource.get_data() と同じように使える
+    """
+    def __init__(self, source, target_latency=JITTER_TARGET_LATENCY, max_latency=JITTER_MAX_LATENCY,
+                 adapt_time=JITTER_ADAPT_TIME, rate=SAMPLE_RATE):
+        self.source = source
+        self.rate = rate
+        self.min_latency = target_latency
+        self.max_latency = max_latency
+        self.adapt_time = adapt_time        # 観測したバーストを覚えておく時間 (秒)
+        self.max_samples = int(max_latency * rate)
+        self.ring = SampleRing(self.max_samples * 2 + BUFFER_SIZE * 2)
+        self.reset()
+
+    def reset(self):
+        """溜まっているサンプルを捨て、目標遅延を初期値に戻す"""
+        self.cursor = self.ring.write_pos
+        self.target = self.min_latency
+        self.buffering = True    # 目標遅延分が溜まるまで放出しない
+        self.underruns = 0       # バッファが空になり溜め直した回数
+        self.dropped = 0         # 遅延が max_latency を超えたため捨てたサンプル数
+        self._burst = 0.0
+        self._origin = None      # 到着時刻の基準 (受信サンプル数 0 の時刻)
+        self._received = 0
+        self._base = None        # 最も早く届いた時の遅れ
+        self._last_fill = None
+        self._last_pop = None
+        self._credit = 0.0       # 放出しきれなかった端数 (サンプル)
+
+    @property
+    def depth(self):
+        """現在溜まっている遅延 (秒)"""
+        return (self.ring.write_pos - self.cursor) / self.rate
+
+    def _fill(self, now):
+        data = self.source.get_data(scale=None)
+        if data is None:
+            return
+        self.ring.write(data)
+
+        if self._origin is None:
+            self._origin = now
+        # 今回届いた先頭サンプルの到着の遅れ。最も早かった到着 (_base) との差がバーストで生じた遅延
+        offset = now - self._origin - self._received / self.rate
+        self._received += len(data)
+        dt = 0.0 if self._last_fill is None else now - self._last_fill
+        self._last_fill = now
+        if self._base is None or offset < self._base:
+            self._base = offset
+        else:
+            # クロックのずれで遅れが少しずつ増えても追従できるよう、基準をゆっくり引き上げる
+            self._base += (offset - self._base) * min(1.0, dt / self.adapt_time)
+        delay = offset - self._base
+        if delay > self.max_latency * 2:
+            # 受信が途切れていた (再接続など) ので到着時刻の基準を取り直す
+            self._origin = None
+            self._received = 0
+            self._base = None
+            return
+        self._burst = max(delay, self._burst * float(np.exp(-dt / self.adapt_time)))
+        # 観測したバーストに最小遅延分の余裕を足したものを目標にする
+        self.target = min(self._burst + self.min_latency, self.max_latency)
+
+    def get_data(self, scale=1.0 / NORM_FACTOR):
+        """前回の呼び出しからの経過時間分のサンプルを返す (溜め中・空なら None)"""
+        now = time.monotonic()
+        self._fill(now)
+        depth = self.ring.write_pos - self.cursor
+
+        if depth > self.max_samples:
+            # 遅延の上限を超えた分は捨てて追いつく
+            self.dropped += depth - self.max_samples
+            self.cursor += depth - self.max_samples
+            depth = self.max_samples
+
+        if self.buffering:
+            self._last_pop = now
+            if depth < self.target * self.rate:
+                return None
+            self.buffering = False
+            self._credit = 0.0
+
+        elapsed = now - self._last_pop
+        self._last_pop = now
+        # 深さが目標からずれている分だけ放出速度を最大 JITTER_MAX_SKEW 変えて、ゆっくり目標に戻す
+        error = (depth / self.rate - self.target) / self.target
+        skew = min(max(error, -1.0), 1.0) * JITTER_MAX_SKEW
+        self._credit += elapsed * self.rate * (1.0 + skew)
+        n = int(self._credit)
+        if n > depth:
+            n = depth
+            self.underruns += 1
+            self.buffering = True
+            self._credit = 0.0
+        else:
+            self._credit -= n
+        if n <= 0:
+            return None
+        data, self.cursor = self.ring.read(self.cursor, scale, max_samples=n)
+        return data
+
+    def stats(self):
+        return {
+            "depth_ms": self.depth * 1000,
+            "target_ms": self.target * 1000,
+            "underruns": self.underruns,
+            "dropped_samples": self.dropped,
+            "buffering": self.buffering,
+        }
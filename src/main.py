@@ -2,29 +2,42 @@ import dearpygui.dearpygui as dpg
 import matplotlib.pyplot as plt
 import numpy as np
 import traceback
-import time
+import sys
 from collections import deque
 
 from config import *
-from udp import UDPListener
-from signal_process import DSPProcessor
+from sources import create_source
+from jitter_buffer import JitterBuffer
+from signal_process import DSPProcessor, STFTFrames
+from ring_buffer import RollingWindow
+from activity import ActivityDetector
+from scheduler import InferenceScheduler
 from surface_recognition.inference import InferenceEngine  
 
-waveform_data = np.zeros(WAVE_WINDOW_SIZE, dtype=np.float32)
-spectro_saw = np.zeros((N_MELS, SPECTRO_WIDTH), dtype=np.float32)
+# 表示用の窓 (追記は新しいデータ分だけ、view() で直近の窓を取り出す)
+waveform_data = RollingWindow(WAVE_WINDOW_SIZE)
+spectro_saw = RollingWindow(SPECTRO_WIDTH, shape=(N_MELS,))
 x_indices_wave_sec = np.arange(WAVE_WINDOW_SIZE) / SAMPLE_RATE
 
 colormap = plt.get_cmap('viridis')
-last_inference_time = 0.0
 SCALE_FFT = 4.0
 
 TH_HIGH = 0.6 # イベント開始
 TH_LOW = 0.5 # イベント終了
 N_TRIGGER_FRAMES = 2
 
-listener = UDPListener()
+# 受信ソースは config.SOURCE_TYPE か起動引数で選ぶ (例: python main.py tcp)
+listener = create_source(sys.argv[1] if len(sys.argv) > 1 else SOURCE_TYPE)
+# 到着のばらつきを吸収し、描画フレームごとに一定量のサンプルを DSP へ渡す
+jitter_buffer = JitterBuffer(listener)
+# STFT はここで1回だけ計算し、表示用のメルスペクトログラムと推論用の PCEN で共有する
+stft = STFTFrames()
 dsp = DSPProcessor()
 inference_engine = InferenceEngine()
+# 指が触れていない (idle) 間は推論しない
+activity = ActivityDetector()
+# 推論のタイミングは受信したサンプル数で決める (触れ始めから一定サンプル後 + 定期実行)
+scheduler = InferenceScheduler()
 class EventState:
     IDLE = "IDLE"
     TRIGGERED = "TRIGGERED"
@@ -37,6 +50,14 @@ prediction_history = deque(maxlen=10)
 display_label = "---"  # GUI表示用のラベル
 display_confidence = 0.0  # GUI表示用の確信度  
 
+def start_listener():
+    jitter_buffer.reset()
+    stft.reset()
+    inference_engine.reset()
+    activity.reset()
+    scheduler.reset()
+    listener.start()
+
 def setup_gui():
     dpg.create_context()
 
@@ -55,8 +76,9 @@ def setup_gui():
         dpg.add_separator()
         
         with dpg.group(horizontal=True):
-            dpg.add_button(label="Start", callback=listener.start, width=100)
+            dpg.add_button(label="Start", callback=start_listener, width=100)
             dpg.add_button(label="Stop", callback=listener.stop, width=100)
+            dpg.add_text("Buffer: --", tag="buffer_text")
             # dpg.add_text("UDP Status: Idle", tag="status_text")
 
         dpg.add_spacer(height=10)
@@ -92,7 +114,7 @@ def setup_gui():
                     dpg.add_plot_axis(dpg.mvYAxis, label="Amp", tag="y_axis_wave")
                     dpg.set_axis_limits("y_axis_wave", -1.1, 1.1)
                     
-                    dpg.add_line_series(x_indices_wave_sec, waveform_data, 
+                    dpg.add_line_series(x_indices_wave_sec, waveform_data.view(), 
                                         label="Raw", parent="y_axis_wave", tag="wave_series")
                     
             with dpg.table_row():
@@ -176,33 +198,31 @@ def check_event_trigger(label, confidence):
 
 
 def update_loop():
-    global waveform_data, spectro_saw, last_inference_time, current_state
+    global current_state
     
 
     try :
-        new_data = listener.get_data()
-        
+        new_data = jitter_buffer.get_data()
+        stats = jitter_buffer.stats()
+        dpg.set_value("buffer_text", f"Buffer: {stats['depth_ms']:.0f} / {stats['target_ms']:.0f} ms")
 
         if new_data is not None:
             # dpg.set_value("status_text", "UDP Status: Receiving...")
             # 1. Update Waveform
             chunk_len = len(new_data)
             if chunk_len > 0:
-                waveform_data = np.roll(waveform_data, -chunk_len)
-                waveform_data[-chunk_len:] = new_data
-                dpg.set_value("wave_series", [x_indices_wave_sec, waveform_data])
+                waveform_data.append(new_data)
+                dpg.set_value("wave_series", [x_indices_wave_sec, waveform_data.view()])
 
             # 2. Update Spectrogram
-            mel_cols = dsp.process_spectrogram_column(new_data)
+            magnitude = stft.push(new_data)
+            inference_engine.push_frames(magnitude, new_data)
+            activity.push_frames(magnitude)
+            scheduler.push_frames(0 if magnitude is None else magnitude.shape[1], activity.pop_onsets())
+            mel_cols = dsp.mel_columns(magnitude)
             if mel_cols is not None:
-                num_new = mel_cols.shape[1]
-                if num_new > SPECTRO_WIDTH:
-                    mel_cols = mel_cols[:, -SPECTRO_WIDTH:]
-                    num_new = SPECTRO_WIDTH
-
-                spectro_saw = np.roll(spectro_saw, -num_new, axis=1)
-                spectro_saw[:, -num_new:] = mel_cols
-                flipped_saw = spectro_saw[::-1, :]
+                spectro_saw.append(mel_cols)
+                flipped_saw = spectro_saw.view()[::-1, :]
                 flat_data = flipped_saw.flatten()
 
                 rgba_mapped = colormap(flat_data)
@@ -221,25 +241,31 @@ def update_loop():
             dpg.set_value("fft_series", [freqs_khz, filtered_mags])
 
             # 4. Inference
-            current_time = time.time()
-            if current_time - last_inference_time > INFERENCE_INTERVAL:
-                label, conf = inference_engine.predict(waveform_data)
-                prediction_history.append((label, conf))
-                check_event_trigger(label, conf)
+            due = scheduler.poll()
+            while due is not None:
+                reason, end = due
+                if activity.should_run(force=(reason == "onset")):
+                    label, conf = inference_engine.predict(end=end)
+                    prediction_history.append((label, conf))
+                    check_event_trigger(label, conf)
                 
-                if display_label == "None":
-                    dpg.set_value("predicted_label", "別の場所に触れています")
-                else:
-                    dpg.set_value("predicted_label", display_label)
-                dpg.set_value("confidence_label", f"{display_confidence * 100:.1f}%")
+                    if display_label == "None":
+                        dpg.set_value("predicted_label", "別の場所に触れています")
+                    else:
+                        dpg.set_value("predicted_label", display_label)
+                    dpg.set_value("confidence_label", f"{display_confidence * 100:.1f}%")
                 
-                # 確信度に応じて色を変える
-                if display_confidence > 0.8:
-                    dpg.configure_item("predicted_label", color=(0, 255, 0)) # 高信頼度: 緑
+                    # 確信度に応じて色を変える
+                    if display_confidence > 0.8:
+                        dpg.configure_item("predicted_label", color=(0, 255, 0)) # 高信頼度: 緑
+                    else:
+                        dpg.configure_item("predicted_label", color=(255, 255, 0)) # 低信頼度: 黄
                 else:
-                    dpg.configure_item("predicted_label", color=(255, 255, 0)) # 低信頼度: 黄
-                
-                last_inference_time = current_time
+                    dpg.set_value("predicted_label", "待機中 (idle)")
+                    dpg.set_value("confidence_label", "---")
+                    dpg.configure_item("predicted_label", color=(128, 128, 128))
+
+                due = scheduler.poll()
                 
         # else:
         #     if listener.running:
@@ -0,0 +1,147 @@
+import struct
+from collections import namedtuple
+import numpy as np
+from config import *
+from adpcm import STEP_TABLE, decode_block
+
+# v2 パケット形式 (リトルエンディアン, arduino/udp/udp.ino の PacketHeader と合わせる)
+#   magic "SW" (2B) | version (1B) | device_id (1B) | seq (uint32) | sample_index (uint32) | PCM int16 ...
+# adpcm 形式は version = 3 で、PCM の代わりに
+#   予測値 (int16) | ステップ番号 (uint8) | 予備 (1B) | IMA-ADPCM ニブル列 (1バイト2サンプル, 下位ニブルが先)
+HEADER = struct.Struct("<2sBBII")
+HEADER_SIZE = HEADER.size
+ADPCM_HEADER = struct.Struct("<hBx")
+PACKET_MAGIC = b"SW"
+PACKET_VERSION = 2
+ADPCM_VERSION = 3
+INDEX_MOD = 1 << 32      # seq, sample_index の周回
+
+PacketHeader = namedtuple("PacketHeader", ["version", "device_id", "seq", "sample_index"])
+
+def decode_header(buf):
+    """先頭 HEADER_SIZE バイトをヘッダとして解釈する (v2 でなければ None)"""
+    if len(buf) < HEADER_SIZE:
+        return None
+    magic, version, device_id, seq, sample_index = HEADER.unpack_from(buf)
+    if magic != PACKET_MAGIC or version not in (PACKET_VERSION, ADPCM_VERSION):
+        return None
+    return PacketHeader(version, device_id, seq, sample_index)
+
+def decode_packet(data):
+    """v2 / adpcm パケットを (ヘッダ, int16 PCM) に分解する (どちらでもなければ None)"""
+    header = decode_header(data)
+    if header is None:
+        return None
+    if header.version == ADPCM_VERSION:
+        pcm = decode_adpcm_payload(memoryview(data)[HEADER_SIZE:])
+        return None if pcm is None else (header, pcm)
+    pcm = np.frombuffer(data, dtype=DTYPE, offset=HEADER_SIZE,
+                        count=(len(data) - HEADER_SIZE) // np.dtype(DTYPE).itemsize)
+    return header, pcm
+
+def encode_packet(device_id, seq, sample_index, pcm):
+    """int16 PCM に v2 ヘッダを付けたパケットを作る"""
+    header = HEADER.pack(PACKET_MAGIC, PACKET_VERSION, device_id,
+                         seq % INDEX_MOD, sample_index % INDEX_MOD)
+    return header + np.asarray(pcm, dtype=DTYPE).tobytes()
+
+def decode_adpcm_payload(payload):
+    """adpcm パケットのヘッダ以降 (予測値・ステップ番号・ニブル列) を int16 に復号する"""
+    if len(payload) < ADPCM_HEADER.size:
+        return None
+    predictor, index = ADPCM_HEADER.unpack_from(payload)
+    if index >= len(STEP_TABLE):
+        return None
+    return decode_block(payload[ADPCM_HEADER.size:], predictor, index)
+
+def encode_adpcm_packet(device_id, seq, sample_index, predictor, index, nibbles):
+    """adpcm.encode_blocks() で符号化した1パケット分に adpcm ヘッダを付ける"""
+    header = HEADER.pack(PACKET_MAGIC, ADPCM_VERSION, device_id,
+                         seq % INDEX_MOD, sample_index % INDEX_MOD)
+    return header + ADPCM_HEADER.pack(int(predictor), int(index)) + bytes(nibbles)
+
+def _wrap_diff(a, b):
+    """周回を考慮した a - b (符号付き)"""
+    d = (a - b) % INDEX_MOD
+    return d - INDEX_MOD if d >= INDEX_MOD // 2 else d
+
+
+class StreamTracker:
+    """
+    1デバイス分の seq / sample_index を追跡し、欠落・順序入れ替わりを検出する
+    update() は欠落サンプル数 (>0 なら補間が必要)、遅着パケットなら -1 を返す
+    accept() は欠落を埋めた書き込むべき PCM を返す (ライブ受信・キャプチャ再生・asyncio 受信で共通)
+    """
+    def __init__(self):
+        self.last_sample = 0      # 最後に受理したサンプル (補間の始点)
+        self.expected_index = None
+        self.expected_seq = None
+        self.device_id = None
+        self.packets = 0          # 受理したパケット数
+        self.lost_packets = 0     # 届かなかった (間に合わなかった) パケット数
+        self.lost_samples = 0     # 補間で埋めたサンプル数
+        self.late_packets = 0     # 遅れて届いた/重複したため捨てたパケット数
+        self.resyncs = 0          # 大きな飛びで同期し直した回数
+
+    def update(self, header, n_samples):
+        self.device_id = header.device_id
+        if self.expected_index is None:
+            self._accept(header, n_samples)
+            return 0
+
+        gap = _wrap_diff(header.sample_index, self.expected_index)
+        if abs(gap) > MAX_GAP_FILL:
+            # デバイスの再起動などで番号が大きく飛んだ
+            self.resyncs += 1
+            self._accept(header, n_samples)
+            return 0
+        if gap < 0:
+            self.late_packets += 1
+            return -1
+
+        if gap > 0:
+            self.lost_samples += gap
+            self.lost_packets += max(1, _wrap_diff(header.seq, self.expected_seq))
+        self._accept(header, n_samples)
+        return gap
+
+    def accept(self, header, pcm, conceal=GAP_CONCEAL):
+        """
+        受信したパケットの PCM を、書き込むべきサンプル列にして返す
+        欠落があれば conceal_gap で埋めたサンプルを前に付けた新しい配列、なければ pcm そのもの
+        (呼び出し側は「pcm そのもの」ならコピーせずに確定できる)。遅着・重複・空のパケットは None
+        """
+        if pcm is None or pcm.size == 0:
+            return None
+        gap = self.update(header, pcm.size)
+        if gap < 0:
+            return None
+        if gap > 0:
+            pcm = np.concatenate([conceal_gap(gap, self.last_sample, pcm[0], conceal), pcm])
+        self.last_sample = pcm[-1]
+        return pcm
+
+    def _accept(self, header, n_samples):
+        self.packets += 1
+        self.expected_index = (header.sample_index + n_samples) % INDEX_MOD
+        self.expected_seq = (header.seq + 1) % INDEX_MOD
+
+    def stats(self):
+        total = self.packets + self.lost_packets
+        return {
+            "device_id": self.device_id,
+            "packets": self.packets,
+            "lost_packets": self.lost_packets,
+            "lost_samples": self.lost_samples,
+            "late_packets": self.late_packets,
+            "resyncs": self.resyncs,
+            "loss_rate": self.lost_packets / total if total else 0.0,
+        }
+
+
+def conceal_gap(gap, last_sample, next_sample, mode=GAP_CONCEAL):
+    """欠落区間を埋めるサンプル列を作る ("zero": 無音, "interp": 直線補間)"""
+    if mode == "interp":
+        ramp = np.linspace(last_sample, next_sample, gap + 2, dtype=np.float32)[1:-1]
+        return ramp.astype(DTYPE)
+    return np.zeros(gap, dtype=DTYPE)
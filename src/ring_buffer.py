@@ -0,0 +1,195 @@
+import numpy as np
+from config import *
+
+class SampleRing:
+    """
+    int16 サンプルを溜める事前確保リングバッファ
+    受信側は write_view() へ直接 recv_into し、commit() で書き込み位置を進める
+    正規化 (float32 変換) は読み出し時にだけ行う
+    buffer を渡すと (共有メモリなど) 外部で確保した capacity + max_write 個の配列を使う
+    """
+    def __init__(self, capacity=RING_CAPACITY, max_write=BUFFER_SIZE * 2, dtype=DTYPE, buffer=None):
+        self.capacity = capacity
+        self.max_write = max_write
+        self.itemsize = np.dtype(dtype).itemsize
+        # 末尾に max_write 分の余白を取り、折り返した分だけ先頭へコピーする
+        if buffer is None:
+            buffer = np.zeros(capacity + max_write, dtype=dtype)
+        self._buf = buffer
+        self._bytes = memoryview(self._buf).cast("B")
+        self.write_pos = 0   # 累積書き込みサンプル数 (単調増加)
+        self.overruns = 0    # 読み出しが追いつかず捨てたサンプル数
+
+    def write_view(self):
+        """次の書き込み位置から max_write サンプル分のバイト列ビューを返す"""
+        start = (self.write_pos % self.capacity) * self.itemsize
+        return self._bytes[start:start + self.max_write * self.itemsize]
+
+    def commit(self, n):
+        """write_view() に書き込んだ n サンプルを確定する"""
+        start = self.write_pos % self.capacity
+        end = start + n
+        if end > self.capacity:
+            self._buf[:end - self.capacity] = self._buf[self.capacity:end]
+        self.write_pos += n
+
+    def write(self, samples):
+        """配列をコピーして書き込む (受信以外の経路用)"""
+        samples = np.asarray(samples)
+        for i in range(0, len(samples), self.max_write):
+            chunk = samples[i:i + self.max_write]
+            start = self.write_pos % self.capacity
+            self._buf[start:start + len(chunk)] = chunk
+            self.commit(len(chunk))
+
+    def last_sample(self):
+        """最後に書き込んだサンプル (未書き込みなら 0)"""
+        if self.write_pos == 0:
+            return 0
+        return self._buf[(self.write_pos - 1) % self.capacity]
+
+    def available(self, cursor):
+        """cursor 以降で読み出せるサンプル数 (溢れた分は除く)"""
+        return max(0, min(self.write_pos - cursor, self.capacity - self.max_write))
+
+    def read(self, cursor, scale=1.0 / NORM_FACTOR, max_samples=None):
+        """
+        cursor 以降の新しいサンプルを float32 に正規化して返す (scale=None なら int16 のまま)
+        max_samples を指定した場合はその数までに留める
+        戻り値: (データ or None, 新しい cursor)
+        """
+        end = self.write_pos
+        # 書き込み中の領域 (max_write 分) は読まない
+        readable = self.capacity - self.max_write
+        if end - cursor > readable:
+            self.overruns += end - cursor - readable
+            cursor = end - readable
+        n = end - cursor
+        if max_samples is not None:
+            n = min(n, max_samples)
+        if n <= 0:
+            return None, cursor
+
+        out = np.empty(n, dtype=FLOAT_DTYPE if scale is not None else self._buf.dtype)
+        start = cursor % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        out[first:] = self._buf[:n - first]
+        if scale is not None:
+            out *= FLOAT_DTYPE(scale)
+        return out, cursor + n
+
+
+class RollingWindow:
+    """
+    直近 length 個 (最後の軸) を保持する窓 (波形・スペクトログラム・推論の入力窓)
+    np.roll や deque と違い、追記は新しいデータ分のコピーだけで、直近の窓は常に連続したビューで取り出せる
+    同じデータを長さ 2 * length の配列の前半と後半に二重に書く (ミラー) ので、どこで折り返しても窓が途切れない
+    shape: 最後の軸より前の形 (メルスペクトログラムなら (N_MELS,))
+    """
+    def __init__(self, length, shape=(), dtype=FLOAT_DTYPE, fill=0):
+        self.length = length
+        self.fill = fill
+        self._buf = np.empty(tuple(shape) + (length * 2,), dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        self._buf[...] = self.fill
+        self._pos = 0          # 最も古い要素の位置 (0 <= _pos < length)
+        self.count = 0         # これまでに追記した数
+
+    def append(self, data):
+        """最後の軸に沿って data を追記する"""
+        data = np.asarray(data)
+        n = data.shape[-1]
+        if n == 0:
+            return
+        self.count += n
+        if n >= self.length:
+            tail = data[..., -self.length:]
+            self._buf[..., :self.length] = tail
+            self._buf[..., self.length:] = tail
+            self._pos = 0
+            return
+        start = self._pos
+        end = start + n
+        self._buf[..., start:end] = data
+        if end <= self.length:
+            self._buf[..., start + self.length:end + self.length] = data
+        else:
+            # length をまたいだ分は前半に、またぐ前の分は後半に写す
+            split = self.length - start
+            self._buf[..., start + self.length:] = data[..., :split]
+            self._buf[..., :end - self.length] = data[..., split:]
+        self._pos = end % self.length
+
+    def view(self):
+        """直近 length 個の連続したビュー (古い順。次の append で内容が変わる)"""
+        return self._buf[..., self._pos:self._pos + self.length]
+
+    def latest(self, n, offset=0):
+        """直近から offset 個前で終わる n 個のビュー (n + offset <= length)"""
+        stop = self._pos + self.length - offset
+        return self._buf[..., stop - n:stop]
+
+    def latest_until(self, n, stop):
+        """
+        通し番号 (reset からの追記数) stop の直前までの n 個のビュー
+        残っていない古い位置は最も古い窓に、まだ追記していない位置は直近の窓になる
+        """
+        offset = min(max(self.count - stop, 0), self.length - n)
+        return self.latest(n, offset)
+
+
+class FrameAssembler:
+    """
+    バイト列を事前確保した bytearray に溜め、固定長の int16 フレーム単位で取り出す
+    フレーム長は偶数バイトなので、奇数バイトで分割されて届いてもサンプルの境界はずれない
+    """
+    def __init__(self, frame_bytes=BUFFER_SIZE * 2, max_frames=16, dtype=DTYPE):
+        self.frame_bytes = frame_bytes
+        self.dtype = np.dtype(dtype)
+        self.frame_samples = frame_bytes // self.dtype.itemsize
+        self._buf = bytearray(frame_bytes * max_frames)
+        self._view = memoryview(self._buf)
+        self._u8 = np.frombuffer(self._buf, dtype=np.uint8)
+        self._start = 0   # 未処理データの先頭
+        self._end = 0     # 書き込み済みデータの末尾
+
+    def write_view(self):
+        """空き領域のビューを返す (前回 pop_frames() で返したビューはここで無効になる)"""
+        if len(self._buf) - self._end < self.frame_bytes:
+            # 端数 (1フレーム未満) だけ先頭へ寄せる
+            remain = self._end - self._start
+            self._u8[:remain] = self._u8[self._start:self._end]
+            self._start, self._end = 0, remain
+        return self._view[self._end:]
+
+    def commit(self, n):
+        self._end += n
+
+    def feed(self, data):
+        """data をコピーして追記し、揃ったフレームを返す"""
+        view = self.write_view()
+        if len(data) > len(view):
+            raise ValueError(f"chunk of {len(data)} bytes exceeds assembler space ({len(view)} bytes)")
+        view[:len(data)] = data
+        self.commit(len(data))
+        return self.pop_frames()
+
+    def pop_frames(self):
+        """揃ったフレームを (フレーム数, frame_samples) の配列 (内部バッファのビュー) で返す"""
+        n_frames = (self._end - self._start) // self.frame_bytes
+        frames = np.frombuffer(self._buf, dtype=self.dtype,
+                               count=n_frames * self.frame_samples,
+                               offset=self._start).reshape(n_frames, self.frame_samples)
+        self._start += n_frames * self.frame_bytes
+        return frames
+
+    def needed(self):
+        """次のフレームを揃えるのに必要なバイト数"""
+        return self.frame_bytes - (self._end - self._start) % self.frame_bytes
+
+    def reset(self):
+        """端数を捨ててフレーム境界を合わせ直す"""
+        self._start = self._end = 0
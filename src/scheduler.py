@@ -0,0 +1,55 @@
+"""
+受信したサンプル数 (STFT のフレーム番号) を時計にした推論のスケジューラ
+壁時計 (time.time() / QTimer) を使わないので、同じデータを再生すれば同じ窓で推論し、
+オフラインの再生は実時間より速く流せる
+"""
+from config import *
+
+
+class InferenceScheduler:
+    """
+    push_frames() でフレーム数と onset (ActivityDetector.pop_onsets()) を受け取り、
+    poll() で推論すべき (理由, 窓の終わりのフレーム番号) を返す
+        "onset": onset から onset_delay サンプル後 (ジェスチャーが窓の決まった位置に来る)
+        "tick" : 最後の推論から interval 秒経っても推論していない時の定期実行
+    フレーム番号は reset からの通し番号 (1フレーム = hop_length サンプル)
+    """
+    def __init__(self, interval=INFERENCE_INTERVAL, onset_delay=INFERENCE_ONSET_DELAY,
+                 hop_length=HOP_LENGTH, sr=SAMPLE_RATE):
+        self.hop_length = hop_length
+        self.sr = sr
+        self.interval_frames = max(1, int(round(interval * sr / hop_length)))
+        self.delay_frames = max(0, int(round(onset_delay / hop_length)))
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self._onset_due = None     # 次の onset 推論のフレーム番号
+        self._next_tick = self.interval_frames
+        self.fired = {"onset": 0, "tick": 0}
+
+    @property
+    def time(self):
+        """ストリーム上の現在時刻 (秒)。クールダウンなどもこれで測れば再生しても同じ結果になる"""
+        return self.frames * self.hop_length / self.sr
+
+    def push_frames(self, count, onsets=()):
+        """count フレーム進め、その間に検出した onset のフレーム番号を登録する"""
+        self.frames += count
+        for onset in onsets:
+            # 推論待ちの onset がある間の onset (ダブルタップの2回目など) は同じ窓に入るのでまとめる
+            if self._onset_due is None:
+                self._onset_due = onset + self.delay_frames
+
+    def poll(self):
+        """推論すべきものがあれば (理由, 窓の終わりのフレーム番号) を返す。なければ None"""
+        if self._onset_due is not None and self._onset_due <= self.frames:
+            end, reason = self._onset_due, "onset"
+            self._onset_due = None
+        elif self._next_tick <= self.frames:
+            end, reason = self._next_tick, "tick"
+        else:
+            return None
+        self._next_tick = end + self.interval_frames
+        self.fired[reason] += 1
+        return reason, end
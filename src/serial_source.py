@@ -0,0 +1,147 @@
+import struct
+import numpy as np
+from config import *
+from ring_buffer import FrameAssembler
+
+# sync フレーム形式 (arduino/esp_serial/esp_serial.ino の USE_SYNC_FRAMING と合わせる)
+#   同期ワード 0xA5 0x5A | ペイロード長 (uint16) | PCM int16 ... | チェックサム (ペイロードのバイト和, uint16)
+SYNC_WORD = b"\xa5\x5a"
+FRAME_HEADER = struct.Struct("<2sH")
+FRAME_TRAILER = struct.Struct("<H")
+
+def frame_checksum(payload):
+    return int(np.frombuffer(payload, dtype=np.uint8).sum()) & 0xFFFF
+
+def encode_sync_frame(pcm):
+    """int16 PCM を sync フレームにする (テスト・シミュレータ用)"""
+    payload = np.asarray(pcm, dtype=DTYPE).tobytes()
+    return (FRAME_HEADER.pack(SYNC_WORD, len(payload)) + payload
+            + FRAME_TRAILER.pack(frame_checksum(payload)))
+
+
+class SyncFrameParser:
+    """
+    sync フレームを事前確保したバッファ上で切り出す
+    同期ワード・長さ・チェックサムが合わなければ1バイトずつずらして同期し直す
+    """
+    def __init__(self, max_payload=SERIAL_MAX_PAYLOAD, max_frames=8, dtype=DTYPE):
+        self.max_payload = max_payload
+        self.dtype = np.dtype(dtype)
+        self.max_frame = FRAME_HEADER.size + max_payload + FRAME_TRAILER.size
+        self._buf = bytearray(self.max_frame * max_frames)
+        self._view = memoryview(self._buf)
+        self._u8 = np.frombuffer(self._buf, dtype=np.uint8)
+        self._start = 0
+        self._end = 0
+        self._in_sync = False     # 起動直後のフレーム途中からの受信は再同期に数えない
+        self.resyncs = 0          # 同期を失って探し直した回数
+        self.dropped_bytes = 0    # 同期探索で読み捨てたバイト数
+
+    def write_view(self):
+        """空き領域のビューを返す (前回 pop_frames() で返したビューはここで無効になる)"""
+        if len(self._buf) - self._end < self.max_frame:
+            remain = self._end - self._start
+            self._u8[:remain] = self._u8[self._start:self._end]
+            self._start, self._end = 0, remain
+        return self._view[self._end:]
+
+    def commit(self, n):
+        self._end += n
+
+    def _skip(self, n):
+        if self._in_sync:
+            self._in_sync = False
+            self.resyncs += 1
+        self._start += n
+        self.dropped_bytes += n
+
+    def pop_frames(self):
+        """揃った正しいフレームの PCM (内部バッファのビュー) をリストで返す"""
+        frames = []
+        while self._end - self._start >= FRAME_HEADER.size:
+            sync, length = FRAME_HEADER.unpack_from(self._buf, self._start)
+            if sync != SYNC_WORD:
+                pos = self._buf.find(SYNC_WORD, self._start + 1, self._end)
+                self._skip((pos if pos >= 0 else self._end - 1) - self._start)
+                continue
+            if length > self.max_payload or length % self.dtype.itemsize:
+                self._skip(1)
+                continue
+
+            total = FRAME_HEADER.size + length + FRAME_TRAILER.size
+            if self._end - self._start < total:
+                break
+            payload_at = self._start + FRAME_HEADER.size
+            payload = self._view[payload_at:payload_at + length]
+            (checksum,) = FRAME_TRAILER.unpack_from(self._buf, payload_at + length)
+            if checksum != frame_checksum(payload):
+                self._skip(1)
+                continue
+
+            frames.append(np.frombuffer(self._buf, dtype=self.dtype,
+                                        count=length // self.dtype.itemsize, offset=payload_at))
+            self._start += total
+            self._in_sync = True
+        return frames
+
+    def needed(self):
+        """次のフレームを揃えるのに最低限必要なバイト数"""
+        pending = self._end - self._start
+        if pending < FRAME_HEADER.size:
+            return FRAME_HEADER.size - pending
+        sync, length = FRAME_HEADER.unpack_from(self._buf, self._start)
+        if sync != SYNC_WORD or length > self.max_payload:
+            return 1
+        return max(1, FRAME_HEADER.size + length + FRAME_TRAILER.size - pending)
+
+    def reset(self):
+        self._start = self._end = 0
+        self._in_sync = False
+
+
+class SerialSource:
+    """
+    シリアルポートから PCM を受信する
+    in_waiting のポーリングと sleep の代わりに、1フレーム分揃うまでブロックする一括読み出しを行う
+    framing="raw": 生の int16 ストリーム / "sync": 同期ワード付きフレーム (破損しても自動で同期し直す)
+    """
+    def __init__(self, port=None, baud_rate=SERIAL_BAUD_RATE, framing=SERIAL_FRAMING,
+                 frame_bytes=BUFFER_SIZE * 2, dtype=DTYPE, serial_conn=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.framing = framing
+        self.serial_conn = serial_conn
+        if framing == "sync":
+            self.parser = SyncFrameParser(dtype=dtype)
+        elif framing == "raw":
+            self.parser = FrameAssembler(frame_bytes, dtype=dtype)
+        else:
+            raise ValueError(f"unknown serial framing: {framing}")
+
+    def open(self):
+        if self.serial_conn is None:
+            import serial
+            self.serial_conn = serial.Serial(self.port, self.baud_rate, timeout=SERIAL_READ_TIMEOUT)
+        self.serial_conn.reset_input_buffer()
+        self.parser.reset()
+
+    @property
+    def resyncs(self):
+        return getattr(self.parser, "resyncs", 0)
+
+    def read_frames(self):
+        """
+        1回読み出して、揃ったフレームを返す (タイムアウト時は空)
+        raw: (フレーム数, サンプル数) の配列 / sync: フレームごとの配列のリスト
+        返す配列は内部バッファのビューなので、次の呼び出しまでに使い終えること
+        """
+        view = self.parser.write_view()
+        # 溜まっている分は一度に読み、足りなければ1フレーム分揃うまで待つ
+        size = min(len(view), max(self.serial_conn.in_waiting, self.parser.needed()))
+        n = self.serial_conn.readinto(view[:size])
+        self.parser.commit(n)
+        return self.parser.pop_frames()
+
+    def close(self):
+        if self.serial_conn and self.serial_conn.is_open:
+            self.serial_conn.close()
@@ -0,0 +1,157 @@
+"""
+共有メモリ受信デーモン
+UDP ソケットはこのプロセスだけが持ち、デバイスごとのサンプルを共有メモリ上のリングへ書き込む
+GUI・推論・データ収集など複数のプロセスは、ソケットを開かずに同じリングを読み出せる
+
+    python shm_ingest.py                        # DEFAULT_DEVICE のみ
+    python shm_ingest.py saw-ring-1 saw-ring-3  # DEVICE_PORTS から選ぶ
+
+読み出し側は sources.create_source("shm", device_id=...) を使う
+"""
+import os
+import sys
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from config import *
+from ring_buffer import SampleRing
+from udp import UDPListener
+
+SHM_PREFIX = "saw-ring."
+# 先頭の管理領域 (uint64 x 8): 書き込み位置, capacity, max_write, サンプリングレート, 残りは予備
+HEADER_WORDS = 8
+HEADER_BYTES = HEADER_WORDS * 8
+WRITE_POS, CAPACITY, MAX_WRITE, RATE = range(4)
+
+def shm_name(device_id):
+    return SHM_PREFIX + device_id
+
+
+def attach_shared_memory(device_id):
+    """
+    既存の共有メモリを読み出し側として開く
+    読み出し側の終了時に共有メモリが削除されないよう、resource_tracker には登録しない
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(shm_name(device_id), track=False)
+    # 3.12 以前は track 引数がないので、開いた後で登録を外す
+    # (登録は POSIX のみで、名前は shm.name の先頭に "/" を付けたもの)
+    shm = shared_memory.SharedMemory(shm_name(device_id))
+    if os.name == "posix":
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+    return shm
+
+
+class SharedSampleRing(SampleRing):
+    """
+    共有メモリ上に置いた SampleRing
+    書き込み位置 (write_pos) も共有メモリに置き、書き込みはデーモン1プロセスだけが行う
+    読み出し側はコピーの前後で write_pos を確認し、読んでいる間に上書きされた分を捨てる
+    """
+    def __init__(self, device_id, capacity=RING_CAPACITY, max_write=BUFFER_SIZE * 2, create=False):
+        self.device_id = device_id
+        if create:
+            size = HEADER_BYTES + (capacity + max_write) * np.dtype(DTYPE).itemsize
+            try:
+                self.shm = shared_memory.SharedMemory(shm_name(device_id), create=True, size=size)
+            except FileExistsError:
+                # 前回のデーモンが異常終了して残った領域は作り直す
+                stale = shared_memory.SharedMemory(shm_name(device_id))
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(shm_name(device_id), create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(device_id)
+
+        self._header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        if create:
+            self._header[:] = 0
+            self._header[CAPACITY] = capacity
+            self._header[MAX_WRITE] = max_write
+            self._header[RATE] = SAMPLE_RATE
+        capacity = int(self._header[CAPACITY])
+        max_write = int(self._header[MAX_WRITE])
+        buffer = np.ndarray((capacity + max_write,), dtype=DTYPE, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if not create:
+            buffer.flags.writeable = False
+        self.owner = create
+        super().__init__(capacity, max_write, DTYPE, buffer=buffer)
+
+    @property
+    def write_pos(self):
+        return int(self._header[WRITE_POS])
+
+    @write_pos.setter
+    def write_pos(self, value):
+        # SampleRing.__init__ の初期化 (= 0) で既存の書き込み位置を消さないよう、読み出し側では無視する
+        if self.owner:
+            self._header[WRITE_POS] = value
+
+    def read(self, cursor, scale=1.0 / NORM_FACTOR, max_samples=None):
+        while True:
+            data, new_cursor = super().read(cursor, scale, max_samples)
+            if data is None:
+                return data, new_cursor
+            # コピー中に書き込み側が追い越した分 (上書き済み) を捨てる
+            valid_from = self.write_pos + self.max_write - self.capacity
+            start = new_cursor - len(data)
+            if start >= valid_from:
+                return data, new_cursor
+            skip = valid_from - start
+            self.overruns += skip
+            if skip < len(data):
+                return data[skip:], new_cursor
+            cursor = valid_from
+
+    def close(self):
+        # 共有メモリを指している配列・ビューを先に手放す
+        self._bytes.release()
+        self._bytes = None
+        self._buf = None
+        self._header = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemoryIngest:
+    """UDPListener の受信先を共有メモリ上のリングにしたもの"""
+    def __init__(self, device_ids=None, packet_format=PACKET_FORMAT, conceal=GAP_CONCEAL):
+        if not device_ids:
+            device_ids = [DEFAULT_DEVICE]
+        devices = {device_id: DEVICE_PORTS[device_id] for device_id in device_ids}
+        self.rings = {device_id: SharedSampleRing(device_id, create=True) for device_id in devices}
+        self.listener = UDPListener(devices, packet_format, conceal, rings=self.rings)
+
+    def start(self):
+        self.listener.start()
+        for device_id, ring in self.rings.items():
+            print(f"[SHM] {device_id} -> /dev/shm/{ring.shm.name}")
+
+    def stop(self):
+        self.listener.stop()
+        for ring in self.rings.values():
+            ring.close()
+
+
+def main():
+    unknown = [device_id for device_id in sys.argv[1:] if device_id not in DEVICE_PORTS]
+    if unknown:
+        print(f"不明なデバイスID: {', '.join(unknown)} (DEVICE_PORTS: {', '.join(DEVICE_PORTS)})")
+        sys.exit(1)
+
+    ingest = SharedMemoryIngest(sys.argv[1:])
+    ingest.start()
+    try:
+        while True:
+            time.sleep(5.0)
+            for device_id, ring in ingest.rings.items():
+                print(f"[SHM] {device_id}: {ring.write_pos / SAMPLE_RATE:.1f} 秒分受信")
+    except KeyboardInterrupt:
+        print("\n[SHM] 停止します")
+    finally:
+        ingest.stop()
+
+
+if __name__ == "__main__":
+    main()
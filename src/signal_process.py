@@ -2,55 +2,112 @@ import numpy as np
 import librosa
 from config import *
 
+
+def check_dtype(name, array, dtype=FLOAT_DTYPE):
+    """段の境界で型を確かめる (暗黙の float64 への変換があれば TypeError)。array をそのまま返す"""
+    if array is not None and array.dtype != dtype:
+        raise TypeError(f"{name}: dtype {array.dtype} (expected {np.dtype(dtype)})")
+    return array
+
+
+class STFTFrames:
+    """
+    連続したストリームから hop_length ごとの振幅スペクトル (n_fft // 2 + 1, フレーム数) を計算する
+    表示用のメルスペクトログラムと推論用の PCEN はここで計算したフレームを共有する (デバイスごとに1つ)
+    pad: ストリーム先頭に置くゼロの数 (n_fft // 2 で librosa の center=True と同じフレーム位置)
+    計算と出力は FLOAT_DTYPE (float32)。float64 のチャンクを渡してもここで揃える
+    """
+    def __init__(self, n_fft=N_FFT, hop_length=HOP_LENGTH, window=None, pad=None):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        # 既定は librosa と同じ周期的なハン窓
+        window = librosa.filters.get_window("hann", n_fft) if window is None else window
+        self.window = np.asarray(window, dtype=FLOAT_DTYPE)
+        self.pad = n_fft // 2 if pad is None else pad
+        # 直前の n_fft - hop_length サンプル (履歴) + 未処理のサンプル
+        self._history = n_fft - hop_length
+        self.reset()
+
+    def reset(self):
+        """ストリームが途切れた (再接続など) 時に状態を捨てる"""
+        self._samples = np.zeros(max(self.pad, self._history) + self.hop_length * 64, dtype=FLOAT_DTYPE)
+        self._filled = self.pad
+        self.frames_total = 0
+
+    def push(self, new_audio_chunk):
+        """
+        新しいサンプルで揃ったフレームの振幅スペクトル (n_fft // 2 + 1, フレーム数) を返す (揃わなければ None)
+        揃ったフレームは履歴バッファ上のストライドビューでまとめて切り出し、1回の rfft で計算する
+        """
+        if new_audio_chunk is None or len(new_audio_chunk) == 0:
+            return None
+        samples = np.asarray(new_audio_chunk, dtype=FLOAT_DTYPE)
+
+        n = len(samples)
+        if self._filled + n > len(self._samples):
+            grown = np.zeros(max(self._filled + n, len(self._samples) * 2), dtype=FLOAT_DTYPE)
+            grown[:self._filled] = self._samples[:self._filled]
+            self._samples = grown
+        self._samples[self._filled:self._filled + n] = samples
+        self._filled += n
+
+        hops = (self._filled - self._history) // self.hop_length
+        if hops <= 0:
+            return None
+        used = hops * self.hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(
+            self._samples[:self._history + used], self.n_fft)[::self.hop_length]
+        magnitude = np.abs(np.fft.rfft(frames * self.window, axis=1)).T
+        self.frames_total += hops
+
+        # 次のフレームに必要な履歴と端数だけを先頭へ詰める
+        remaining = self._filled - used
+        self._samples[:remaining] = self._samples[used:self._filled]
+        self._filled = remaining
+        return magnitude
+
+
 class DSPProcessor:
     def __init__(self):
-        self.audio_buffer = np.zeros(N_FFT, dtype=np.float32)
         self.mel_basis = librosa.filters.mel(
             sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS
         )
-        self._residual = np.zeros(0, dtype=np.float32)
+        # 単体で使う時の STFT (従来どおり np.hanning の窓、先頭は N_FFT - HOP_LENGTH のゼロ)
+        self.stft = STFTFrames(window=np.hanning(N_FFT), pad=N_FFT - HOP_LENGTH)
+        self._fft_window = np.hanning(FFT_SIZE).astype(FLOAT_DTYPE)
+        self._fft_freqs = np.fft.rfftfreq(FFT_SIZE, 1/SAMPLE_RATE)
 
     def process_spectrogram_column(self, new_audio_chunk):
-        if new_audio_chunk is None or len(new_audio_chunk) == 0:
-            return None
-        self._residual = np.concatenate([self._residual, new_audio_chunk])
+        """新しいサンプルで揃ったホップ数分のメルスペクトログラム列 (N_MELS, 列数) を返す"""
+        return self.mel_columns(self.stft.push(new_audio_chunk))
 
-        cols = []
-        while len(self._residual) >= HOP_LENGTH:
-            hop_chunk = self._residual[:HOP_LENGTH]
-            self._residual = self._residual[HOP_LENGTH:]
+    def mel_columns(self, magnitude):
+        """
+        振幅スペクトル (N_FFT // 2 + 1, フレーム数) を表示用のメルスペクトログラム列 (0〜1) にする
+        共有の STFTFrames から受け取ったフレームをそのまま渡せる
+        """
+        if magnitude is None or magnitude.shape[1] == 0:
+            return None
+        mel_spec = self.mel_basis @ magnitude
 
-            self.audio_buffer = np.roll(self.audio_buffer, -HOP_LENGTH)
-            self.audio_buffer[-HOP_LENGTH:] = hop_chunk
+        # librosa.power_to_db(ref=1.0, top_db=80) を列ごとに適用したものと同じ
+        mel_db = 10.0 * np.log10(np.maximum(1e-10, mel_spec))
+        mel_db = np.maximum(mel_db, mel_db.max(axis=0) - 80.0)
 
-            windowed = self.audio_buffer * np.hanning(N_FFT)
-            magnitude = np.abs(np.fft.rfft(windowed))
-        
-            mel_spec = np.dot(self.mel_basis, magnitude)
-        
-            mel_db = librosa.power_to_db(mel_spec, ref=1.0)
-        
-            mel_norm = (mel_db + 80) / 80
-            mel_norm = np.clip(mel_norm, 0, 1)
-        
-            cols.append(mel_norm)
-        
-        if not cols:
-            return None
-        
-        return np.stack(cols, axis=1)
+        mel_norm = (mel_db + 80) / 80
+        mel_norm = np.clip(mel_norm, 0, 1)
+        return mel_norm
 
     def compute_fft(self, audio_chunk):
         """周波数分布を計算"""
         if len(audio_chunk) < FFT_SIZE:
-            padded = np.zeros(FFT_SIZE)
+            padded = np.zeros(FFT_SIZE, dtype=FLOAT_DTYPE)
             padded[:len(audio_chunk)] = audio_chunk
             audio_chunk = padded
         else:
             audio_chunk = audio_chunk[-FFT_SIZE:]
 
         # FFT計算
-        magnitude = np.abs(np.fft.rfft(audio_chunk * np.hanning(len(audio_chunk))))
-        freqs = np.fft.rfftfreq(len(audio_chunk), 1/SAMPLE_RATE)
+        magnitude = np.abs(np.fft.rfft(audio_chunk * self._fft_window))
         
-        return freqs, magnitude
\ No newline at end of file
+        return self._fft_freqs, magnitude
@@ -0,0 +1,270 @@
+"""
+SAW-Ring デバイスシミュレータ
+データ収集アプリで録音した WAV を、arduino/udp/udp.ino・arduino/tcp/tcp.ino と同じ形式で送信する
+
+    python simulator.py udp ../data/skin --devices 4 --speed 10 --loss 0.01 --reorder 0.01
+    python simulator.py tcp ../data/skin/person_1/swipe_1.wav --loop
+    python simulator.py udp ../data/skin --host 239.255.42.1 --interface 127.0.0.1   # ループバックでマルチキャスト
+"""
+import argparse
+import glob
+import ipaddress
+import os
+import random
+import socket
+import threading
+import time
+import wave
+import numpy as np
+from config import *
+from packet import encode_packet, encode_adpcm_packet
+from adpcm import encode_blocks
+
+PACKET_BYTES = 1024      # 実機 (udp.ino / tcp.ino) の BUFFER_SIZE
+
+def find_wavs(paths):
+    """ファイル・ディレクトリの指定から WAV ファイルの一覧を作る (ディレクトリは再帰的に探す)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.wav"), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+def load_wav(path):
+    """16bit PCM の WAV を int16 のモノラル配列として読む"""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != np.dtype(DTYPE).itemsize:
+            raise ValueError(f"{path}: 16bit PCM の WAV のみ対応しています")
+        if wf.getframerate() != SAMPLE_RATE:
+            print(f"[SIM] 警告: {path} のサンプリングレートは {wf.getframerate()} Hz です (想定 {SAMPLE_RATE} Hz)")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=DTYPE)
+        return samples[::wf.getnchannels()]
+
+
+class VirtualDevice:
+    """
+    WAV を実機と同じ間隔のパケット列にして送る仮想デバイス
+    speed: 1.0 で実時間、10.0 で10倍速、0 で待たずに送る
+    loss / reorder: パケットを捨てる確率 / 次のパケットと入れ替える確率 (UDP のみ)
+    """
+    def __init__(self, samples, packet_bytes=PACKET_BYTES, speed=1.0, loop=False,
+                 loss=0.0, reorder=0.0, packet_format="raw", device_id=0, seed=None):
+        self.samples = samples
+        self.packet_samples = packet_bytes // np.dtype(DTYPE).itemsize
+        self.speed = speed
+        self.loop = loop
+        self.loss = loss
+        self.reorder = reorder
+        self.packet_format = packet_format
+        self.device_id = device_id
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.sent_bytes = 0
+        self.elapsed = 0.0
+
+    def packets(self):
+        """送信するパケットを順に返す (seq・sample_index は捨てたパケットの分も進める)"""
+        seq = 0
+        sample_index = 0
+        n_packets = len(self.samples) // self.packet_samples
+        if self.packet_format == "adpcm":
+            # パケットごとに独立しているので、全パケットを先にまとめて符号化しておく
+            blocks = self.samples[:n_packets * self.packet_samples].reshape(-1, self.packet_samples)
+            predictors, indices, nibbles = encode_blocks(blocks)
+        while True:
+            for i in range(n_packets):
+                pcm = self.samples[i * self.packet_samples:(i + 1) * self.packet_samples]
+                if self.packet_format == "v2":
+                    yield encode_packet(self.device_id, seq, sample_index, pcm)
+                elif self.packet_format == "adpcm":
+                    yield encode_adpcm_packet(self.device_id, seq, sample_index,
+                                              predictors[i], indices[i], nibbles[i])
+                else:
+                    yield pcm.tobytes()
+                seq += 1
+                sample_index += self.packet_samples
+            if not self.loop:
+                return
+
+    def paced(self, stop):
+        """packets() を実機の送信間隔 (÷speed) に合わせて返す"""
+        interval = self.packet_samples / SAMPLE_RATE / self.speed if self.speed > 0 else 0.0
+        started = time.monotonic()
+        for i, packet in enumerate(self.packets()):
+            if stop.is_set():
+                break
+            if interval:
+                # 1ms 以上先行している時だけ待つ (高倍速では sleep の粒度より間隔が短いため)
+                delay = started + i * interval - time.monotonic()
+                if delay > 0.001:
+                    stop.wait(delay)
+            self.elapsed = time.monotonic() - started
+            yield packet
+
+    def impaired(self, packets):
+        """パケットの欠落・順序の入れ替わりを加える"""
+        held = None
+        for packet in packets:
+            if self.random.random() < self.loss:
+                self.dropped += 1
+                continue
+            if held is None and self.random.random() < self.reorder:
+                held = packet
+                self.reordered += 1
+                continue
+            yield packet
+            if held is not None:
+                yield held
+                held = None
+        if held is not None:
+            yield held
+
+    def report(self, name):
+        rate = self.sent_bytes / self.elapsed if self.elapsed > 0 else 0.0
+        print(f"[SIM] {name}: 送信 {self.sent} パケット ({self.sent_bytes} bytes, {rate / 1000:.1f} kB/s), "
+              f"欠落 {self.dropped}, 入れ替え {self.reordered}, {self.elapsed:.2f} 秒")
+
+
+class UDPDeviceSimulator(threading.Thread):
+    """
+    udp.ino と同じく、PC の指定ポートへパケットを送りつける
+    host がマルチキャストアドレスの場合は multicast_if のインターフェースからグループへ送る
+    """
+    def __init__(self, device, host="127.0.0.1", port=UDP_PORT, multicast_if=MULTICAST_IF):
+        super().__init__(daemon=True)
+        self.device = device
+        self.host = host
+        self.port = port
+        self.multicast_if = multicast_if
+        self.stop_event = threading.Event()
+
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if ipaddress.ip_address(self.host).is_multicast:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # 同じ PC の受信プロセスにも届ける
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.multicast_if))
+        try:
+            for packet in self.device.impaired(self.device.paced(self.stop_event)):
+                try:
+                    sock.sendto(packet, (self.host, self.port))
+                except ConnectionRefusedError:
+                    pass  # 受信側が起動していなくても実機と同じく送り続ける
+                self.device.sent += 1
+                self.device.sent_bytes += len(packet)
+        finally:
+            sock.close()
+        self.device.report(f"UDP {self.host}:{self.port}")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class TCPDeviceSimulator(threading.Thread):
+    """tcp.ino と同じく、TCP サーバとして待ち受け、接続してきたクライアントへ生の PCM を流す"""
+    def __init__(self, device, host="0.0.0.0", port=TCP_PORT):
+        super().__init__(daemon=True)
+        self.device = device
+        self.host = host
+        self.port = port
+        self.stop_event = threading.Event()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.server.settimeout(SELECT_TIMEOUT)
+
+    def run(self):
+        print(f"[SIM] TCP サーバ起動: {self.host}:{self.port}")
+        packets = self.device.paced(self.stop_event)
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    client, addr = self.server.accept()
+                except socket.timeout:
+                    continue
+                print(f"[SIM] クライアント接続: {addr}")
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    for packet in packets:
+                        client.sendall(packet)
+                        self.device.sent += 1
+                        self.device.sent_bytes += len(packet)
+                    break  # 送り終えた
+                except OSError as e:
+                    # 実機と同じく、切断されたら次のクライアントを待つ (送信位置は進んだまま)
+                    print(f"[SIM] クライアント切断: {e}")
+                finally:
+                    client.close()
+        finally:
+            self.server.close()
+        self.device.report(f"TCP {self.host}:{self.port}")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音済み WAV を SAW-Ring と同じ形式で送信するシミュレータ")
+    parser.add_argument("transport", choices=["udp", "tcp"])
+    parser.add_argument("wavs", nargs="+", help="WAV ファイルまたはディレクトリ (data/texture/person_X/ など)")
+    parser.add_argument("--host", default=None, help="UDP: 送信先 (既定 127.0.0.1) / TCP: 待ち受けアドレス (既定 0.0.0.0)")
+    parser.add_argument("--interface", default=MULTICAST_IF,
+                        help="UDP: --host がマルチキャストアドレスの場合に送信するインターフェースのアドレス")
+    parser.add_argument("--port", type=int, default=None, help="先頭デバイスのポート (既定: UDP は DEVICE_PORTS, TCP は TCP_PORT)")
+    parser.add_argument("--devices", type=int, default=1, help="並列に動かす仮想デバイスの数")
+    parser.add_argument("--packet-bytes", type=int, default=PACKET_BYTES, help="1パケットの PCM バイト数 (符号化前)")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度 (1〜100, 0 で待たずに送る)")
+    parser.add_argument("--loop", action="store_true", help="最後まで送ったら繰り返す")
+    parser.add_argument("--loss", type=float, default=0.0, help="UDP パケットを捨てる確率")
+    parser.add_argument("--reorder", type=float, default=0.0, help="UDP パケットを入れ替える確率")
+    parser.add_argument("--format", choices=["raw", "v2", "adpcm"], default=PACKET_FORMAT,
+                        help="UDP パケット形式 (adpcm は v2 ヘッダ付きの 4bit IMA-ADPCM, 受信側は PACKET_FORMAT = \"v2\")")
+    parser.add_argument("--seed", type=int, default=None, help="欠落・入れ替えの乱数シード")
+    args = parser.parse_args()
+
+    files = find_wavs(args.wavs)
+    if not files:
+        parser.error("WAV ファイルが見つかりません")
+    samples = np.concatenate([load_wav(path) for path in files])
+    print(f"[SIM] {len(files)} ファイル, {len(samples) / SAMPLE_RATE:.1f} 秒分を送信します")
+
+    if args.port is not None:
+        ports = [args.port + i for i in range(args.devices)]
+    elif args.transport == "udp":
+        ports = list(DEVICE_PORTS.values())[:args.devices]
+    else:
+        ports = [TCP_PORT + i for i in range(args.devices)]
+    if len(ports) < args.devices:
+        parser.error(f"--devices {args.devices} には --port の指定が必要です")
+
+    simulators = []
+    for i, port in enumerate(ports):
+        seed = None if args.seed is None else args.seed + i
+        device = VirtualDevice(samples, args.packet_bytes, args.speed, args.loop,
+                               args.loss, args.reorder, args.format, device_id=i, seed=seed)
+        if args.transport == "udp":
+            simulators.append(UDPDeviceSimulator(device, args.host or "127.0.0.1", port, args.interface))
+        else:
+            simulators.append(TCPDeviceSimulator(device, args.host or "0.0.0.0", port))
+
+    for simulator in simulators:
+        simulator.start()
+    try:
+        for simulator in simulators:
+            while simulator.is_alive():
+                simulator.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("\n[SIM] 停止します")
+        for simulator in simulators:
+            simulator.stop()
+        for simulator in simulators:
+            simulator.join(timeout=2.0)
+
+
+if __name__ == "__main__":
+    main()
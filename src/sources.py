@@ -0,0 +1,560 @@
+import asyncio
+import threading
+import time
+import wave
+import numpy as np
+from config import *
+from ring_buffer import SampleRing
+from udp import UDPListener
+from tcp import ReconnectingTCPSource
+from ble import BLESource
+from serial_source import SerialSource
+from shm_ingest import SharedSampleRing, shm_name
+from capture import CaptureReplayListener
+from clock import ClockEstimator, DriftResampler
+from forwarder import Aggregator
+from aio_ingest import AsyncIngestEngine, tcp_stream, ble_stream
+
+class SampleSource:
+    """
+    受信ソースの共通インターフェース
+    各バックエンドは専用スレッドで受信し、int16 のまま SampleRing に書き込む
+    読み出し側は get_data() / read_frames() で float32 (scale=None なら int16) を受け取る
+    on_status(メッセージ) / on_connected() / on_error(メッセージ) は受信スレッドから呼ばれる
+    clock は受信時刻から推定した実際のサンプリングレート・ジッタ (clock.py)
+    resample_ppm を指定すると、推定ドリフトがそれを超えた時に読み出し側で SAMPLE_RATE へリサンプルする
+    """
+    kind = None
+
+    def __init__(self, capacity=RING_CAPACITY, on_status=None, on_connected=None, on_error=None,
+                 resample_ppm=RESAMPLE_DRIFT_PPM):
+        self.ring = SampleRing(capacity)
+        self.cursor = 0
+        self.clock = ClockEstimator()
+        self.resample_ppm = resample_ppm
+        self._resampler = DriftResampler()
+        self._pending = None   # リサンプル後、フレームに満たず残ったサンプル
+        self.on_status = on_status
+        self.on_connected = on_connected
+        self.on_error = on_error      # 受信を続けられなくなった時 (スレッドは終了する)
+        self.running = False
+        self.thread = None
+        self._data = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._thread_main, daemon=True)
+        self.thread.start()
+
+    def _thread_main(self):
+        try:
+            self._run()
+        except Exception as e:
+            if not self._stop.is_set():
+                self._error(f"受信エラー: {e}")
+        finally:
+            self.running = False
+            self._data.set()  # 待っている読み出し側を起こす
+
+    def _run(self):
+        """受信ループ (stop() まで self._push() でサンプルを書き込む)"""
+        raise NotImplementedError
+
+    def _interrupt(self):
+        """ブロックしている受信を stop() から中断する"""
+
+    def _push(self, samples):
+        self.ring.write(samples)
+        self.clock.update(time.time_ns(), self.ring.write_pos)
+        self._data.set()
+
+    def _status(self, message, echo=True):
+        if echo:
+            print(f"[{self.kind}] {message}")
+        if self.on_status:
+            self.on_status(message)
+
+    def _connected(self):
+        if self.on_connected:
+            self.on_connected()
+
+    def _error(self, message):
+        print(f"[{self.kind}] {message}")
+        if self.on_error:
+            self.on_error(message)
+
+    def get_data(self, scale=1.0 / NORM_FACTOR):
+        """未読サンプルをまとめて返す (無ければ None)"""
+        data, self.cursor = self.ring.read(self.cursor, scale)
+        return self._correct_drift(data)
+
+    def _correct_drift(self, data):
+        """推定ドリフトが resample_ppm を超えていれば SAMPLE_RATE に合わせ直す"""
+        clock = self.clock
+        if not self.resample_ppm or not clock.ready() or abs(clock.drift_ppm) <= self.resample_ppm:
+            self._resampler.reset()
+            return data
+        if data is None:
+            return data
+        return self._resampler.process(data, clock.rate)
+
+    def read_frames(self, frame_samples=BUFFER_SIZE, timeout=SELECT_TIMEOUT, scale=1.0 / NORM_FACTOR):
+        """
+        frame_samples ずつ揃った未読サンプルを (フレーム数, frame_samples) の配列で返す
+        揃っていなければ timeout 秒まで待ち、それでも無ければ None (端数は次回に回す)
+        """
+        if self.resample_ppm:
+            return self._read_resampled_frames(frame_samples, timeout, scale)
+        n = self.ring.available(self.cursor) // frame_samples * frame_samples
+        if n == 0:
+            self._wait(timeout)
+            n = self.ring.available(self.cursor) // frame_samples * frame_samples
+            if n == 0:
+                return None
+        data, self.cursor = self.ring.read(self.cursor, scale, max_samples=n)
+        return data.reshape(-1, frame_samples)
+
+    def _read_resampled_frames(self, frame_samples, timeout, scale):
+        """リサンプル後のサンプル数はフレーム境界に揃わないので、端数を _pending に残しておく"""
+        pending = 0 if self._pending is None else len(self._pending)
+        data = self.get_data(scale)
+        if data is None and pending < frame_samples:
+            self._wait(timeout)
+            data = self.get_data(scale)
+        if data is not None:
+            self._pending = data if not pending else np.concatenate((self._pending, data))
+        if self._pending is None:
+            return None
+        n = len(self._pending) // frame_samples * frame_samples
+        if n == 0:
+            return None
+        frames = self._pending[:n].reshape(-1, frame_samples)
+        self._pending = self._pending[n:]
+        return frames
+
+    def _wait(self, timeout):
+        """新しいサンプルが書き込まれるか timeout 秒経つまで待つ"""
+        self._data.wait(timeout)
+        self._data.clear()
+
+    def stats(self):
+        stats = {
+            "kind": self.kind,
+            "samples": self.ring.write_pos,
+            "overruns": self.ring.overruns,
+        }
+        stats.update(self.clock.stats())
+        return stats
+
+    def stop(self):
+        self._stop.set()
+        self._interrupt()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+        self.thread = None
+        self.running = False
+
+
+class UDPSampleSource(SampleSource):
+    """UDPListener (1デバイス分) をソースとして使う"""
+    kind = "UDP"
+
+    def __init__(self, port=UDP_PORT, device_id=DEFAULT_DEVICE, packet_format=PACKET_FORMAT,
+                 conceal=GAP_CONCEAL, sock_buf_size=SOCKET_BUF_SIZE, multicast_group=MULTICAST_GROUP, **kwargs):
+        super().__init__(**kwargs)
+        self.device_id = device_id
+        self.listener = UDPListener({device_id: port}, packet_format, conceal,
+                                    on_data=lambda _: self._data.set(), sock_buf_size=sock_buf_size,
+                                    multicast_group=multicast_group)
+        # 受信スレッドは UDPListener が持つので、そのリングをそのまま読む
+        self.ring = self.listener.rings[device_id]
+        self.clock = self.listener.clocks[device_id]
+        self.cursor = self.ring.write_pos
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            self.listener.start()
+        except OSError as e:
+            self._error(f"Bind Error: {e}")
+            return
+        self.running = True
+        self._status(f"Listening on UDP port {self.listener.devices[self.device_id]}")
+        self._connected()
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(self.listener.get_stats(self.device_id))
+        return stats
+
+    def stop(self):
+        self.listener.stop()
+        self.running = False
+        self._data.set()
+
+
+class CaptureSampleSource(UDPSampleSource):
+    """キャプチャファイル (capture.py) のパケットを UDP 受信と同じ処理で再生する"""
+    kind = "Capture"
+
+    def __init__(self, path=REPLAY_PATH, device_id=None, speed=REPLAY_SPEED, conceal=GAP_CONCEAL, **kwargs):
+        SampleSource.__init__(self, **kwargs)
+        self.listener = CaptureReplayListener(path, speed, conceal,
+                                              on_data=lambda _: self._data.set(), on_end=self._on_end)
+        self.device_id = device_id or next(iter(self.listener.devices))
+        self.ring = self.listener.rings[self.device_id]
+        self.clock = self.listener.clocks[self.device_id]
+        self.cursor = self.ring.write_pos
+
+    def start(self):
+        if self.running:
+            return
+        self.listener.start()
+        self.running = True
+        self._status(f"Replaying {self.listener.reader.path} ({self.device_id}, x{self.listener.speed})")
+        self._connected()
+
+    def _on_end(self):
+        self._status("再生が終わりました")
+        self.running = False
+        self._data.set()
+
+
+class TCPSampleSource(SampleSource):
+    """ReconnectingTCPSource (切断時は自動で再接続) をソースとして使う"""
+    kind = "TCP"
+
+    def __init__(self, host=TCP_HOST, port=TCP_PORT, frame_bytes=BUFFER_SIZE * 2, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.frame_bytes = frame_bytes
+        self.tcp = None
+
+    def _run(self):
+        self.tcp = ReconnectingTCPSource(self.host, self.port, self.frame_bytes,
+                                         on_connected=lambda _: self._connected(),
+                                         on_disconnected=lambda reason: self._status(reason, echo=False))
+        if self._stop.is_set():
+            return
+        print(f"[{self.kind}] 接続中... {self.host}:{self.port}")
+        try:
+            while not self._stop.is_set():
+                frames = self.tcp.read_frames()
+                if frames is None:
+                    break
+                if len(frames):
+                    self._push(frames.ravel())
+        finally:
+            self.tcp.close()
+
+    def _interrupt(self):
+        if self.tcp:
+            self.tcp.stop()
+
+    def stats(self):
+        stats = super().stats()
+        if self.tcp:
+            stats.update(connects=self.tcp.connects, last_reconnect_time=self.tcp.last_reconnect_time)
+        return stats
+
+
+class BLESampleSource(SampleSource):
+    """BLESource (アドレスキャッシュ付き) をソースとして使う"""
+    kind = "BLE"
+
+    def __init__(self, name=BLE_DEVICE_NAME, characteristic_uuid=BLE_CHARACTERISTIC_UUID,
+                 frame_bytes=BUFFER_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.characteristic_uuid = characteristic_uuid
+        self.frame_bytes = frame_bytes
+        self.ble = None
+
+    def _run(self):
+        self.ble = BLESource(self.name, self.characteristic_uuid, self.frame_bytes,
+                             on_frames=lambda frames: self._push(frames.ravel()),
+                             on_status=self.on_status, on_connected=self._connected)
+        if self._stop.is_set():
+            return
+        try:
+            asyncio.run(self.ble.run())
+        except ConnectionError as e:
+            self._error(str(e))
+            return
+        if not self._stop.is_set():
+            self._error("BLE接続が予期せず切断されました。")
+
+    def _interrupt(self):
+        if self.ble:
+            self.ble.stop()
+
+    def stats(self):
+        stats = super().stats()
+        if self.ble:
+            stats.update(startup_time=self.ble.startup_time, used_scan=self.ble.used_scan)
+        return stats
+
+
+class SerialSampleSource(SampleSource):
+    """SerialSource (ブロッキング読み出し) をソースとして使う"""
+    kind = "Serial"
+
+    def __init__(self, port=SERIAL_PORT, baud_rate=SERIAL_BAUD_RATE, framing=SERIAL_FRAMING,
+                 frame_bytes=BUFFER_SIZE * 2, **kwargs):
+        super().__init__(**kwargs)
+        self.port = port
+        self.baud_rate = baud_rate
+        self.framing = framing
+        self.frame_bytes = frame_bytes
+        self.serial = None
+
+    def _run(self):
+        self.serial = SerialSource(self.port, self.baud_rate, self.framing, self.frame_bytes)
+        self.serial.open()
+        self._status(f"Connected to {self.serial.port} at {self.serial.baud_rate}")
+        self._connected()
+        try:
+            while not self._stop.is_set():
+                # SERIAL_READ_TIMEOUT ごとに戻ってくるので停止要求を確認できる
+                for frame in self.serial.read_frames():
+                    self._push(frame)
+        finally:
+            self.serial.close()
+
+    def stats(self):
+        stats = super().stats()
+        if self.serial:
+            stats["resyncs"] = self.serial.resyncs
+        return stats
+
+
+class FileSampleSource(SampleSource):
+    """
+    WAV ファイル (int16) を実機の代わりに再生するソース
+    speed=1.0 で実時間、speed=0 で待たずに流し込む。loop=True で繰り返す
+    """
+    kind = "File"
+
+    def __init__(self, path=REPLAY_PATH, speed=REPLAY_SPEED, loop=False, chunk=BUFFER_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.chunk = chunk
+        self.resample_ppm = 0   # 再生速度の違いがドリフトとして見えるので補正しない
+
+    def _run(self):
+        with wave.open(self.path, "rb") as wf:
+            if wf.getsampwidth() != np.dtype(DTYPE).itemsize:
+                raise ValueError(f"{self.path}: 16bit PCM の WAV のみ対応しています")
+            channels = wf.getnchannels()
+            if wf.getframerate() != SAMPLE_RATE:
+                print(f"[{self.kind}] 警告: サンプリングレートが {wf.getframerate()} Hz です (想定 {SAMPLE_RATE} Hz)")
+            self._status(f"Replaying {self.path} (x{self.speed})")
+            self._connected()
+
+            started = time.monotonic()
+            sent = 0
+            while not self._stop.is_set():
+                raw = wf.readframes(self.chunk)
+                if not raw:
+                    if not self.loop:
+                        self._status("再生が終わりました")
+                        break
+                    wf.rewind()
+                    continue
+                # 多チャンネルの場合は先頭チャンネルだけを使う
+                samples = np.frombuffer(raw, dtype=DTYPE)[::channels]
+                self._push(samples)
+                sent += len(samples)
+                if self.speed > 0:
+                    delay = started + sent / (wf.getframerate() * self.speed) - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+
+
+class SharedMemorySampleSource(SampleSource):
+    """
+    shm_ingest.py が共有メモリに書き込んでいるデバイスを読み出す
+    ソケットを開かないので、複数のプロセスが同じデバイスを同時に読める
+    """
+    kind = "SHM"
+
+    def __init__(self, device_id=DEFAULT_DEVICE, poll_interval=0.005, **kwargs):
+        super().__init__(**kwargs)
+        self.device_id = device_id
+        self.poll_interval = poll_interval   # 別プロセスの書き込みは通知されないので、この間隔で確認する
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            self.ring = SharedSampleRing(self.device_id)
+        except FileNotFoundError:
+            self._error(f"共有メモリ {shm_name(self.device_id)} が見つかりません (shm_ingest.py を起動してください)")
+            return
+        self.cursor = self.ring.write_pos
+        self.running = True
+        self._status(f"Attached to {shm_name(self.device_id)}")
+        self._connected()
+
+    def _wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        write_pos = self.ring.write_pos
+        while self.running and self.ring.write_pos == write_pos and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.ring.close()
+            self.ring = SampleRing(self.ring.capacity)
+
+
+class ForwardedSampleSource(SampleSource):
+    """forwarder.py の転送側から集約ノードへ送られてきたデバイスを読み出す"""
+    kind = "Forward"
+
+    def __init__(self, device_id=DEFAULT_DEVICE, port=FORWARD_PORT, **kwargs):
+        super().__init__(**kwargs)
+        self.device_id = device_id
+        self.port = port
+        self.aggregator = None
+
+    def start(self):
+        if self.running:
+            return
+        self.aggregator = Aggregator.shared(self.port)
+        try:
+            self.aggregator.start()
+        except OSError as e:
+            self.aggregator.release()
+            self.aggregator = None
+            self._error(f"Bind Error: {e}")
+            return
+        self.ring = self.aggregator.ring(self.device_id)
+        self.clock = self.aggregator.clocks[self.device_id]
+        self.cursor = self.ring.write_pos
+        self.aggregator.subscribe(self.device_id, self._data.set)
+        self.running = True
+        self._status(f"Waiting for {self.device_id} on port {self.port}")
+        self._connected()
+
+    def stats(self):
+        stats = super().stats()
+        if self.aggregator:
+            stats.update(self.aggregator.get_stats(self.device_id))
+        return stats
+
+    def stop(self):
+        if self.aggregator:
+            self.aggregator.unsubscribe(self.device_id, self._data.set)
+            self.aggregator.release()
+            self.aggregator = None
+        self.running = False
+        self._data.set()
+
+
+class AsyncIngestSampleSource(SampleSource):
+    """
+    aio_ingest.AsyncIngestEngine (asyncio のイベントループ + 上限付きバッファ) の1デバイス分をソースとして使う
+    読み出しが滞った時は policy ("drop_oldest" / "drop_newest" / "block") に従い、捨てた数は stats() の shed_samples
+    transport: "udp" (port, packet_format, conceal, sock_buf_size, multicast_group) / "tcp" (host, port) / "ble" (address)
+    TCP は切断・無通信タイムアウトの後も TCPSampleSource と同じバックオフで再接続し続ける
+    """
+    kind = "AIO"
+
+    def __init__(self, transport="udp", device_id=DEFAULT_DEVICE, port=None, host=TCP_HOST, address=None,
+                 characteristic_uuid=BLE_CHARACTERISTIC_UUID, frame_bytes=BUFFER_SIZE * 2,
+                 buffer_size=INGEST_BUFFER_SIZE, policy=OVERFLOW_POLICY, packet_format=PACKET_FORMAT,
+                 conceal=GAP_CONCEAL, sock_buf_size=SOCKET_BUF_SIZE, multicast_group=MULTICAST_GROUP, **kwargs):
+        super().__init__(**kwargs)
+        self.resample_ppm = 0   # リングを通らないので読み出し側ではリサンプルしない
+        self.transport = transport
+        self.device_id = device_id
+        self.engine = AsyncIngestEngine(buffer_size, policy, on_error=self._on_stream_end)
+        if transport == "udp":
+            self.engine.add_udp(device_id, UDP_PORT if port is None else port, packet_format=packet_format,
+                                conceal=conceal, sock_buf_size=sock_buf_size, multicast_group=multicast_group)
+        elif transport == "tcp":
+            self.engine.add_stream(device_id, tcp_stream(host, TCP_PORT if port is None else port, frame_bytes))
+        elif transport == "ble":
+            if address is None:
+                raise ValueError("aio ソースの BLE はデバイスのアドレスが必要です")
+            self.engine.add_stream(device_id, ble_stream(address, characteristic_uuid))
+        else:
+            raise ValueError(f"unknown transport: {transport} (choose from udp, tcp, ble)")
+        self.buffer = self.engine.buffers[device_id]
+        self.buffer.on_data = self._on_data
+        self._received = 0
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            self.engine.start()
+        except OSError as e:
+            self._error(f"Bind Error: {e}")
+            return
+        self.running = True
+        self._status(f"Ingest engine started ({self.transport}, policy: {self.buffer.policy})")
+        self._connected()
+
+    def _on_data(self, n):
+        self._received += n
+        self.clock.update(time.time_ns(), self._received)
+        self._data.set()
+
+    def _on_stream_end(self, device_id, message):
+        # エンジン側で表示済みなので on_error にだけ伝える
+        self.running = False
+        if self.on_error:
+            self.on_error(message)
+        self._data.set()
+
+    def get_data(self, scale=1.0 / NORM_FACTOR):
+        """上限付きバッファに溜まっているサンプルをまとめて返す (無ければ None)"""
+        return self.buffer.get(scale)
+
+    def read_frames(self, frame_samples=BUFFER_SIZE, timeout=SELECT_TIMEOUT, scale=1.0 / NORM_FACTOR):
+        # 上限付きバッファはフレーム境界を持たないので、リサンプル時と同じく端数を次回に回す
+        return self._read_resampled_frames(frame_samples, timeout, scale)
+
+    def stats(self):
+        stats = super().stats()
+        stats["samples"] = self._received
+        stats.update(self.buffer.stats())
+        protocol = self.engine.protocols.get(self.device_id)
+        if protocol is not None and protocol.packet_format == "v2":
+            stats.update(protocol.tracker.stats())
+        return stats
+
+    def stop(self):
+        self.engine.stop()
+        self.running = False
+        self._data.set()
+
+
+SOURCE_TYPES = {
+    "udp": UDPSampleSource,
+    "tcp": TCPSampleSource,
+    "ble": BLESampleSource,
+    "serial": SerialSampleSource,
+    "file": FileSampleSource,
+    "shm": SharedMemorySampleSource,
+    "capture": CaptureSampleSource,
+    "forward": ForwardedSampleSource,
+    "aio": AsyncIngestSampleSource,
+}
+
+def create_source(kind=SOURCE_TYPE, **kwargs):
+    """種類名 ("udp" / "tcp" / "ble" / "serial" / "file" / "shm" / "capture" / "forward" / "aio") からソースを作る"""
+    if kind not in SOURCE_TYPES:
+        raise ValueError(f"unknown source type: {kind} (choose from {', '.join(SOURCE_TYPES)})")
+    return SOURCE_TYPES[kind](**kwargs)
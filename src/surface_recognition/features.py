@@ -0,0 +1,165 @@
+"""
+推論用の PCEN 特徴量
+extract_pcen は学習時と同じ特徴量を 2 秒分の窓全体から計算する
+StreamingPCEN は新しく揃ったホップ分のメルフレームを溜めておき、推論ごとには窓に依存する部分だけを計算して同じ特徴量を返す
+"""
+import numpy as np
+import librosa
+import scipy.signal
+from config import FLOAT_DTYPE
+from signal_process import STFTFrames
+from ring_buffer import RollingWindow
+
+
+def extract_pcen(audio, sr=24000, n_mels=128, n_fft=1024, hop_length=256, fixed_width=188):
+    # fixed width: 出力するスペクトログラムの時間軸の長さ (基本188(2s))
+    y = audio
+    y = y - np.mean(y)  # DCオフセット除去
+
+    if len(y) < n_fft:
+        y = librosa.util.fix_length(y, size=n_fft)
+
+    melspec = librosa.feature.melspectrogram(
+        y=y, sr=sr,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        n_mels=n_mels,
+        power=1.0 # power=1.0 -> 振幅スペクトログラム
+    )
+
+    pcen = librosa.pcen(
+        melspec * (2**20),
+        sr=sr,
+        hop_length=hop_length,
+        time_constant=0.3,
+        gain=0.98,
+        bias=2,
+        power=0.5
+    )
+
+    current_width = pcen.shape[1]
+
+    if current_width < fixed_width:
+        # 足りない場合は右側を0埋め (パディング)
+        pad_width = fixed_width - current_width
+        min_val = pcen.min() # その画像の背景レベルを取得
+        pcen = np.pad(pcen, ((0, 0), (0, pad_width)), mode='constant', constant_values=min_val)
+    else:
+        # 長すぎる場合は先頭から固定長だけ切り出し (トリミング)
+        pcen = pcen[:, :fixed_width]
+
+
+    return pcen
+
+
+class StreamingPCEN:
+    """
+    push() でサンプルを受け取り、features() で extract_pcen と同じ PCEN 特徴量 (n_mels, fixed_width) を返す
+    メルフレームは新しく揃ったホップ分だけ計算して溜めておき (ストリーム上の center=True の STFT と同じ位置)、
+    features() では窓ごとに変わる部分だけを計算し直す
+        - 窓の平均値除去: 周期的なハン窓では定数成分が 0, 1 番目のビンにしか出ないので、そのビンだけ直す
+        - 窓の両端でゼロパディングに掛かるフレームだけ STFT し直す (ストリーム開始直後は開始前のフレームも)
+        - PCEN の平滑化フィルタは extract_pcen と同じく窓の先頭から掛け直す (128 x 188 なので軽い)
+    ストリームの開始前はゼロとして扱う (ゼロで埋めた window_samples のバッファに extract_pcen を掛けたものと同じ)
+    表示と STFT を共有する場合は、共有の STFTFrames の出力と元のサンプルを push_frames() で渡す
+    """
+    def __init__(self, sr=24000, n_mels=128, n_fft=1024, hop_length=256, fixed_width=188,
+                 time_constant=0.3, gain=0.98, bias=2, power=0.5, max_lag=94, window_samples=48000):
+        if 1 + window_samples // hop_length != fixed_width:
+            raise ValueError(f"window of {window_samples} samples does not give {fixed_width} frames")
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.fixed_width = fixed_width
+        self.window_samples = window_samples   # extract_pcen に渡していた窓の長さ
+        # features(end=...) で過去の窓を取り出せるよう、fixed_width より max_lag フレーム多く残す
+        self.max_lag = max_lag
+        self.gain = gain
+        self.bias = bias
+        self.power = power
+        # 平滑化フィルタの係数と初期状態 (librosa.pcen と同じ求め方)
+        t_frames = time_constant * sr / float(hop_length)
+        b = (np.sqrt(1 + 4 * t_frames**2) - 1) / (2 * t_frames**2)
+        self._ba = (np.array([b], dtype=FLOAT_DTYPE), np.array([1, b - 1], dtype=FLOAT_DTYPE))
+        self._zi = np.full((n_mels, 1), scipy.signal.lfilter_zi([b], [1, b - 1])[0], dtype=FLOAT_DTYPE)
+        self.stft = STFTFrames(n_fft=n_fft, hop_length=hop_length)
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, dtype=FLOAT_DTYPE)
+
+        # 窓の平均値 m を引くと、ビン k の値は m * sum(window * e^{-2πikn/N}) だけ変わる
+        n = np.arange(n_fft)
+        dc_basis = self.stft.window[:, None] * np.exp(-2j * np.pi * np.arange(2) * n[:, None] / n_fft)
+        self._dc_basis = dc_basis.astype(np.complex64)
+        self._dc_response = self._dc_basis.sum(axis=0)
+        # 窓の両端でゼロパディングに掛かるフレーム (extract_pcen の center=True)
+        half = n_fft // 2
+        centers = np.arange(fixed_width) * hop_length
+        self._edges = np.flatnonzero((centers < half) | (centers + half > window_samples))
+        self._inner = np.flatnonzero((centers >= half) & (centers + half <= window_samples))
+
+        self._mel = RollingWindow(fixed_width + max_lag, shape=(n_mels,))
+        self._samples = RollingWindow((fixed_width + max_lag) * hop_length + n_fft)
+        self.reset()
+
+    def reset(self):
+        """ストリームが途切れた (再接続など) 時に状態を捨てる"""
+        self.stft.reset()
+        self._mel.reset()
+        self._samples.reset()
+        self.frames_total = 0    # 溜めたメルフレームの通し番号 (次のフレームの番号)
+
+    def push(self, samples):
+        """新しいサンプルを追加する"""
+        self.push_frames(self.stft.push(samples), samples)
+
+    def push_frames(self, magnitude, samples):
+        """
+        振幅スペクトル (n_fft // 2 + 1, フレーム数) と、それを計算した STFTFrames に渡したサンプルを追加する
+        メル変換は新しいフレームの分だけここで行う
+        """
+        if samples is not None and len(samples) > 0:
+            self._samples.append(samples)
+        if magnitude is None or magnitude.shape[1] == 0:
+            return
+        self._mel.append(self.mel_basis @ magnitude)
+        self.frames_total += magnitude.shape[1]
+
+    def features(self, end=None):
+        """
+        フレーム番号 end の直前までの fixed_width フレームの PCEN (n_mels, fixed_width) を返す (float32)
+        end を省略すると直近の窓。max_lag より古い end は残っている最も古い窓になる
+        """
+        if self.frames_total == 0:
+            return None
+        lag = 0 if end is None else min(max(self.frames_total - end, 0), self.max_lag, self.frames_total - 1)
+        end = self.frames_total - lag
+        mel = self._mel.latest(self.fixed_width, lag).copy()
+        start = (end - self.fixed_width) * self.hop_length
+        y = self._samples.latest_until(self.window_samples, start + self.window_samples)
+        mean = np.mean(y)
+
+        # ストリーム開始前のフレーム (最初の 2 秒の窓の左側) は溜めていないので、両端と同じく計算し直す
+        before_start = self.fixed_width - end
+        inner = self._inner[self._inner >= before_start]
+        redo = np.union1d(self._edges, np.arange(min(max(before_start, 0), self.fixed_width)))
+
+        # 窓の内側のフレーム: 平均値を引いた分だけ 0, 1 番目のビンの振幅を直す
+        half = self.n_fft // 2
+        if len(inner) > 0:
+            first = inner[0] * self.hop_length - half
+            frames = np.lib.stride_tricks.sliding_window_view(y, self.n_fft)[first::self.hop_length][:len(inner)]
+            bins = frames @ self._dc_basis
+            delta = np.abs(bins - mean * self._dc_response) - np.abs(bins)
+            mel[:, inner] += self.mel_basis[:, :2] @ delta.T
+
+        # 残りのフレーム: 平均値を引いてゼロで埋めた窓から計算し直す
+        padded = np.pad(y - mean, half)
+        redo_frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft)[redo * self.hop_length]
+        magnitude = np.abs(np.fft.rfft(redo_frames * self.stft.window, axis=1)).T
+        mel[:, redo] = self.mel_basis @ magnitude
+        return self._pcen(mel * FLOAT_DTYPE(2**20))
+
+    def _pcen(self, S, eps=1e-6):
+        """librosa.pcen (bias > 0, power > 0) と同じ計算を float32 のまま行う"""
+        b, a = self._ba
+        S_smooth, _ = scipy.signal.lfilter(b, a, S, zi=self._zi, axis=-1)
+        smooth = np.exp(-self.gain * (np.log(FLOAT_DTYPE(eps)) + np.log1p(S_smooth / eps)))
+        return (self.bias**self.power) * np.expm1(self.power * np.log1p(S * smooth / self.bias))
@@ -1,5 +1,7 @@
 from .models import *
+from .features import StreamingPCEN
 from config import *
+from signal_process import check_dtype
 
 class InferenceEngine:
     def __init__(self):
@@ -23,18 +25,42 @@ class InferenceEngine:
         self.model.to(self.device)
         self.model.eval() # 推論モードに設定
 
-    def predict(self, audio_buffer):
+        # 新しいサンプルだけからメルフレームを更新していき、推論ごとには extract_pcen と同じ特徴量を組み立てる
+        self.frontend = StreamingPCEN()
+
+    def push(self, new_audio_chunk):
+        """受信した新しいサンプルを特徴量計算に渡す"""
+        self.frontend.push(new_audio_chunk)
+
+    def push_frames(self, magnitude, new_audio_chunk):
+        """表示と共有の STFTFrames で計算した振幅スペクトルと、その元のサンプルを特徴量計算に渡す"""
+        self.frontend.push_frames(magnitude, new_audio_chunk)
+
+    def reset(self):
+        """ストリームが途切れた時に特徴量の状態を捨てる"""
+        self.frontend.reset()
+
+    def predict(self, audio_buffer=None, end=None):
         """
-        Numpyの音声データを受け取り、予測ラベルと確信度を返す
+        予測ラベルと確信度を返す
+        audio_buffer を渡した場合はその音声データ全体から、省略した場合は push() 済みのストリームから特徴量を作る
+        end: ストリームの窓の終わりのフレーム番号 (InferenceScheduler.poll() の値。省略すると直近の窓)
         """
         if not self.model_loaded:
             print("Model not loaded. Cannot perform prediction.")
             return "Error", 0.0
         
         # 前処理 (PCEN)
-        feature = extract_pcen(audio_buffer)
+        if audio_buffer is not None:
+            # 窓全体から計算し直す従来の経路 (librosa は float64 で計算するので、ここで FLOAT_DTYPE に揃える)
+            feature = extract_pcen(audio_buffer).astype(FLOAT_DTYPE)
+        else:
+            feature = self.frontend.features(end)
+            if feature is None:
+                return "None", 0.0
         
-        input_tensor = torch.tensor(feature, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
+        # float32 のままコピーせずにテンソルにする (float64 が紛れ込んでいればここで止める)
+        input_tensor = torch.from_numpy(check_dtype("model input", feature)).unsqueeze(0).unsqueeze(0)
         input_tensor = input_tensor.to(self.device)
 
         with torch.no_grad():
@@ -0,0 +1,189 @@
+import random
+import socket
+import threading
+import time
+import numpy as np
+from config import *
+from ring_buffer import FrameAssembler
+
+# (host, port) -> 解決済みアドレス (接続のたびに mDNS を引き直さないためのキャッシュ)
+_resolved_addrs = {}
+
+def resolve(host, port, refresh=False):
+    """名前解決の結果をキャッシュして返す"""
+    key = (host, port)
+    if refresh or key not in _resolved_addrs:
+        infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        _resolved_addrs[key] = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+    return _resolved_addrs[key]
+
+class Backoff:
+    """
+    再接続のジッタ付き指数バックオフ (ReconnectingTCPSource と aio_ingest.tcp_stream で共有)
+    next() は次に待つ時間 (0〜現在の上限の一様乱数) を返し、上限を倍にする (maximum まで)
+    """
+    def __init__(self, initial=TCP_BACKOFF_INITIAL, maximum=TCP_BACKOFF_MAX,
+                 resolve_after=TCP_RESOLVE_AFTER_FAILURES):
+        self.initial = initial
+        self.maximum = maximum
+        self.resolve_after = resolve_after
+        self.reset()
+
+    def reset(self):
+        self.delay = self.initial
+        self.failures = 0
+
+    @property
+    def refresh(self):
+        """キャッシュしたアドレスで resolve_after 回失敗したら名前解決し直す"""
+        return self.failures >= self.resolve_after
+
+    def next(self):
+        self.failures += 1
+        wait = random.uniform(0, self.delay)
+        self.delay = min(self.delay * 2, self.maximum)
+        return wait
+
+
+class TCPFrameReader:
+    """
+    TCP ストリームを固定長の int16 フレームに切り出す
+    FrameAssembler の空き領域に recv_into で直接受信し、揃ったフレームをコピーせずに返す
+    """
+    def __init__(self, sock, frame_bytes=BUFFER_SIZE * 2, max_frames=16, dtype=DTYPE):
+        self.sock = sock
+        self.assembler = FrameAssembler(frame_bytes, max_frames, dtype)
+        self.frame_bytes = frame_bytes
+        self.frame_samples = self.assembler.frame_samples
+
+    def read_frames(self):
+        """
+        1回受信して、揃ったフレームを (フレーム数, frame_samples) の配列で返す
+        返す配列は内部バッファのビューなので、次の呼び出しまでに使い終えること
+        接続が閉じられた場合は None
+        """
+        n = self.sock.recv_into(self.assembler.write_view())
+        if n == 0:
+            return None
+        self.assembler.commit(n)
+        return self.assembler.pop_frames()
+
+    def reset(self, sock=None):
+        """再接続時に端数を捨ててフレーム境界を合わせ直す"""
+        if sock is not None:
+            self.sock = sock
+        self.assembler.reset()
+
+
+class ReconnectingTCPSource:
+    """
+    切断されても自動で再接続する TCP ソース
+    名前解決の結果をキャッシュし、再接続はジッタ付き指数バックオフで行う
+    再接続のたびにフレーム境界を合わせ直し、再接続にかかった時間を記録する
+    """
+    def __init__(self, host=TCP_HOST, port=TCP_PORT, frame_bytes=BUFFER_SIZE * 2, dtype=DTYPE,
+                 on_connected=None, on_disconnected=None):
+        self.host = host
+        self.port = port
+        self.frame_bytes = frame_bytes
+        self.dtype = dtype
+        self.on_connected = on_connected          # on_connected(再接続時間 or None)
+        self.on_disconnected = on_disconnected    # on_disconnected(理由)
+        self.sock = None
+        self.reader = None
+        self.connects = 0
+        self.last_reconnect_time = None   # 直近の切断から再接続までの時間 (秒)
+        self.reconnect_times = []
+        self._empty = np.empty((0, frame_bytes // np.dtype(dtype).itemsize), dtype=dtype)
+        self._stop = threading.Event()
+
+    def _open(self, refresh):
+        last_error = OSError(f"no address for {self.host}")
+        for family, sockaddr in resolve(self.host, self.port, refresh):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(TCP_CONNECT_TIMEOUT)
+                sock.connect(sockaddr)
+            except OSError as e:
+                sock.close()
+                last_error = e
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(TCP_RECV_TIMEOUT)
+            return sock
+        raise last_error
+
+    def connect(self):
+        """接続できるまでバックオフしながら再試行する (stop() で中断された場合は False)"""
+        started = time.monotonic()
+        backoff = Backoff()
+        while not self._stop.is_set():
+            try:
+                sock = self._open(refresh=backoff.refresh)
+            except OSError as e:
+                wait = backoff.next()
+                print(f"[TCP] 接続失敗 ({backoff.failures}回目): {e}")
+                self._stop.wait(wait)
+                continue
+
+            if self._stop.is_set():
+                sock.close()
+                break
+            self.sock = sock
+            if self.reader is None:
+                self.reader = TCPFrameReader(sock, self.frame_bytes, dtype=self.dtype)
+            else:
+                self.reader.reset(sock)
+
+            reconnect_time = None
+            if self.connects > 0:
+                reconnect_time = time.monotonic() - started
+                self.last_reconnect_time = reconnect_time
+                self.reconnect_times.append(reconnect_time)
+                print(f"[TCP] 再接続しました ({reconnect_time:.2f} 秒)")
+            self.connects += 1
+            if self.on_connected:
+                self.on_connected(reconnect_time)
+            return True
+        return False
+
+    def read_frames(self):
+        """
+        揃ったフレームを返す (TCPFrameReader.read_frames と同じ形式)
+        切断・無通信タイムアウト時は再接続して空の配列を返し、stop() 後は None を返す
+        """
+        if self.sock is None and not self.connect():
+            return None
+        try:
+            frames = self.reader.read_frames()
+            reason = "接続が相手方から切断されました。"
+        except OSError as e:  # socket.timeout を含む
+            frames = None
+            reason = f"受信エラー: {e}"
+        if frames is not None:
+            return frames
+
+        self._close()
+        if self._stop.is_set():
+            return None
+        print(f"[TCP] {reason} 再接続します。")
+        if self.on_disconnected:
+            self.on_disconnected(reason)
+        return self._empty
+
+    def _close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def stop(self):
+        self._stop.set()
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.stop()
+        self._close()
@@ -1,56 +1,335 @@
+import os
 import socket
+import struct
+import sys
+import selectors
 import threading
-import queue
+import time
 import numpy as np
 from config import *
+from ring_buffer import SampleRing
+from packet import HEADER_SIZE, ADPCM_VERSION, StreamTracker, decode_header, decode_adpcm_payload
+from clock import ClockEstimator
+
+# Linux: 受信キューが溢れて捨てられたパケット数を補助データで受け取る (socket モジュールに定数がない場合がある)
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+# Linux: カーネルがパケットを受け取った時刻 (struct timespec) を補助データで受け取る
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+TIMESPEC = struct.Struct("@qq")
+PROC_NET_UDP = ("/proc/net/udp", "/proc/net/udp6")
+
+
+def open_udp_socket(port, multicast_group="", multicast_if=MULTICAST_IF):
+    """
+    受信用の UDP ソケットを開く
+    multicast_group を指定した場合は、他のプロセスも同じポートを開けるようにしてからグループに参加する
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if not multicast_group:
+        sock.bind((UDP_IP, port))
+        return sock
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # グループのアドレスに bind し、同じポートへの他の宛先のパケットは受けない (Windows は INADDR_ANY のみ)
+    sock.bind(("" if sys.platform == "win32" else multicast_group, port))
+    membership = struct.pack("4s4s", socket.inet_aton(multicast_group), socket.inet_aton(multicast_if))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+
+def read_proc_drops(inodes):
+    """/proc/net/udp の drops 列から、ソケットの inode ごとのカーネル破棄数を読む (Linux 以外は空)"""
+    drops = {}
+    for path in PROC_NET_UDP:
+        try:
+            with open(path) as f:
+                next(f)  # 見出し行
+                for line in f:
+                    fields = line.split()
+                    # sl local rem st tx:rx tr:when retrnsmt uid timeout inode ref pointer drops
+                    if len(fields) >= 13 and int(fields[9]) in inodes:
+                        drops[int(fields[9])] = int(fields[12])
+        except (OSError, ValueError, StopIteration):
+            continue
+    return drops
+
+
+class SocketStats:
+    """
+    1ソケット分の受信カウンタ (受信スレッドが更新する)
+    rcvbuf はカーネルが実際に確保した SO_RCVBUF (Linux では要求値の2倍が返る)
+    """
+    def __init__(self, sock, requested):
+        self.requested = requested
+        self.rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.inode = os.fstat(sock.fileno()).st_ino
+        self.packets = 0
+        self.bytes = 0
+        self.kernel_drops = 0
+        self.truncated = 0   # リングの書き込み枠 (max_write) に収まらず捨てたパケット数
+        self.rates = (0.0, 0.0, 0.0)
+        self._last = (time.monotonic(), 0, 0, 0)
+
+    def parse_ancdata(self, ancdata):
+        """
+        recvmsg の補助データから SO_RXQ_OVFL の累積破棄数を取り出し、
+        SO_TIMESTAMPNS の受信時刻 (ns) を返す (無ければ None)
+        """
+        timestamp = None
+        for level, kind, data in ancdata:
+            if level != socket.SOL_SOCKET:
+                continue
+            if kind == SO_RXQ_OVFL and len(data) >= 4:
+                self.kernel_drops = max(self.kernel_drops, int.from_bytes(data[:4], sys.byteorder))
+            elif kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+                sec, nsec = TIMESPEC.unpack_from(data)
+                timestamp = sec * 1_000_000_000 + nsec
+        return timestamp
+
+    def update_rates(self, now):
+        last_time, last_packets, last_bytes, last_drops = self._last
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        self.rates = ((self.packets - last_packets) / elapsed,
+                      (self.bytes - last_bytes) / elapsed,
+                      (self.kernel_drops - last_drops) / elapsed)
+        self._last = (now, self.packets, self.bytes, self.kernel_drops)
+
+    def stats(self):
+        packets_per_sec, bytes_per_sec, drops_per_sec = self.rates
+        total = self.packets + self.kernel_drops
+        return {
+            "rcvbuf": self.rcvbuf,
+            "rcvbuf_requested": self.requested,
+            "rx_packets": self.packets,
+            "rx_bytes": self.bytes,
+            "kernel_drops": self.kernel_drops,
+            "truncated_packets": self.truncated,
+            "packets_per_sec": packets_per_sec,
+            "bytes_per_sec": bytes_per_sec,
+            "kernel_drops_per_sec": drops_per_sec,
+            "kernel_drop_rate": self.kernel_drops / total if total else 0.0,
+        }
+
 
 class UDPListener:
-    def __init__(self):
-        self.data_queue = queue.Queue()
+    """
+    複数デバイスのUDPソケットを1つのselectorループで受信する
+    devices: {デバイスID: ポート番号} (省略時は UDP_PORT の1台のみ)
+    受信データはデバイスごとの SampleRing に recv_into で直接書き込む
+    packet_format="v2" の場合はヘッダから欠落・順序入れ替わりを検出し、欠落区間を埋める
+    (ヘッダの version が adpcm のパケットは復号してから書き込む)
+    on_data(デバイスID) を渡すと、受信のたびに受信スレッドから呼ばれる
+    rings を渡すと (共有メモリ上のリングなど) デバイスごとにそのリングへ書き込む
+    capture_path を指定すると、受信したパケットをそのままファイルに記録する (capture.py で再生できる)
+    get_stats() でソケットバッファの実サイズ・受信レート・カーネルでの破棄数も確認できる
+    clocks にはデバイスごとの ClockEstimator (受信時刻から実際のサンプリングレート・ジッタを推定) を持つ
+    multicast_group を指定すると、各ポートでそのマルチキャストグループに参加して受信する
+    (同じグループ・ポートを他のプロセスや PC も同時に受信できる)
+    """
+    def __init__(self, devices=None, packet_format=PACKET_FORMAT, conceal=GAP_CONCEAL, on_data=None,
+                 sock_buf_size=SOCKET_BUF_SIZE, rings=None, capture_path=CAPTURE_PATH,
+                 multicast_group=MULTICAST_GROUP, multicast_if=MULTICAST_IF):
+        if devices is None:
+            devices = {DEFAULT_DEVICE: UDP_PORT}
+        self.devices = dict(devices)
+        self.packet_format = packet_format
+        self.conceal = conceal
+        self.on_data = on_data
+        self.sock_buf_size = sock_buf_size
+        self.capture_path = capture_path
+        self.capture = None
+        self.multicast_group = multicast_group
+        self.multicast_if = multicast_if
+        rings = rings or {}
+        self.rings = {device_id: rings.get(device_id) or SampleRing() for device_id in self.devices}
+        self.read_cursors = {device_id: 0 for device_id in self.devices}
+        self.trackers = {device_id: StreamTracker() for device_id in self.devices}
+        self.clocks = {device_id: ClockEstimator() for device_id in self.devices}
+        self._header_buf = bytearray(HEADER_SIZE)
         self.running = False
         self.thread = None
-        self.sock = None
+        self.selector = None
+        self.socks = {}
+        self.sock_stats = {}
+        self._ancbufsize = 0
+        self._next_stats = 0.0
 
     def start(self):
+        if self.running:
+            return
+        if self.capture_path:
+            from capture import CaptureWriter
+            # パスの %Y%m%d-%H%M%S などは開始時刻に置き換える
+            path = time.strftime(self.capture_path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.capture = CaptureWriter(path, self.devices, self.packet_format)
+            print(f"Capturing packets to {path}")
+        self.selector = selectors.DefaultSelector()
+        self._ancbufsize = 0
+        for device_id, port in self.devices.items():
+            sock = open_udp_socket(port, self.multicast_group, self.multicast_if)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.sock_buf_size)
+            for option in (SO_RXQ_OVFL, SO_TIMESTAMPNS):
+                if option is None:
+                    continue
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, option, 1)
+                    self._ancbufsize = socket.CMSG_SPACE(4) + socket.CMSG_SPACE(TIMESPEC.size)
+                except OSError:
+                    pass
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, data=device_id)
+            self.socks[device_id] = sock
+            self.sock_stats[device_id] = stats = SocketStats(sock, self.sock_buf_size)
+            if stats.rcvbuf < self.sock_buf_size:
+                # 上限 (Linux: net.core.rmem_max, macOS: kern.ipc.maxsockbuf) で切り詰められている
+                print(f"Warning: {device_id} の受信バッファは {stats.rcvbuf} bytes しか確保できませんでした "
+                      f"(要求 {self.sock_buf_size} bytes)")
+        self._next_stats = time.monotonic() + STATS_INTERVAL
+
         self.running = True
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((UDP_IP, UDP_PORT))
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUF_SIZE)
-        
         self.thread = threading.Thread(target=self._listen_loop, daemon=True)
         self.thread.start()
-        print(f"UDP Listener started on port {UDP_PORT}")
+        ports = ", ".join(f"{d}:{p}" for d, p in self.devices.items())
+        if self.multicast_group:
+            ports += f" (multicast {self.multicast_group} via {self.multicast_if})"
+        print(f"UDP Listener started on {ports}")
 
     def _listen_loop(self):
         while self.running:
             try:
-                data, _ = self.sock.recvfrom(BUFFER_SIZE * 4)
-                if not data:
-                    continue
+                events = self.selector.select(timeout=SELECT_TIMEOUT)
+            except (OSError, ValueError):
+                break  # stop() でソケットが閉じられた
 
-                pcm_data = np.frombuffer(data, dtype=DTYPE)
-                if pcm_data.size > 0:
-                    normalized = pcm_data.astype(np.float32) / NORM_FACTOR # 正規化
-                    # normalized = normalized - np.mean(normalized)  # DCオフセット除去
-                    self.data_queue.put(normalized)
+            for key, _ in events:
+                try:
+                    if self.packet_format == "v2":
+                        self._drain_v2(key.fileobj, key.data)
+                    else:
+                        self._drain(key.fileobj, key.data)
+                except Exception as e:
+                    print(f"Receive Error ({key.data}): {e}")
+                if self.on_data:
+                    self.on_data(key.data)
 
-            except Exception as e:
-                print(f"Receive Error: {e}")
+            now = time.monotonic()
+            if now >= self._next_stats:
+                self._update_rates(now)
+                self._next_stats = now + STATS_INTERVAL
 
-    def get_data(self):
-        """キューに溜まったデータを全て取り出して結合して返す"""
-        data_list = []
-        try:
-            while True:
-                data_list.append(self.data_queue.get_nowait())
-        except queue.Empty:
-            pass
-        
-        if not data_list:
-            return None
-        return np.concatenate(data_list)
+    def _update_rates(self, now):
+        """受信レートを更新し、/proc/net/udp の破棄数 (補助データが届かない間の分) を反映する"""
+        proc_drops = read_proc_drops({stats.inode for stats in self.sock_stats.values()})
+        for stats in self.sock_stats.values():
+            stats.kernel_drops = max(stats.kernel_drops, proc_drops.get(stats.inode, 0))
+            stats.update_rates(now)
+
+    def _drain(self, sock, device_id):
+        """ソケットに溜まったパケットを最大 RECV_BATCH 個までリングへ直接読み込む"""
+        ring = self.rings[device_id]
+        stats = self.sock_stats[device_id]
+        clock = self.clocks[device_id]
+        for _ in range(RECV_BATCH):
+            view = ring.write_view()
+            try:
+                nbytes, ancdata, flags, addr = sock.recvmsg_into([view], self._ancbufsize)
+            except BlockingIOError:
+                return
+            stats.packets += 1
+            stats.bytes += nbytes
+            if flags & socket.MSG_TRUNC:
+                # 末尾が切れたパケットは途中までの PCM を確定せずに捨てる
+                stats.truncated += 1
+                continue
+            timestamp = stats.parse_ancdata(ancdata) if ancdata else None
+            if timestamp is None:
+                timestamp = time.time_ns()
+            if self.capture:
+                self.capture.write(device_id, addr, view[:nbytes], timestamp_ns=timestamp)
+            if nbytes >= ring.itemsize:
+                ring.commit(nbytes // ring.itemsize)
+                clock.update(timestamp, ring.write_pos)
+
+    def _drain_v2(self, sock, device_id):
+        """ヘッダは作業バッファへ、PCM はリングへ分散受信し、欠落を埋めてから確定する"""
+        ring = self.rings[device_id]
+        tracker = self.trackers[device_id]
+        stats = self.sock_stats[device_id]
+        clock = self.clocks[device_id]
+        for _ in range(RECV_BATCH):
+            view = ring.write_view()
+            try:
+                nbytes, ancdata, flags, addr = sock.recvmsg_into([self._header_buf, view], self._ancbufsize)
+            except BlockingIOError:
+                return
+            stats.packets += 1
+            stats.bytes += nbytes
+            if flags & socket.MSG_TRUNC:
+                # 末尾が切れたパケットは途中までの PCM を確定せずに捨てる
+                stats.truncated += 1
+                continue
+            timestamp = stats.parse_ancdata(ancdata) if ancdata else None
+            if timestamp is None:
+                timestamp = time.time_ns()
+            if self.capture:
+                self.capture.write(device_id, addr, self._header_buf[:nbytes],
+                                   view[:max(0, nbytes - HEADER_SIZE)], timestamp_ns=timestamp)
+            header = decode_header(self._header_buf)
+            if header is None:
+                continue
+            if header.version == ADPCM_VERSION:
+                # 復号結果は新しい配列なので、受信したビュー (リングの書き込み位置) に上書きしても問題ない
+                pcm = decode_adpcm_payload(view[:max(0, nbytes - HEADER_SIZE)])
+            else:
+                pcm = np.frombuffer(view, dtype=DTYPE, count=max(0, (nbytes - HEADER_SIZE) // ring.itemsize))
+            out = tracker.accept(header, pcm, self.conceal)
+            if out is None:
+                continue  # 遅着・重複・空のパケットは捨てる
+            if out is pcm and header.version != ADPCM_VERSION:
+                ring.commit(len(pcm))  # 欠落なし: リングに直接受信した PCM をそのまま確定する
+            else:
+                ring.write(out)
+            clock.update(timestamp, ring.write_pos)
+
+    def get_stats(self, device_id=None):
+        """
+        受信カウンタを返す
+        v2 パケットの受信・欠落数に加え、ソケットの実バッファサイズ (rcvbuf)、
+        受信レート (packets_per_sec / bytes_per_sec, STATS_INTERVAL ごとに更新)、
+        カーネルで捨てられたパケット数 (kernel_drops, Linux のみ)、
+        リングの書き込み枠より大きく切り詰められたため捨てたパケット数 (truncated_packets)、
+        推定サンプリングレート・ドリフト (ppm)・到着ジッタ (ms) を含む
+        """
+        if device_id is None:
+            device_id = next(iter(self.devices))
+        stats = self.trackers[device_id].stats()
+        stats.update(self.clocks[device_id].stats())
+        if device_id in self.sock_stats:
+            stats.update(self.sock_stats[device_id].stats())
+        return stats
+
+    def get_data(self, device_id=None):
+        """指定デバイスの未読サンプルを正規化して返す"""
+        if device_id is None:
+            device_id = next(iter(self.devices))
+        data, self.read_cursors[device_id] = self.rings[device_id].read(self.read_cursors[device_id])
+        return data
 
     def stop(self):
         self.running = False
-        if self.sock:
-            self.sock.close()
\ No newline at end of file
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        for sock in self.socks.values():
+            sock.close()
+        self.socks = {}
+        if self.capture:
+            self.capture.close()
+            self.capture = None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# アプリと同じく src のモジュールを直接 import する
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
@@ -0,0 +1,18 @@
+import numpy as np
+
+from adpcm import decode_block
+from packet import ADPCM_HEADER, ADPCM_VERSION, HEADER, PACKET_MAGIC, decode_adpcm_payload, decode_packet
+
+
+def test_decode_block_without_nibbles_is_empty():
+    pcm = decode_block(b"", 0, 0)
+    assert pcm.size == 0
+    assert pcm.dtype == np.int16
+
+
+def test_adpcm_packet_with_header_only_decodes_to_empty():
+    assert decode_adpcm_payload(ADPCM_HEADER.pack(100, 10)).size == 0
+    packet = HEADER.pack(PACKET_MAGIC, ADPCM_VERSION, 1, 0, 0) + ADPCM_HEADER.pack(100, 10)
+    header, pcm = decode_packet(packet)
+    assert header.version == ADPCM_VERSION
+    assert pcm.size == 0
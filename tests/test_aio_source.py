@@ -0,0 +1,109 @@
+import socket
+import time
+
+import numpy as np
+
+from packet import encode_packet
+from sources import AsyncIngestSampleSource, create_source
+from test_tcp_reconnect import FRAME_BYTES, DroppingServer, _frame
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(source, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while source.stats()["samples"] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_create_source_selects_aio():
+    source = create_source("aio", port=_free_udp_port())
+    assert isinstance(source, AsyncIngestSampleSource)
+
+
+def test_udp_frames_through_bounded_buffer():
+    port = _free_udp_port()
+    source = create_source("aio", port=port, buffer_size=4096, policy="drop_oldest")
+    source.start()
+    try:
+        assert source.running
+        pcm = np.arange(1024, dtype=np.int16)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for i in range(0, len(pcm), 100):
+                sock.sendto(pcm[i:i + 100].tobytes(), ("127.0.0.1", port))
+        _wait_for(source, len(pcm))
+        frames = source.read_frames(256, timeout=0.5, scale=None)
+        assert frames.shape == (4, 256)
+        assert np.array_equal(frames.ravel(), pcm)
+        assert source.stats()["shed_samples"] == 0
+    finally:
+        source.stop()
+
+
+def test_drop_oldest_sheds_when_reader_stalls():
+    port = _free_udp_port()
+    source = create_source("aio", port=port, buffer_size=1000, policy="drop_oldest")
+    source.start()
+    try:
+        pcm = np.arange(3000, dtype=np.int16)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for i in range(0, len(pcm), 500):
+                sock.sendto(pcm[i:i + 500].tobytes(), ("127.0.0.1", port))
+        _wait_for(source, len(pcm))
+        data = source.get_data(scale=None)
+        # 読み出しが止まっている間の古いサンプルが捨てられ、直近の 1000 サンプルが残る
+        assert np.array_equal(data, pcm[-1000:])
+        assert source.stats()["shed_samples"] == 2000
+        assert data.dtype == np.int16
+        source.buffer.put_nowait(pcm[:10])
+        assert source.get_data().dtype == np.float32
+    finally:
+        source.stop()
+
+
+def test_udp_v2_options_reach_the_engine():
+    """packet_format / conceal / ソケットバッファの指定が aio の UDP にも効く"""
+    port = _free_udp_port()
+    source = create_source("aio", port=port, packet_format="v2", conceal="interp", sock_buf_size=1 << 16)
+    source.start()
+    try:
+        n = 4
+        packets = {seq: np.full(n, seq * 100, dtype=np.int16) for seq in range(4)}
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for seq in (0, 1, 3, 2):   # 2 は欠落扱いになった後に遅れて届く
+                sock.sendto(encode_packet(1, seq, seq * n, packets[seq]), ("127.0.0.1", port))
+        _wait_for(source, 4 * n)
+        data = source.get_data(scale=None)
+        assert np.array_equal(data[2 * n:3 * n], [140, 180, 220, 260])
+        assert np.array_equal(data[3 * n:], packets[3])
+        stats = source.stats()
+        assert stats["lost_packets"] == 1
+        assert stats["late_packets"] == 1
+        protocol = source.engine.protocols[source.device_id]
+        sock = protocol.transport.get_extra_info("socket")
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 1 << 16
+    finally:
+        source.stop()
+
+
+def test_tcp_reconnects_and_realigns_frames():
+    """フレームの途中で切断されても再接続し、次の接続のフレーム境界から読み直す"""
+    first = _frame(1) + _frame(2)[:FRAME_BYTES // 2 + 1]
+    server = DroppingServer([first, _frame(3) + _frame(4)])
+    ended = []
+    source = create_source("aio", transport="tcp", host="127.0.0.1", port=server.port,
+                           frame_bytes=FRAME_BYTES, on_error=ended.append)
+    source.start()
+    try:
+        _wait_for(source, 3 * FRAME_BYTES // 2, timeout=5.0)
+        data = source.get_data(scale=None)
+        assert np.array_equal(data.reshape(-1, FRAME_BYTES // 2)[:, 0], [1, 3, 4])
+        assert ended == []
+        assert source.running
+    finally:
+        source.stop()
+        server.close()
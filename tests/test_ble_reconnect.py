@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+
+from ble import BLESource, load_cached_address, save_cached_address
+from config import *
+
+NAME = "SAW-Ring"
+ADDRESS = "AA:BB:CC:DD:EE:01"
+FRAME_BYTES = 16
+
+
+class FakeDevice:
+    def __init__(self, address):
+        self.address = address
+
+
+class FakeScanner:
+    """BleakScanner の代わり: find_device_by_name の呼び出しを記録する"""
+    device = FakeDevice(ADDRESS)
+    calls = []
+
+    @classmethod
+    async def find_device_by_name(cls, name, timeout=None):
+        cls.calls.append(name)
+        return cls.device if name == NAME else None
+
+
+class FakeClient:
+    """
+    BleakClient の代わり
+    start_notify で 1フレーム分を奇数バイトに分けて通知し、その後に切断コールバックを呼ぶ
+    unreachable に入っているアドレスへの接続は失敗する
+    """
+    unreachable = set()
+    targets = []
+
+    def __init__(self, target, disconnected_callback=None, timeout=None):
+        self.target = target
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+
+    async def connect(self):
+        FakeClient.targets.append(self.target)
+        if self.target in self.unreachable:
+            raise TimeoutError(f"{self.target} did not respond")
+        self.is_connected = True
+
+    async def start_notify(self, uuid, handler):
+        data = np.arange(FRAME_BYTES // 2, dtype=np.int16).tobytes()
+        loop = asyncio.get_running_loop()
+        loop.call_soon(handler, uuid, data[:5])
+        loop.call_soon(handler, uuid, data[5:])
+        loop.call_soon(self._drop)
+
+    def _drop(self):
+        self.is_connected = False
+        self.disconnected_callback(self)
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+class StreamingClient(FakeClient):
+    """
+    arduino/ble/ble.ino と同じ間隔で通知する BleakClient の代わり
+    I2S から 4096 バイト (2048 サンプル = 85 ms) 読むごとに、MTU - 5 バイトずつに分けて続けて通知する
+    """
+    MTU = 247            # スマートフォン・PC でよく折り合う MTU (4096 バイトを割り切れない大きさ)
+    READ_BYTES = 4096
+    BURSTS = 16
+    notifications = 0
+
+    @classmethod
+    def pcm(cls):
+        samples = cls.READ_BYTES // 2 * cls.BURSTS
+        return ((np.arange(samples) * 7) % 60000 - 30000).astype(np.int16)
+
+    async def start_notify(self, uuid, handler):
+        self._task = asyncio.ensure_future(self._stream(uuid, handler))
+
+    async def _stream(self, uuid, handler):
+        data = self.pcm().tobytes()
+        chunk = self.MTU - 5
+        start = time.monotonic()
+        for burst in range(self.BURSTS):
+            # I2S の読み出しが揃う時刻まで待つ
+            await asyncio.sleep(max(0.0, start + burst * self.READ_BYTES / 2 / SAMPLE_RATE - time.monotonic()))
+            block = data[burst * self.READ_BYTES:(burst + 1) * self.READ_BYTES]
+            for i in range(0, len(block), chunk):
+                handler(uuid, bytearray(block[i:i + chunk]))
+                StreamingClient.notifications += 1
+        self._drop()
+
+
+@pytest.fixture(autouse=True)
+def fakes():
+    FakeScanner.calls = []
+    FakeClient.targets = []
+    FakeClient.unreachable = set()
+
+
+def _run(cache_path):
+    frames = []
+    source = BLESource(NAME, frame_bytes=FRAME_BYTES, cache_path=str(cache_path),
+                       on_frames=lambda f: frames.extend(f.copy()),
+                       client_class=FakeClient, scanner_class=FakeScanner)
+    asyncio.run(source.run())
+    return source, frames
+
+
+def test_first_connect_scans_and_reconnect_uses_cache(tmp_path):
+    cache_path = tmp_path / "ble_address.json"
+
+    source, frames = _run(cache_path)
+    assert source.used_scan
+    assert FakeScanner.calls == [NAME]
+    assert FakeClient.targets == [FakeScanner.device]
+    assert load_cached_address(NAME, str(cache_path)) == ADDRESS
+    assert len(frames) == 1
+    assert np.array_equal(frames[0], np.arange(FRAME_BYTES // 2))
+    assert source.startup_time is not None
+
+    # 再接続はキャッシュしたアドレスへ直接つなぎ、スキャンしない
+    source, frames = _run(cache_path)
+    assert not source.used_scan
+    assert FakeScanner.calls == [NAME]
+    assert FakeClient.targets[1:] == [ADDRESS]
+    assert len(frames) == 1
+
+
+def test_failed_cached_connect_falls_back_to_scan(tmp_path):
+    cache_path = tmp_path / "ble_address.json"
+    stale = "AA:BB:CC:DD:EE:99"
+    cache_path.write_text(json.dumps({NAME: stale}))
+    FakeClient.unreachable = {stale}
+
+    source, frames = _run(cache_path)
+    assert source.used_scan
+    assert FakeClient.targets == [stale, FakeScanner.device]
+    assert FakeScanner.calls == [NAME]
+    # 見つかったデバイスのアドレスでキャッシュを更新する
+    assert load_cached_address(NAME, str(cache_path)) == ADDRESS
+    assert len(frames) == 1
+
+
+def test_device_not_found_raises(tmp_path):
+    source = BLESource("Other-Ring", cache_path=str(tmp_path / "ble_address.json"),
+                       client_class=FakeClient, scanner_class=FakeScanner)
+    with pytest.raises(ConnectionError):
+        asyncio.run(source.run())
+    assert FakeClient.targets == []
+
+
+def test_realtime_notifications_with_cached_address(tmp_path):
+    """実機と同じ間隔・分け方の通知を数百個受け、フレームの数・内容と最初のフレームまでの時間を確かめる"""
+    cache_path = tmp_path / "ble_address.json"
+    save_cached_address(NAME, ADDRESS, str(cache_path))
+    StreamingClient.notifications = 0
+    frames = []
+    source = BLESource(NAME, frame_bytes=BUFFER_SIZE, cache_path=str(cache_path),
+                       on_frames=lambda f: frames.extend(f.copy()),
+                       client_class=StreamingClient, scanner_class=FakeScanner)
+    asyncio.run(source.run())
+
+    assert not source.used_scan
+    assert FakeScanner.calls == []
+    assert StreamingClient.notifications >= 200
+    pcm = StreamingClient.pcm()
+    assert len(frames) == pcm.nbytes // BUFFER_SIZE
+    assert all(frame.shape == (BUFFER_SIZE // 2,) for frame in frames)
+    assert np.array_equal(np.concatenate(frames), pcm[:len(frames) * BUFFER_SIZE // 2])
+    assert source.startup_time < 1.0
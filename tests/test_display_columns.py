@@ -0,0 +1,63 @@
+import numpy as np
+import librosa
+import pytest
+
+from config import *
+from dsp_bench import reference_columns
+from signal_process import DSPProcessor, STFTFrames
+
+# 表示と推論で STFT を共有しても、表示のスペクトログラムが従来の計算からほとんど変わらないこと
+# 共有の STFTFrames のフレーム j は従来の列 j + 1 と同じ区間 (従来の最初の列はストリーム開始前の区間)
+
+
+@pytest.fixture
+def audio():
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE * 3)
+    tone = 0.2 * np.sin(2 * np.pi * 1000 * t / SAMPLE_RATE)
+    return (tone + rng.standard_normal(len(t)) * 0.05 + 0.02).astype(FLOAT_DTYPE)
+
+
+def _chunks(audio, size):
+    return [audio[i:i + size] for i in range(0, len(audio), size)]
+
+
+def test_dsp_processor_alone_matches_reference(audio):
+    chunks = _chunks(audio, 400)
+    dsp = DSPProcessor()
+    columns = np.concatenate([c for c in map(dsp.process_spectrogram_column, chunks) if c is not None], axis=1)
+    assert np.abs(columns - reference_columns(chunks)).max() < 1e-6
+
+
+def test_shared_frames_display_close_to_reference(audio):
+    """src/main.py: 周期的なハン窓になった分だけ変わる (0〜1 の表示で 8 bit の色の1段未満)"""
+    chunks = _chunks(audio, 400)
+    stft = STFTFrames()
+    dsp = DSPProcessor()
+    columns = np.concatenate([c for c in (dsp.mel_columns(stft.push(c)) for c in chunks) if c is not None], axis=1)
+    reference = reference_columns(chunks)
+    assert columns.shape[1] == reference.shape[1] - 1
+    assert np.abs(columns - reference[:, 1:]).max() < 1 / 255
+
+
+def test_shared_frames_match_tcp_heatmap(audio):
+    """app-tcp/visualization: チャンクごとの librosa.feature.melspectrogram (center=False) と同じ値"""
+    n_mels = 128
+    overlap = N_FFT - HOP_LENGTH
+    previous = np.zeros(overlap, dtype=FLOAT_DTYPE)
+    stft = STFTFrames()
+    mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=n_mels)
+    reference, shared = [], []
+    for chunk in _chunks(audio, 1024):
+        combined = np.concatenate((previous, chunk))
+        previous = chunk[-overlap:]
+        S = librosa.feature.melspectrogram(y=combined, sr=SAMPLE_RATE, n_fft=N_FFT,
+                                           hop_length=HOP_LENGTH, n_mels=n_mels, center=False)
+        reference.append(librosa.power_to_db(S, ref=1.0))
+        magnitude = stft.push(chunk)
+        if magnitude is not None:
+            shared.append(librosa.power_to_db(mel_basis @ magnitude**2, ref=1.0))
+    reference = np.concatenate(reference, axis=1)
+    shared = np.concatenate(shared, axis=1)
+    assert shared.shape[1] == reference.shape[1] - 1
+    assert np.abs(shared - reference[:, 1:]).max() < 1e-3
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from config import *
+from ring_buffer import RollingWindow, SampleRing
+from signal_process import DSPProcessor, STFTFrames, check_dtype
+from surface_recognition.features import StreamingPCEN
+
+# 受信リング (int16) → 正規化 → STFT → メル / FFT → PCEN (モデルの入力) の各段が float32 のままであること
+
+
+@pytest.fixture
+def pcm():
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(SAMPLE_RATE * 3) * 3000).astype(DTYPE)
+
+
+def _samples(pcm):
+    """SampleRing に書き込んで正規化して読み出したチャンク"""
+    ring = SampleRing()
+    cursor = 0
+    for i in range(0, len(pcm), BUFFER_SIZE):
+        ring.write(pcm[i:i + BUFFER_SIZE])
+        raw, _ = ring.read(cursor, scale=None)
+        assert raw.dtype == DTYPE
+        samples, cursor = ring.read(cursor)
+        yield samples
+
+
+def test_pipeline_stays_float32(pcm):
+    stft = STFTFrames()
+    dsp = DSPProcessor()
+    pcen = StreamingPCEN()
+    for samples in _samples(pcm):
+        assert samples.dtype == FLOAT_DTYPE
+        magnitude = stft.push(samples)
+        assert magnitude.dtype == FLOAT_DTYPE
+        assert dsp.mel_columns(magnitude).dtype == FLOAT_DTYPE
+        assert dsp.compute_fft(samples)[1].dtype == FLOAT_DTYPE
+        assert dsp.compute_fft(samples[:100])[1].dtype == FLOAT_DTYPE
+        pcen.push_frames(magnitude, samples)
+    feature = pcen.features()
+    assert feature.shape == (128, 188)
+    assert feature.dtype == FLOAT_DTYPE
+
+
+def test_float64_input_is_cast_at_the_stft(pcm):
+    samples = pcm.astype(np.float64) / NORM_FACTOR
+    dsp = DSPProcessor()
+    columns = dsp.process_spectrogram_column(samples)
+    assert columns.dtype == FLOAT_DTYPE
+
+    pcen = StreamingPCEN()
+    pcen.push(samples)
+    assert pcen.features().dtype == FLOAT_DTYPE
+    # ストリーム開始直後 (窓の左側がまだゼロ) も float32
+    short = StreamingPCEN()
+    short.push(samples[:SAMPLE_RATE // 2])
+    assert short.features().dtype == FLOAT_DTYPE
+
+
+def test_rolling_window_keeps_dtype():
+    window = RollingWindow(100, shape=(N_MELS,))
+    window.append(np.ones((N_MELS, 30), dtype=np.float64))
+    assert window.view().dtype == FLOAT_DTYPE
+
+
+def test_check_dtype_rejects_float64():
+    array = np.zeros(4, dtype=FLOAT_DTYPE)
+    assert check_dtype("ok", array) is array
+    assert check_dtype("none", None) is None
+    with pytest.raises(TypeError):
+        check_dtype("model input", np.zeros(4))
@@ -0,0 +1,50 @@
+import threading
+import time
+
+import numpy as np
+
+from config import *
+from forwarder import Aggregator
+
+BLOCK = 64
+BLOCKS = 300
+
+
+class YieldingDict(dict):
+    """読み出しの直後に他のスレッドへ切り替える (期待するサンプル番号の確認と更新の間で競合させる)"""
+    def get(self, *args):
+        value = super().get(*args)
+        time.sleep(0)
+        return value
+
+
+def test_concurrent_peers_write_each_sample_once():
+    """
+    同じデバイスのブロックを2つの接続 (再接続直後の古い接続と新しい接続) が同時に書き込んでも、
+    重なった分は一方だけが書き込み、リングのサンプルは途切れも重複もしない
+    """
+    aggregator = Aggregator(port=0)
+    aggregator.expected = YieldingDict()
+    ring = aggregator.ring("dev")
+    pcm = (np.arange(BLOCK * BLOCKS) % 20000).astype(DTYPE)
+    barrier = threading.Barrier(2)
+    notified = []
+    aggregator.subscribe("dev", lambda: notified.append(1))
+
+    def peer():
+        for i in range(BLOCKS):
+            barrier.wait()
+            aggregator._write("dev", i * BLOCK, pcm[i * BLOCK:(i + 1) * BLOCK], 0, 0)
+
+    threads = [threading.Thread(target=peer) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    data, _ = ring.read(0, scale=None)
+    assert np.array_equal(data, pcm)
+    stats = aggregator.get_stats("dev")
+    assert stats["forwarded_samples"] == len(pcm)
+    assert stats["forward_lost_samples"] == 0
+    assert len(notified) == BLOCKS
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import jitter_buffer
+from config import *
+from jitter_buffer import JitterBuffer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeSource:
+    """送られた分だけ連番のサンプルを返すソース"""
+    def __init__(self):
+        self.sent = 0
+        self.pending = 0
+
+    def send(self, n):
+        self.pending += n
+
+    def get_data(self, scale=None):
+        if self.pending == 0:
+            return None
+        data = (np.arange(self.sent, self.sent + self.pending) % 30000).astype(DTYPE)
+        self.sent += self.pending
+        self.pending = 0
+        return data
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(jitter_buffer, "time", clock)
+    return clock
+
+
+def _run(buffer, source, clock, seconds, send_every=0.05, tick=0.01):
+    """tick 秒ごとに get_data() を呼び、send_every 秒ごとに届いたことにする (send_every=None で届かない)"""
+    out = []
+    for step in range(round(seconds / tick)):
+        clock.now += tick
+        if send_every and step % round(send_every / tick) == 0:
+            source.send(round(send_every * SAMPLE_RATE))
+        data = buffer.get_data(scale=None)
+        if data is not None:
+            out.append(data)
+    return np.concatenate(out) if out else np.zeros(0, dtype=DTYPE)
+
+
+def test_underrun_rebuffers_without_losing_samples(clock):
+    source = FakeSource()
+    buffer = JitterBuffer(source)
+    first = _run(buffer, source, clock, 1.0)
+    assert not buffer.buffering
+    assert buffer.underruns == 0
+
+    # 受信が止まると溜まっていた分を出し切ってから溜め直しに入る
+    drained = _run(buffer, source, clock, 0.2, send_every=None)
+    assert buffer.underruns == 1
+    assert buffer.buffering
+    assert buffer.depth == 0
+    assert buffer.get_data() is None
+
+    # 再開後は目標遅延分が溜まるまで出さず、サンプルは途切れも重複もしない
+    resumed = _run(buffer, source, clock, 1.0)
+    assert not buffer.buffering
+    # 途切れた時間はバーストとして目標遅延に反映される
+    assert JITTER_TARGET_LATENCY + 0.1 < buffer.target < JITTER_MAX_LATENCY
+    out = np.concatenate([first, drained, resumed])
+    assert np.array_equal(out, np.arange(len(out)) % 30000)
+    assert buffer.dropped == 0
+
+
+def test_overflow_drops_oldest_beyond_max_latency(clock):
+    source = FakeSource()
+    buffer = JitterBuffer(source)
+    # 1 秒分が一度に届くと、max_latency を超えた古い分を捨てる
+    source.send(SAMPLE_RATE)
+    assert buffer.get_data(scale=None) is None
+    max_samples = int(JITTER_MAX_LATENCY * SAMPLE_RATE)
+    assert buffer.dropped == SAMPLE_RATE - max_samples
+    assert buffer.depth == pytest.approx(JITTER_MAX_LATENCY)
+
+    clock.now += 0.01
+    data = buffer.get_data(scale=None)
+    # 残した直近の分の先頭から、経過時間分 (深さが目標より大きいので最大 JITTER_MAX_SKEW 速く) を出す
+    assert data[0] == SAMPLE_RATE - max_samples
+    assert np.array_equal(data, np.arange(data[0], data[0] + len(data)))
+    assert len(data) == int(0.01 * SAMPLE_RATE * (1 + JITTER_MAX_SKEW))
+    stats = buffer.stats()
+    assert stats["dropped_samples"] == SAMPLE_RATE - max_samples
+    assert stats["underruns"] == 0
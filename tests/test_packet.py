@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from config import *
+from packet import INDEX_MOD, PacketHeader, StreamTracker, conceal_gap
+
+N = 4
+
+
+def _header(seq, sample_index=None):
+    return PacketHeader(2, 1, seq % INDEX_MOD, (seq * N if sample_index is None else sample_index) % INDEX_MOD)
+
+
+def _pcm(seq):
+    return np.full(N, seq % 300 * 100, dtype=DTYPE)
+
+
+def _feed(tracker, seqs, conceal="zero"):
+    out = []
+    for seq in seqs:
+        pcm = tracker.accept(_header(seq), _pcm(seq), conceal)
+        if pcm is not None:
+            out.append(pcm)
+    return np.concatenate(out)
+
+
+def test_in_order_packets_pass_through_without_copy():
+    tracker = StreamTracker()
+    for seq in range(3):
+        pcm = _pcm(seq)
+        assert tracker.accept(_header(seq), pcm) is pcm
+    assert tracker.stats()["packets"] == 3
+    assert tracker.stats()["lost_packets"] == 0
+
+
+def test_gap_is_filled_with_zeros():
+    tracker = StreamTracker()
+    out = _feed(tracker, [0, 1, 3], "zero")
+    assert np.array_equal(out, np.concatenate([_pcm(0), _pcm(1), np.zeros(N, dtype=DTYPE), _pcm(3)]))
+    stats = tracker.stats()
+    assert stats["lost_packets"] == 1
+    assert stats["lost_samples"] == N
+    assert stats["loss_rate"] == pytest.approx(0.25)
+
+
+def test_gap_is_interpolated_from_the_last_accepted_sample():
+    tracker = StreamTracker()
+    out = _feed(tracker, [0, 1, 3], "interp")
+    # 100 (パケット1の最後) から 300 (パケット3の最初) までの直線
+    assert np.array_equal(out[2 * N:3 * N], [140, 180, 220, 260])
+    assert out.dtype == DTYPE
+    assert tracker.last_sample == 300
+
+
+def test_late_and_duplicate_packets_are_dropped():
+    tracker = StreamTracker()
+    _feed(tracker, [0, 1, 3])
+    assert tracker.accept(_header(2), _pcm(2)) is None     # 補間済みの区間に遅れて届いた
+    assert tracker.accept(_header(3), _pcm(3)) is None     # 重複
+    assert tracker.accept(_header(4), _pcm(4)) is not None
+    stats = tracker.stats()
+    assert stats["late_packets"] == 2
+    assert stats["packets"] == 4
+
+
+def test_empty_packet_is_ignored():
+    tracker = StreamTracker()
+    assert tracker.accept(_header(0), np.zeros(0, dtype=DTYPE)) is None
+    assert tracker.expected_index is None
+
+
+def test_large_jump_resyncs_without_fill():
+    tracker = StreamTracker()
+    _feed(tracker, [0])
+    pcm = _pcm(1)
+    assert tracker.accept(_header(1, MAX_GAP_FILL * 2), pcm) is pcm
+    assert tracker.stats()["resyncs"] == 1
+    assert tracker.stats()["lost_samples"] == 0
+
+
+def test_sequence_wraps_around():
+    tracker = StreamTracker()
+    last = INDEX_MOD // N - 1
+    out = _feed(tracker, [last - 1, last, last + 2])
+    assert len(out) == 4 * N
+    assert tracker.stats()["lost_packets"] == 1
+
+
+def test_conceal_gap_modes():
+    assert np.array_equal(conceal_gap(3, 10, 50, "zero"), [0, 0, 0])
+    assert np.array_equal(conceal_gap(3, 10, 50, "interp"), [20, 30, 40])
+    assert conceal_gap(0, 10, 50, "interp").size == 0
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from ring_buffer import RollingWindow
+
+LENGTH = 10
+
+
+def _expected(history, length=LENGTH, fill=0):
+    """ゼロ (fill) から始めて history を追記した後の直近 length 個"""
+    padded = np.concatenate([np.full(history.shape[:-1] + (length,), fill, dtype=history.dtype), history], axis=-1)
+    return padded[..., -length:]
+
+
+@pytest.mark.parametrize("sizes", [
+    [3, 3, 3, 3, 3, 3, 3],     # length をまたぐ追記を何度も繰り返す
+    [9, 2, 10, 1, 7, 13, 4],   # length ちょうど・length 超えを含む
+    [1] * 25,
+])
+def test_mirrored_wrap_keeps_contiguous_window(sizes):
+    window = RollingWindow(LENGTH, shape=(2,))
+    history = np.zeros((2, 0), dtype=np.float32)
+    for size in sizes:
+        data = np.arange(history.shape[1], history.shape[1] + size, dtype=np.float32)
+        data = np.stack([data, -data])
+        window.append(data)
+        history = np.concatenate([history, data], axis=1)
+        view = window.view()
+        assert view.shape == (2, LENGTH)
+        assert view.base is not None   # コピーではなく連続したビュー
+        assert np.array_equal(view, _expected(history))
+        for n, offset in ((LENGTH, 0), (4, 0), (4, 6), (1, LENGTH - 1)):
+            assert np.array_equal(window.latest(n, offset), _expected(history)[..., LENGTH - offset - n:LENGTH - offset])
+    assert window.count == sum(sizes)
+
+
+def test_latest_until_edges():
+    window = RollingWindow(LENGTH, fill=-1)
+    window.append(np.arange(23, dtype=np.float32))   # 13〜22 が残っている
+    n = 4
+    assert np.array_equal(window.latest_until(n, 23), [19, 20, 21, 22])
+    # まだ追記していない位置は直近の窓
+    assert np.array_equal(window.latest_until(n, 30), [19, 20, 21, 22])
+    # 残っている最も古い窓と、それより古い位置
+    assert np.array_equal(window.latest_until(n, 17), [13, 14, 15, 16])
+    assert np.array_equal(window.latest_until(n, 16), [13, 14, 15, 16])
+    assert np.array_equal(window.latest_until(n, -5), [13, 14, 15, 16])
+    assert np.array_equal(window.latest_until(n, 18), [14, 15, 16, 17])
+    assert np.array_equal(window.latest_until(LENGTH, 20), np.arange(13, 23))
+
+
+def test_latest_until_before_filled():
+    """追記が length に満たない間は、開始前を fill として扱う"""
+    window = RollingWindow(LENGTH, fill=-1)
+    window.append(np.arange(3, dtype=np.float32))
+    assert np.array_equal(window.latest_until(4, 3), [-1, 0, 1, 2])
+    assert np.array_equal(window.latest_until(4, 1), [-1, -1, -1, 0])
+    assert np.array_equal(window.latest_until(4, 0), [-1, -1, -1, -1])
+    window.reset()
+    assert window.count == 0
+    assert np.all(window.view() == -1)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from config import *
+from scheduler import InferenceScheduler
+from surface_recognition.features import StreamingPCEN
+
+ONSET = 300
+
+
+def _run(scheduler, total, chunk, onsets=()):
+    """chunk フレームずつ進め、その範囲の onset を渡して poll() の結果をすべて返す"""
+    fired = []
+    for start in range(0, total, chunk):
+        count = min(chunk, total - start)
+        scheduler.push_frames(count, [o for o in onsets if start <= o < start + count])
+        due = scheduler.poll()
+        while due is not None:
+            fired.append(due)
+            due = scheduler.poll()
+    return fired
+
+
+@pytest.mark.parametrize("chunk", [1, 4, 13, 64])
+def test_onset_window_end_does_not_depend_on_chunking(chunk):
+    scheduler = InferenceScheduler()
+    assert scheduler.delay_frames == round(INFERENCE_ONSET_DELAY / HOP_LENGTH)
+    fired = _run(scheduler, 600, chunk, [ONSET])
+    assert [end for reason, end in fired if reason == "onset"] == [ONSET + scheduler.delay_frames]
+    # 定期実行は onset の推論から interval 後に数え直す
+    ends = [end for _, end in fired]
+    onset_at = ends.index(ONSET + scheduler.delay_frames)
+    if onset_at + 1 < len(ends):
+        assert ends[onset_at + 1] == ONSET + scheduler.delay_frames + scheduler.interval_frames
+
+
+def test_second_onset_while_pending_is_merged():
+    scheduler = InferenceScheduler()
+    fired = _run(scheduler, 600, 8, [ONSET, ONSET + 10])
+    assert [end for reason, end in fired if reason == "onset"] == [ONSET + scheduler.delay_frames]
+    assert scheduler.fired["onset"] == 1
+
+
+def test_onset_lands_at_the_same_column_of_the_window():
+    """
+    onset_delay 後の窓では、受信の区切り方によらずタップが窓の決まった列 (fixed_width - delay_frames) に来る
+    PCEN は立ち上がりを強調するので、最大になるのはクリックが最初に掛かるその1つ前のフレーム
+    """
+    scheduler = InferenceScheduler()
+    windows = []
+    audio = np.zeros(SAMPLE_RATE * 4, dtype=FLOAT_DTYPE)
+    audio[ONSET * HOP_LENGTH] = 1.0   # フレーム ONSET の中心のクリック
+    for chunk in (500, 1024, 2999):
+        pcen = StreamingPCEN()
+        scheduler.reset()
+        ends = []
+        for i in range(0, len(audio), chunk):
+            pcen.push(audio[i:i + chunk])
+            frames = pcen.frames_total - scheduler.frames
+            scheduler.push_frames(frames, [ONSET] if scheduler.frames <= ONSET < pcen.frames_total else [])
+            due = scheduler.poll()
+            while due is not None:
+                if due[0] == "onset":
+                    ends.append(due[1])
+                due = scheduler.poll()
+        assert ends == [ONSET + scheduler.delay_frames]
+        windows.append(pcen.features(ends[0]))
+        column = int(np.argmax(windows[-1].sum(axis=0)))
+        assert column == pcen.fixed_width - scheduler.delay_frames - 1
+    for window in windows[1:]:
+        assert np.allclose(window, windows[0], atol=1e-4)
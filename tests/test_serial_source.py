@@ -0,0 +1,97 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from serial_source import SYNC_WORD, SerialSource, encode_sync_frame
+
+pytest.importorskip("serial")
+
+FRAME_BYTES = 16
+
+
+@pytest.fixture
+def pty_source():
+    """pty の slave 側をシリアルポートとして開いた SerialSource を作る (master 側が ESP32 の代わり)"""
+    master, slave = os.openpty()
+    sources = []
+    def make(framing):
+        source = SerialSource(os.ttyname(slave), framing=framing, frame_bytes=FRAME_BYTES)
+        source.open()
+        sources.append(source)
+        return source
+    yield master, make
+    for source in sources:
+        source.close()
+    os.close(master)
+    os.close(slave)
+
+
+def _read(source, count, timeout=2.0):
+    """count 個のフレームが揃うまで読み出す (返されたビューはコピーしておく)"""
+    frames = []
+    deadline = time.monotonic() + timeout
+    while len(frames) < count and time.monotonic() < deadline:
+        frames.extend(np.array(frame) for frame in source.read_frames())
+    return frames
+
+
+def test_sync_drops_bad_checksum_and_resyncs(pty_source):
+    master, make = pty_source
+    source = make("sync")
+    good1 = np.arange(8, dtype=np.int16)
+    bad = bytearray(encode_sync_frame(np.arange(100, 108, dtype=np.int16)))
+    bad[-1] ^= 0xFF   # チェックサムを壊す
+    good2 = np.arange(200, 216, dtype=np.int16)
+    # 起動直後のフレーム途中からの受信 (同期ワードの前のゴミ) も読み捨てられる
+    os.write(master, b"\x01\x02\x03" + encode_sync_frame(good1) + bytes(bad) + encode_sync_frame(good2))
+
+    frames = _read(source, 2)
+    assert len(frames) == 2
+    assert np.array_equal(frames[0], good1)
+    assert np.array_equal(frames[1], good2)
+    # 壊れたフレームで1回同期を失い、次の 0xA5 0x5A で同期し直す
+    assert source.resyncs == 1
+    assert source.parser.dropped_bytes == 3 + len(bad)
+    assert _read(source, 1, timeout=0.3) == []
+
+
+def test_sync_frame_split_across_reads(pty_source):
+    master, make = pty_source
+    source = make("sync")
+    pcm = np.arange(-8, 8, dtype=np.int16)
+    data = encode_sync_frame(pcm)
+    assert data.startswith(SYNC_WORD)
+
+    # ヘッダの途中とペイロードの途中で分けて届いてもフレームになる
+    os.write(master, data[:3])
+    assert source.read_frames() == []
+    os.write(master, data[3:11])
+    assert source.read_frames() == []
+    os.write(master, data[11:])
+    frames = _read(source, 1)
+    assert len(frames) == 1
+    assert np.array_equal(frames[0], pcm)
+    assert source.resyncs == 0
+
+
+def test_raw_odd_splits_keep_sample_boundaries(pty_source):
+    master, make = pty_source
+    source = make("raw")
+    # 上位・下位バイトが入れ替わると値が変わるよう負の値も混ぜる
+    pcm = (np.arange(FRAME_BYTES // 2 * 4, dtype=np.int16) - 10) * 257
+    data = pcm.tobytes()
+
+    frames = []
+    pos = 0
+    for size in (3, 5, 7, 1, 9, 11, 13):
+        os.write(master, data[pos:pos + size])
+        pos += size
+        frames.extend(np.array(f) for f in source.read_frames())
+    os.write(master, data[pos:])
+    frames.extend(_read(source, 4 - len(frames)))
+
+    assert len(frames) == 4
+    assert all(frame.shape == (FRAME_BYTES // 2,) for frame in frames)
+    assert np.array_equal(np.concatenate(frames), pcm)
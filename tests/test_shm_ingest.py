@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+import shm_ingest
+from config import *
+from shm_ingest import SharedSampleRing
+
+DEVICE = f"test-{os.getpid()}"
+
+
+@pytest.fixture
+def writer():
+    ring = SharedSampleRing(DEVICE, capacity=1024, max_write=64, create=True)
+    yield ring
+    ring.close()
+
+
+@pytest.fixture
+def tracked(monkeypatch):
+    """resource_tracker への登録・解除を記録する (実際の tracker プロセスには送らない)"""
+    names = []
+    monkeypatch.setattr(shm_ingest.resource_tracker, "register", lambda name, kind: names.append(name))
+    monkeypatch.setattr(shm_ingest.resource_tracker, "unregister", lambda name, kind: names.remove(name))
+    return names
+
+
+def test_reader_is_not_tracked_and_does_not_unlink(writer, tracked):
+    pcm = np.arange(100, dtype=DTYPE)
+    writer.write(pcm)
+    reader = SharedSampleRing(DEVICE)
+    # 読み出し側は resource_tracker に残らない (終了時に共有メモリを消さない)
+    assert tracked == []
+    data, cursor = reader.read(0, scale=None)
+    assert np.array_equal(data, pcm)
+    assert cursor == 100
+    reader.close()
+
+    # 読み出し側を閉じても共有メモリは残り、書き込み側の続きを読める
+    writer.write(pcm[:10])
+    reader = SharedSampleRing(DEVICE)
+    data, _ = reader.read(cursor, scale=None)
+    assert np.array_equal(data, pcm[:10])
+    reader.close()
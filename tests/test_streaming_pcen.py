@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from config import *
+from signal_process import STFTFrames
+from surface_recognition.features import StreamingPCEN, extract_pcen
+
+# StreamingPCEN はモデルの学習に使った extract_pcen (2 秒の窓ごとの計算) と同じ特徴量を返すこと
+WINDOW = SAMPLE_RATE * 2
+TOLERANCE = 1e-4           # 2 秒の窓が揃った後
+STARTUP_TOLERANCE = 1e-2   # 窓の大半がゼロの間 (ほぼ無音の列で float32 の丸めが目立つ)
+
+
+@pytest.fixture
+def audio():
+    """DC オフセット付きの定常ノイズに、途中から 300 Hz の音が重なる 6 秒の信号"""
+    rng = np.random.default_rng(1)
+    t = np.arange(SAMPLE_RATE * 6)
+    tone = 0.1 * np.sin(2 * np.pi * 300 * t / SAMPLE_RATE) * (t > SAMPLE_RATE * 3)
+    return (rng.standard_normal(len(t)) * 0.05 + 0.02 + tone).astype(FLOAT_DTYPE)
+
+
+def _reference(audio, end):
+    """フレーム番号 end の直前までの窓を、ストリーム開始前をゼロで埋めたバッファから extract_pcen で計算する"""
+    padded = np.concatenate([np.zeros(WINDOW, dtype=FLOAT_DTYPE), audio])
+    start = WINDOW + (end - 188) * HOP_LENGTH
+    return extract_pcen(padded[start:start + WINDOW])
+
+
+@pytest.mark.parametrize("chunk", [100, 777, 3001])
+def test_matches_extract_pcen(audio, chunk):
+    pcen = StreamingPCEN()
+    worst = startup_worst = 0.0
+    checked = set()
+    for i in range(0, len(audio), chunk):
+        pcen.push(audio[i:i + chunk])
+        total = pcen.frames_total
+        if total == 0:
+            assert pcen.features() is None
+        if total == 0 or total % 6 or total in checked:
+            continue
+        checked.add(total)
+        # 直近の窓と、スケジューラが少し前の end を指定した場合の窓
+        for end in {total, max(total - 40, 1)}:
+            error = np.abs(pcen.features(end) - _reference(audio, end)).max()
+            if end >= 188:
+                worst = max(worst, error)
+            else:
+                startup_worst = max(startup_worst, error)
+    assert worst < TOLERANCE
+    assert startup_worst < STARTUP_TOLERANCE
+
+
+def test_shared_stft_frames(audio):
+    """表示と共有する STFTFrames の出力を push_frames() で渡しても同じ特徴量になる"""
+    stft = STFTFrames()
+    shared = StreamingPCEN()
+    own = StreamingPCEN()
+    for i in range(0, len(audio), 1000):
+        chunk = audio[i:i + 1000]
+        shared.push_frames(stft.push(chunk), chunk)
+        own.push(chunk)
+    assert shared.frames_total == own.frames_total
+    assert np.array_equal(shared.features(), own.features())
+    assert np.abs(shared.features() - _reference(audio, shared.frames_total)).max() < TOLERANCE
+
+
+def test_old_end_is_clamped_to_max_lag(audio):
+    pcen = StreamingPCEN(max_lag=10)
+    pcen.push(audio)
+    oldest = pcen.frames_total - 10
+    assert np.array_equal(pcen.features(0), pcen.features(oldest))
+    assert np.abs(pcen.features(0) - _reference(audio, oldest)).max() < TOLERANCE
+
+
+def test_reset_starts_a_new_stream(audio):
+    pcen = StreamingPCEN()
+    assert pcen.features() is None
+    pcen.push(audio[:SAMPLE_RATE])
+    pcen.reset()
+    pcen.push(audio[:SAMPLE_RATE // 2])
+    error = np.abs(pcen.features() - _reference(audio, pcen.frames_total)).max()
+    assert error < STARTUP_TOLERANCE
@@ -0,0 +1,128 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+import tcp
+from config import *
+from tcp import ReconnectingTCPSource
+
+FRAME_SAMPLES = 8
+FRAME_BYTES = FRAME_SAMPLES * 2
+
+
+def _frame(value):
+    return np.full(FRAME_SAMPLES, value, dtype=np.int16).tobytes()
+
+
+class DroppingServer:
+    """
+    ESP32 の代わりのローカル TCP サーバ
+    1本目の接続ではフレームの途中まで送って切断し、2本目の接続では続けてフレームを送る
+    """
+    def __init__(self, payloads):
+        self.payloads = payloads
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        for i, payload in enumerate(self.payloads):
+            conn, _ = self.listener.accept()
+            conn.sendall(payload)
+            if i == len(self.payloads) - 1:
+                # 最後の接続はテストが読み終わるまで開いておく
+                self.done.wait(5.0)
+            conn.close()
+
+    def close(self):
+        self.done.set()
+        self.thread.join(timeout=1.0)
+        self.listener.close()
+
+
+@pytest.fixture
+def getaddrinfo_calls(monkeypatch):
+    """名前解決の回数を数える (キャッシュも空にしておく)"""
+    calls = []
+    real = socket.getaddrinfo
+    def counting(*args, **kwargs):
+        calls.append(args[:2])
+        return real(*args, **kwargs)
+    monkeypatch.setattr(tcp, "_resolved_addrs", {})
+    monkeypatch.setattr(socket, "getaddrinfo", counting)
+    return calls
+
+
+@pytest.fixture
+def backoff_delays(monkeypatch):
+    """バックオフの待ち時間 (ジッタの上限) を記録し、実際には待たない"""
+    delays = []
+    def uniform(low, high):
+        delays.append(high)
+        return 0.0
+    monkeypatch.setattr(tcp.random, "uniform", uniform)
+    return delays
+
+
+def test_frames_realign_after_mid_frame_drop(getaddrinfo_calls):
+    # 1本目: フレーム1つと次のフレームの前半 (+奇数バイト) で切断 / 2本目: 新しいフレーム2つ
+    first = _frame(1) + _frame(2)[:FRAME_BYTES // 2 + 1]
+    second = _frame(3) + _frame(4)
+    server = DroppingServer([first, second])
+    reasons = []
+    reconnects = []
+    source = ReconnectingTCPSource("127.0.0.1", server.port, frame_bytes=FRAME_BYTES,
+                                   on_connected=reconnects.append,
+                                   on_disconnected=reasons.append)
+    try:
+        received = []
+        for _ in range(20):
+            frames = source.read_frames()
+            received.extend(frames.copy())
+            if len(received) == 3:
+                break
+        assert len(reasons) == 1
+        # 切断前の端数は捨てられ、再接続後のフレームは境界が揃っている
+        assert [frame[0] for frame in received] == [1, 3, 4]
+        for frame in received:
+            assert np.all(frame == frame[0])
+        assert source.connects == 2
+        assert reconnects[0] is None
+        assert reconnects[1] == source.last_reconnect_time
+        assert source.reconnect_times == [source.last_reconnect_time]
+        # 再接続ではキャッシュしたアドレスを使い、名前解決し直さない
+        assert getaddrinfo_calls == [("127.0.0.1", server.port)]
+    finally:
+        source.close()
+        server.close()
+
+
+def test_backoff_grows_and_re_resolves_after_failures(getaddrinfo_calls, backoff_delays):
+    # 閉じたポートへの接続は即座に拒否される
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    source = ReconnectingTCPSource("127.0.0.1", port, frame_bytes=FRAME_BYTES)
+
+    attempts = 8
+    def stop_after_attempts(timeout):
+        if len(backoff_delays) >= attempts:
+            source._stop.set()
+    source._stop.wait = stop_after_attempts
+
+    assert source.connect() is False
+    assert source.connects == 0
+    assert len(backoff_delays) == attempts
+    # 待ち時間の上限は失敗ごとに倍になり、TCP_BACKOFF_MAX で頭打ちになる
+    expected = [min(TCP_BACKOFF_INITIAL * 2 ** i, TCP_BACKOFF_MAX) for i in range(attempts)]
+    assert backoff_delays == pytest.approx(expected)
+    assert backoff_delays[-1] == TCP_BACKOFF_MAX
+    # 最初の TCP_RESOLVE_AFTER_FAILURES 回はキャッシュを使い、それ以降は毎回引き直す
+    assert len(getaddrinfo_calls) == 1 + attempts - TCP_RESOLVE_AFTER_FAILURES
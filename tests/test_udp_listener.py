@@ -0,0 +1,67 @@
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from config import NORM_FACTOR
+from packet import encode_packet
+from ring_buffer import SampleRing
+from udp import UDPListener
+
+MAX_WRITE = 64
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def listen():
+    """書き込み枠が MAX_WRITE サンプルのリングで UDPListener を起動し、送信用の関数を返す"""
+    listeners = []
+    def make(packet_format):
+        port = _free_udp_port()
+        ring = SampleRing(capacity=1024, max_write=MAX_WRITE)
+        listener = UDPListener({"dev": port}, packet_format=packet_format, rings={"dev": ring}, capture_path="")
+        listener.start()
+        listeners.append(listener)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        def send(packets):
+            for packet in packets:
+                sock.sendto(packet, ("127.0.0.1", port))
+            deadline = time.monotonic() + 2.0
+            while listener.get_stats()["rx_packets"] < len(packets) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            sock.close()
+        return listener, send
+    yield make
+    for listener in listeners:
+        listener.stop()
+
+
+def test_truncated_raw_packet_is_dropped(listen):
+    listener, send = listen("raw")
+    small = np.arange(MAX_WRITE, dtype=np.int16)
+    send([small.tobytes(), np.ones(MAX_WRITE + 1, dtype=np.int16).tobytes(), small.tobytes()])
+    # 切り詰められたパケットは途中まで書き込まずに捨てる
+    assert np.array_equal(listener.get_data("dev"), np.concatenate([small, small]) / NORM_FACTOR)
+    assert listener.get_stats()["truncated_packets"] == 1
+
+
+def test_truncated_v2_packet_is_dropped_and_concealed(listen):
+    listener, send = listen("v2")
+    n = MAX_WRITE // 2
+    packets = [encode_packet(1, 0, 0, np.full(n, 100, dtype=np.int16)),
+               encode_packet(1, 1, n, np.full(MAX_WRITE + 1, 200, dtype=np.int16)),
+               encode_packet(1, 2, n + MAX_WRITE + 1, np.full(n, 300, dtype=np.int16))]
+    send(packets)
+    data = np.round(listener.get_data("dev") * NORM_FACTOR).astype(np.int16)
+    # 捨てたパケットの区間は欠落として埋められる (既定の conceal)
+    assert len(data) == 2 * n + MAX_WRITE + 1
+    assert np.all(data[:n] == 100) and np.all(data[-n:] == 300)
+    stats = listener.get_stats()
+    assert stats["truncated_packets"] == 1
+    assert stats["lost_packets"] == 1